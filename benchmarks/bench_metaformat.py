@@ -0,0 +1,94 @@
+"""Compares the whole buffer tokenizer of :mod:`lektor.metaformat` with the
+line by line tokenizer it replaced on a large generated ``contents.lr``.
+
+Run it with ``python benchmarks/bench_metaformat.py``.
+"""
+import io
+import timeit
+
+from lektor.metaformat import tokenize, _process_buf
+
+
+def tokenize_lines(iterable, interesting_keys=None, encoding=None):
+    """The line by line tokenizer from before, kept for comparison."""
+    key = []
+    buf = []
+    want_newline = False
+    is_interesting = True
+
+    def _flush_item():
+        the_key = key[0]
+        if not is_interesting:
+            value = None
+        else:
+            value = _process_buf(buf)
+        del key[:], buf[:]
+        return the_key, value
+
+    if encoding is not None:
+        iterable = (x.decode(encoding, 'replace') for x in iterable)
+
+    for line in iterable:
+        line = line.rstrip(u'\r\n') + u'\n'
+
+        if line.rstrip() == u'---':
+            want_newline = False
+            if key:
+                yield _flush_item()
+        elif key:
+            if want_newline:
+                want_newline = False
+                if not line.strip():
+                    continue
+            if is_interesting:
+                buf.append(line)
+        else:
+            bits = line.split(u':', 1)
+            if len(bits) == 2:
+                key = [bits[0].strip()]
+                if interesting_keys is None:
+                    is_interesting = True
+                else:
+                    is_interesting = key[0] in interesting_keys
+                if is_interesting:
+                    first_bit = bits[1].strip(u'\t ')
+                    if first_bit.strip():
+                        buf = [first_bit]
+                    else:
+                        buf = []
+                        want_newline = True
+
+    if key:
+        yield _flush_item()
+
+
+def make_contents(fields=50, body_lines=2000):
+    rv = [u'_model: page\n']
+    for idx in range(fields):
+        rv.append(u'---\nfield%d: Value number %d\n' % (idx, idx))
+    rv.append(u'---\nbody:\n\n')
+    for idx in range(body_lines):
+        rv.append(u'Line %d of the body with some text äöü.\n'
+                  % idx)
+    return u''.join(rv).encode('utf-8')
+
+
+def main():
+    data = make_contents()
+    cases = [
+        ('all keys', None),
+        ('one key', set(['field0'])),
+    ]
+    print('%d KB of contents' % (len(data) // 1024))
+    for label, keys in cases:
+        assert list(tokenize(io.BytesIO(data), keys, 'utf-8')) == \
+            list(tokenize_lines(io.BytesIO(data), keys, 'utf-8'))
+        for name, func in [('lines', tokenize_lines), ('buffer', tokenize)]:
+            seconds = min(timeit.repeat(
+                lambda: list(func(io.BytesIO(data), keys, 'utf-8')),
+                number=20, repeat=5)) / 20
+            print('%-8s %-8s %.3f ms' % (label, name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
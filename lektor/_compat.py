@@ -29,6 +29,7 @@ if PY2:
     iteritems = lambda d: d.iteritems()
 
     from cStringIO import StringIO as BytesIO, StringIO
+    from collections import MutableMapping
     import Queue as queue
     NativeStringIO = BytesIO
 
@@ -47,6 +48,7 @@ else:
     iteritems = lambda d: iter(d.items())
 
     from io import BytesIO, StringIO
+    from collections.abc import MutableMapping
     import queue
     NativeStringIO = StringIO
 
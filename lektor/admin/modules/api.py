@@ -119,7 +119,7 @@ def find():
     alt = request.values.get('alt') or PRIMARY_ALT
     lang = request.values.get('lang') or g.admin_context.info.ui_lang
     q = request.values.get('q')
-    builder = current_app.lektor_info.get_builder()
+    builder = current_app.lektor_info.get_builder(g.admin_context.pad)
     return jsonify(
         results=builder.find_files(q, alt=alt, lang=lang)
     )
@@ -286,7 +286,7 @@ def get_servers():
 
 @bp.route('/build', methods=['POST'])
 def trigger_build():
-    builder = current_app.lektor_info.get_builder()
+    builder = current_app.lektor_info.get_builder(g.admin_context.pad)
     builder.build_all()
     builder.prune()
     return jsonify(okay=True)
@@ -294,7 +294,7 @@ def trigger_build():
 
 @bp.route('/clean', methods=['POST'])
 def trigger_clean():
-    builder = current_app.lektor_info.get_builder()
+    builder = current_app.lektor_info.get_builder(g.admin_context.pad)
     builder.prune(all=True)
     builder.touch_site_config()
     return jsonify(okay=True)
@@ -15,6 +15,7 @@ class AdminContext(object):
         self.admin_root = url_for('dash.index').rstrip('/')
         self.site_root = request.script_root
         self.info = current_app.lektor_info
+        self.pad_locked = False
 
     def get_temp_path(self, name=None):
         if name is None:
@@ -28,7 +29,11 @@ class AdminContext(object):
 
     @cached_property
     def pad(self):
-        return current_app.lektor_info.get_pad()
+        # The request holds the pad lock from the first use of the pad
+        # until it ends, see :func:`release_pad`.
+        self.info.pad_lock.acquire()
+        self.pad_locked = True
+        return self.info.get_pad()
 
     @cached_property
     def tree(self):
@@ -38,3 +43,11 @@ class AdminContext(object):
 @bp.before_app_request
 def find_common_info():
     g.admin_context = AdminContext()
+
+
+@bp.teardown_app_request
+def release_pad(exc):
+    ctx = g.get('admin_context')
+    if ctx is not None and ctx.pad_locked:
+        ctx.pad_locked = False
+        ctx.info.pad_lock.release()
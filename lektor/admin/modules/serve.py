@@ -125,20 +125,21 @@ def handle_build_failure(failure):
 
 def serve_up_artifact(path):
     li = current_app.lektor_info
-    pad = li.get_pad()
+    with li.pad_lock:
+        pad = li.get_pad()
 
-    artifact_name, filename = li.resolve_artifact('/' + path, pad)
-    if filename is None:
-        abort(404)
+        artifact_name, filename = li.resolve_artifact('/' + path, pad)
+        if filename is None:
+            abort(404)
 
-    if artifact_name is None:
-        artifact_name = path.strip('/')
+        if artifact_name is None:
+            artifact_name = path.strip('/')
 
-    # If there was a build failure for the given artifact, we want
-    # to render this instead of sending the (most likely missing or
-    # corrupted) file.
-    ctrl = li.get_failure_controller(pad)
-    failure = ctrl.lookup_failure(artifact_name)
+        # If there was a build failure for the given artifact, we want
+        # to render this instead of sending the (most likely missing or
+        # corrupted) file.
+        ctrl = li.get_failure_controller(pad)
+        failure = ctrl.lookup_failure(artifact_name)
     if failure is not None:
         return handle_build_failure(failure)
 
@@ -4,8 +4,7 @@ from flask import Flask, request, abort
 from flask.helpers import safe_join
 from werkzeug.utils import append_slash_redirect
 
-from lektor.db import Database
-from lektor.builder import Builder
+from lektor.builder import Builder, WatchBuilder
 from lektor.buildfailures import FailureController
 from lektor.admin.modules import register_modules
 from lektor.reporter import CliReporter
@@ -14,15 +13,29 @@ from lektor.reporter import CliReporter
 class LektorInfo(object):
 
     def __init__(self, env, output_path, ui_lang='en', extra_flags=None,
-                 verbosity=0):
+                 verbosity=0, watch_builder=None):
         self.env = env
         self.ui_lang = ui_lang
         self.output_path = output_path
         self.extra_flags = extra_flags
         self.verbosity = verbosity
+        # The watch builder keeps one pad warm across requests.  The dev
+        # server shares it with the background builder whose watcher
+        # invalidates it when sources change.
+        if watch_builder is None:
+            watch_builder = WatchBuilder(env, output_path,
+                                         extra_flags=extra_flags)
+        self.watch_builder = watch_builder
+
+    @property
+    def pad_lock(self):
+        """The pad is not thread safe.  This lock has to be held while
+        using it, which also keeps the background builder from rebuilding.
+        """
+        return self.watch_builder.lock
 
     def get_pad(self):
-        return Database(self.env).new_pad()
+        return self.watch_builder.pad
 
     def get_builder(self, pad=None):
         if pad is None:
@@ -79,11 +92,12 @@ class LektorInfo(object):
 class WebUI(Flask):
 
     def __init__(self, env, debug=False, output_path=None, ui_lang='en',
-                 verbosity=0, extra_flags=None):
+                 verbosity=0, extra_flags=None, watch_builder=None):
         Flask.__init__(self, 'lektor.admin', static_url_path='/admin/static')
         self.lektor_info = LektorInfo(env, output_path, ui_lang,
                                       extra_flags=extra_flags,
-                                      verbosity=verbosity)
+                                      verbosity=verbosity,
+                                      watch_builder=watch_builder)
         self.debug = debug
         self.config['PROPAGATE_EXCEPTIONS'] = True
 
@@ -11,11 +11,19 @@ def get_asset(pad, filename, parent=None):
     if env.is_uninteresting_source_name(filename):
         return None
 
-    try:
-        stat_obj = os.stat(os.path.join(parent.source_filename, filename))
-    except OSError:
-        return None
-    if stat.S_ISDIR(stat_obj.st_mode):
+    path = os.path.join(parent.source_filename, filename)
+    snapshot = pad.db.fs_snapshot
+    st = snapshot.stat(path) if snapshot is not None else None
+    if st is not None:
+        if st[1] < 0:
+            return None
+        is_dir = st[2]
+    else:
+        try:
+            is_dir = stat.S_ISDIR(os.stat(path).st_mode)
+        except OSError:
+            return None
+    if is_dir:
         return Directory(pad, filename, parent=parent)
 
     ext = os.path.splitext(filename)[1]
@@ -98,7 +106,7 @@ class Directory(Asset):
     @property
     def children(self):
         try:
-            files = os.listdir(self.source_filename)
+            files = self.pad.db.listdir(self.source_filename)
         except OSError:
             return
 
@@ -83,6 +83,7 @@ class BuildProgram(object):
         self.produce_artifacts()
 
         sub_artifacts = []
+        all_sub_artifacts = []
         failures = []
 
         gen = self.build_state.builder
@@ -93,6 +94,7 @@ class BuildProgram(object):
                     failures.append(ctx.exc_info)
                 else:
                     sub_artifacts.extend(ctx.sub_artifacts)
+                    all_sub_artifacts.extend(ctx.sub_artifacts)
 
         # Step one is building the artifacts that this build program
         # knows about.
@@ -105,6 +107,19 @@ class BuildProgram(object):
             artifact, build_func = sub_artifacts.pop()
             _build(artifact, build_func)
 
+        # Thumbnails might still be generated in the background.  Wait for
+        # them so that they are finished when the source is.  The
+        # artifacts they were written for already reported their failures.
+        if gen.thumbnail_pool is not None:
+            failures.extend(exc_info for _artifact, exc_info
+                            in gen.thumbnail_pool.join())
+
+        # A thumbnail batch can give sub artifacts a new file before they
+        # are built.  If they were skipped after a failure or as current
+        # after all, that file has to go away.
+        for artifact, _build_func in all_sub_artifacts:
+            artifact.discard()
+
         # If we failed anywhere we want to mark *all* artifacts as dirty.
         # This means that if a sub-artifact failes we also rebuild the
         # parent next time around.
@@ -213,7 +228,7 @@ class PageBuildProgram(BuildProgram):
         if pagination_enabled:
             if self.source.page_num is None:
                 child_sources.append(self._iter_paginated_children())
-                pq = p_config.get_pagination_query(self.source)
+                pq = p_config.get_pagination_items(self.source)
                 child_sources.append(set(all_children) - set(pq))
                 child_sources.append(self.source.attachments)
             else:
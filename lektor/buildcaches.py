@@ -0,0 +1,786 @@
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import hashlib
+import tempfile
+
+from jinja2.utils import LRUCache
+
+from lektor._compat import iteritems, string_types, text_type
+from lektor.imagetools import EXIFInfo, get_image_info, read_exif
+from lektor.utils import portable_popen, replace_file
+
+
+def _describe_fs_path_for_checksum(path):
+    """Given a file system path this returns a basic description of what
+    this is.  This is used for checksum hashing on directories.
+    """
+    # This is not entirely correct as it does not detect changes for
+    # contents from alternatives.  However for the moment it's good
+    # enough.
+    if os.path.isfile(path):
+        return b'\x01'
+    if os.path.isfile(os.path.join(path, 'contents.lr')):
+        return b'\x02'
+    if os.path.isdir(path):
+        return b'\x03'
+    return b'\x00'
+
+
+def _sha1():
+    return hashlib.sha1()
+
+
+def _blake2b():
+    # Same digest size as SHA-1 so the checksums look alike.
+    return hashlib.blake2b(digest_size=20)
+
+
+def _xxhash():
+    import xxhash  # pylint: disable=import-error
+    return xxhash.xxh64()
+
+
+checksum_algorithms = {
+    'sha1': _sha1,
+    'xxhash': _xxhash,
+}
+if hasattr(hashlib, 'blake2b'):
+    checksum_algorithms['blake2b'] = _blake2b
+
+
+def get_checksum_hash(algorithm):
+    """Returns a function that creates a new hash object for one of the
+    :data:`checksum_algorithms`.
+    """
+    rv = checksum_algorithms.get(algorithm)
+    if rv is None:
+        raise RuntimeError('Unknown checksum algorithm %r.  Supported are: '
+                           '%s' % (algorithm,
+                                   ', '.join(sorted(checksum_algorithms))))
+    try:
+        rv()
+    except ImportError:
+        raise RuntimeError('The %r checksum algorithm requires the %r '
+                           'package.' % (algorithm, algorithm))
+    return rv
+
+
+def compute_checksum(env, filename, new_hash=_sha1):
+    """Calculates the checksum of a file or directory.  For a directory
+    this hashes a description of its contents.
+    """
+    try:
+        h = new_hash()
+        if os.path.isdir(filename):
+            h.update(b'DIR\x00')
+            for child in sorted(os.listdir(filename)):
+                if env.is_uninteresting_source_name(child):
+                    continue
+                if isinstance(child, text_type):
+                    child = child.encode('utf-8')
+                h.update(child)
+                h.update(_describe_fs_path_for_checksum(
+                    os.path.join(filename, child.decode('utf-8'))))
+                h.update(b'\x00')
+        else:
+            with open(filename, 'rb') as f:
+                while 1:
+                    chunk = f.read(16 * 1024)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+        return h.hexdigest()
+    except (OSError, IOError):
+        return '0' * 40
+
+
+def _get_mtime_ns(st):
+    rv = getattr(st, 'st_mtime_ns', None)
+    if rv is None:
+        rv = int(st.st_mtime * 1e9)
+    return rv
+
+
+class FileStatCache(object):
+    """Base class of the caches that remember something about source files
+    in a table of the build state.  An entry is reused for as long as the
+    inode, size and modification time of the file stay the same.
+
+    The table has the columns ``path``, ``inode``, ``size`` and
+    ``mtime_ns`` followed by the :attr:`columns` of the subclass.  Entries
+    are loaded lazily and are lists of the inode, size and modification
+    time followed by the values of these columns.
+    """
+
+    #: Files modified more recently than this many seconds ago are not
+    #: remembered as they could still change within the precision of the
+    #: file system's timestamps.
+    racy_window = 2
+
+    #: The build state table of the cache.
+    table = None
+
+    #: The columns of the table after the key columns.
+    columns = ()
+
+    def __init__(self, builder):
+        self.builder = builder
+        self._entries = None
+
+    def _get_scope(self):
+        """Returns a dictionary of column values that all entries of this
+        cache share.  Only entries with these values are loaded.
+        """
+        return {}
+
+    def _load_entries(self):
+        scope = sorted(self._get_scope().items())
+        where = ''
+        if scope:
+            where = ' where ' + ' and '.join('%s = ?' % k for k, _ in scope)
+        con = self.builder.connect_to_database()
+        try:
+            cur = con.cursor()
+            cur.execute('select %s from %s%s' % (
+                ', '.join(('path', 'inode', 'size', 'mtime_ns') +
+                          tuple(self.columns)),
+                self.table, where), [v for _, v in scope])
+            return dict((row[0], list(row[1:])) for row in cur.fetchall())
+        finally:
+            con.close()
+
+    def _stat_key(self, filename):
+        """Returns the key of a file and its stat result.  The key is `None`
+        if the file cannot be remembered.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None, None
+        return (st.st_ino, st.st_size, _get_mtime_ns(st)), st
+
+    def _get_entry(self, key, filename):
+        """Returns the entry of a file if it has the given key."""
+        if key is None:
+            return None
+        if self._entries is None:
+            self._entries = self._load_entries()
+        entry = self._entries.get(filename)
+        if entry is None or tuple(entry[:3]) != key:
+            return None
+        return entry
+
+    def _is_racy(self, st):
+        return time.time() - st.st_mtime <= self.racy_window
+
+    def _remember(self, key, filename, values):
+        """Remembers the column values for a file with the given key."""
+        if self._entries is None:
+            self._entries = self._load_entries()
+        self._entries[filename] = list(key + tuple(values))
+        scope = sorted(self._get_scope().items())
+        names = ['path'] + [k for k, _ in scope] + \
+            ['inode', 'size', 'mtime_ns'] + list(self.columns)
+        con = self.builder.connect_to_database()
+        try:
+            con.execute('insert or replace into %s (%s) values (%s)' % (
+                self.table, ', '.join(names), ', '.join(['?'] * len(names))),
+                [filename] + [v for _, v in scope] + list(key) + list(values))
+            con.commit()
+        finally:
+            con.close()
+
+    def prune(self):
+        """Forgets about files that no longer exist."""
+        con = self.builder.connect_to_database()
+        try:
+            cur = con.cursor()
+            cur.execute('select path from %s' % self.table)
+            missing = [(path,) for path, in cur.fetchall()
+                       if not os.path.exists(path)]
+            if missing:
+                cur.executemany('delete from %s where path = ?' % self.table,
+                                missing)
+                con.commit()
+        finally:
+            con.close()
+        if self._entries is not None:
+            for path, in missing:
+                self._entries.pop(path, None)
+
+
+class ChecksumCache(FileStatCache):
+    """Remembers the checksums of source files in the build state so that
+    unchanged files are not read again in later builds.
+
+    Directories are not remembered as the type of their entries can
+    change without affecting the directory's modification time.
+    """
+
+    table = 'checksums'
+    columns = ('checksum',)
+
+    def __init__(self, builder, algorithm='sha1'):
+        FileStatCache.__init__(self, builder)
+        self.algorithm = algorithm
+        self.new_hash = get_checksum_hash(algorithm)
+
+    def _get_scope(self):
+        return {'algorithm': self.algorithm}
+
+    def _stat_key(self, filename):
+        key, st = FileStatCache._stat_key(self, filename)
+        if st is not None and stat.S_ISDIR(st.st_mode):
+            return None, st
+        return key, st
+
+    def get_checksum(self, env, filename):
+        """Returns the checksum of a file, reading it only if necessary."""
+        key, st = self._stat_key(filename)
+        entry = self._get_entry(key, filename)
+        if entry is not None:
+            return entry[3]
+
+        checksum = compute_checksum(env, filename, self.new_hash)
+        if key is not None and self._stat_key(filename)[0] == key and \
+           not self._is_racy(st):
+            self._remember(key, filename, (checksum,))
+        return checksum
+
+
+class RecordIndex(FileStatCache):
+    """Remembers the tokenized contents of record files in the build state
+    so that later builds do not have to parse unchanged files again.
+
+    The database consults the index in :meth:`Database.load_tokens` while
+    the builder has its pooled connection open in the same thread.
+    """
+
+    table = 'raw_records'
+    columns = ('data',)
+
+    def get_tokens(self, filename):
+        """Returns the ``(key, value)`` pairs of a record file if they are
+        known and the file did not change since, otherwise `None`.
+        """
+        entry = self._get_entry(self._stat_key(filename)[0], filename)
+        if entry is None:
+            return None
+        if isinstance(entry[3], string_types):
+            entry[3] = [tuple(x) for x in json.loads(entry[3])]
+        return entry[3]
+
+    def remember(self, filename, tokens):
+        """Remembers the ``(key, value)`` pairs of a record file that was
+        just read.
+        """
+        key, st = self._stat_key(filename)
+        if key is None or self._is_racy(st):
+            return
+        self._remember(key, filename, (json.dumps(tokens),))
+        self._entries[filename][3] = tokens
+
+
+class ImageInfoCache(FileStatCache):
+    """Remembers the format, dimensions and EXIF data of images in the
+    build state so that later builds do not have to read the image headers
+    again.  EXIF data is only remembered once it was asked for.
+
+    The database consults the cache in :meth:`Database.get_image_info` and
+    :meth:`Database.read_exif` while the builder has its pooled connection
+    open in the same thread.
+    """
+
+    table = 'image_info'
+    columns = ('format', 'width', 'height', 'exif')
+
+    def get_image_info(self, filename):
+        """Returns the format, width and height of an image like
+        :func:`lektor.imagetools.get_image_info`.
+        """
+        key, st = self._stat_key(filename)
+        entry = self._get_entry(key, filename)
+        if entry is not None:
+            return tuple(entry[3:6])
+        with open(filename, 'rb') as f:
+            rv = get_image_info(f)
+        if key is not None and not self._is_racy(st):
+            self._remember(key, filename, tuple(rv) + (None,))
+        return rv
+
+    def read_exif(self, filename):
+        """Returns the EXIF data of an image like
+        :func:`lektor.imagetools.read_exif`.
+        """
+        key, st = self._stat_key(filename)
+        entry = self._get_entry(key, filename)
+        if entry is not None and entry[6] is not None:
+            if isinstance(entry[6], string_types):
+                entry[6] = EXIFInfo.from_json(json.loads(entry[6]))
+            return entry[6]
+        with open(filename, 'rb') as f:
+            rv = read_exif(f)
+            if entry is not None:
+                info = tuple(entry[3:6])
+            else:
+                f.seek(0)
+                info = tuple(get_image_info(f))
+        if key is not None and not self._is_racy(st):
+            self._remember(key, filename,
+                           info + (json.dumps(rv.to_json()),))
+        return rv
+
+
+class MarkdownCache(object):
+    """Remembers rendered markdown across contexts and builds.  Recently
+    used entries are kept in memory and all entries are stored in the
+    build state, which is pruned down to the `size` most recently used
+    ones.  See :func:`lektor.markdown.markdown_to_html` for how the keys
+    are computed.
+    """
+
+    def __init__(self, builder, size):
+        self.builder = builder
+        self.size = size
+        self._memory = LRUCache(min(size, 1000))
+        self._touched = set()
+        self._now = int(time.time())
+
+    def get(self, key):
+        """Returns ``(html, dependencies)`` for a key or `None`."""
+        rv = self._memory.get(key)
+        if rv is not None:
+            return rv
+        con = self.builder.connect_to_database()
+        try:
+            cur = con.cursor()
+            cur.execute('''
+                select html, dependencies from markdown_cache where key = ?
+            ''', [key])
+            row = cur.fetchone()
+            if row is None:
+                return None
+            if key not in self._touched:
+                self._touched.add(key)
+                cur.execute('''
+                    update markdown_cache set last_used = ? where key = ?
+                ''', [self._now, key])
+                con.commit()
+        finally:
+            con.close()
+        rv = row[0], json.loads(row[1])
+        self._memory[key] = rv
+        return rv
+
+    def put(self, key, html, dependencies):
+        """Remembers the HTML of a render and the source files it depended
+        on.
+        """
+        self._memory[key] = html, dependencies
+        self._touched.add(key)
+        con = self.builder.connect_to_database()
+        try:
+            con.execute('''
+                insert or replace into markdown_cache
+                    (key, html, dependencies, last_used)
+                    values (?, ?, ?, ?)
+            ''', [key, html, json.dumps(dependencies), self._now])
+            con.commit()
+        finally:
+            con.close()
+
+    def prune(self):
+        """Forgets about all but the most recently used entries."""
+        con = self.builder.connect_to_database()
+        try:
+            con.execute('''
+                delete from markdown_cache where key not in (
+                    select key from markdown_cache
+                     order by last_used desc limit ?)
+            ''', [self.size])
+            con.commit()
+        finally:
+            con.close()
+
+
+class ArtifactIndex(object):
+    """An in-memory copy of the artifact tables of the build state.  A
+    build loads it upfront so that checking whether artifacts are current
+    does not require queries per artifact.  Artifacts that are updated
+    after loading are looked up in the database again.
+    """
+
+    def __init__(self):
+        self.dependencies = {}
+        self.config_hashes = {}
+        self.dirty_sources = set()
+        self.invalidated = set()
+
+    @classmethod
+    def load(cls, con):
+        """Loads the index from a build state connection."""
+        rv = cls()
+        cur = con.cursor()
+        try:
+            cur.execute('''
+                select artifact, source, source_mtime, source_size,
+                       source_checksum, is_dir
+                  from artifacts
+            ''')
+            for row in cur:
+                rv.dependencies.setdefault(row[0], []).append(row[1:])
+            cur.execute('''
+                select artifact, config_hash from artifact_config_hashes
+            ''')
+            rv.config_hashes.update(cur)
+            cur.execute('select source from dirty_sources')
+            rv.dirty_sources.update(x[0] for x in cur)
+        finally:
+            cur.close()
+        return rv
+
+    def knows(self, artifact_name):
+        """Checks if the index is still current for an artifact."""
+        return artifact_name not in self.invalidated
+
+    def invalidate(self, artifact_name):
+        """Marks an artifact as changed since loading the index."""
+        self.invalidated.add(artifact_name)
+
+
+class _PooledUnit(object):
+    """A unit of work on a :class:`PooledConnection`.  It runs inside its
+    own savepoint so rolling it back only discards its own changes and
+    leaves the other pending units alone.
+    """
+
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+        self.open = True
+        pool.con.execute('savepoint %s' % name)
+        pool.open_units += 1
+
+    def cursor(self):
+        return self.pool.con.cursor()
+
+    def execute(self, sql, args=()):
+        return self.pool.con.execute(sql, args)
+
+    def commit(self):
+        if self.open:
+            self.open = False
+            self.pool.con.execute('release %s' % self.name)
+            self.pool.open_units -= 1
+            self.pool.commit()
+
+    def rollback(self):
+        if self.open:
+            self.open = False
+            self.pool.con.execute('rollback to %s' % self.name)
+            self.pool.con.execute('release %s' % self.name)
+            self.pool.open_units -= 1
+
+    def close(self):
+        self.commit()
+
+
+class PooledConnection(object):
+    """Wraps the build state connection that is shared by everything that
+    happens during a build run.  Only every `commit_interval`-th commit,
+    the first commit after the transaction was open for `max_age` seconds
+    and an explicit :meth:`flush` actually commit, so many small updates
+    end up in a single transaction.  Every user of the connection gets
+    its own unit of work from :meth:`begin`.
+    """
+
+    def __init__(self, con, commit_interval, max_age=2.0):
+        self.con = con
+        self.commit_interval = commit_interval
+        self.max_age = max_age
+        self.pending_commits = 0
+        self.transaction_started = None
+        self.open_units = 0
+        self._units = 0
+
+    def begin(self):
+        """Starts a unit of work that is committed or rolled back on its
+        own.
+        """
+        if self.transaction_started is None:
+            self.con.execute('begin')
+            self.transaction_started = time.time()
+        self._units += 1
+        return _PooledUnit(self, 'unit%d' % self._units)
+
+    def cursor(self):
+        return self.con.cursor()
+
+    def execute(self, sql, args=()):
+        return self.con.execute(sql, args)
+
+    def commit(self):
+        self.pending_commits += 1
+        # Units that are still open would end up in the commit as well.
+        if self.open_units:
+            return
+        if self.pending_commits >= self.commit_interval or \
+           time.time() - self.transaction_started >= self.max_age:
+            self.flush()
+
+    def flush(self):
+        """Commits all pending changes."""
+        if self.transaction_started is not None:
+            self.con.commit()
+        self.transaction_started = None
+        self.pending_commits = 0
+
+
+class ProcessPool(object):
+    """Runs external programs in the background with at most `size` of
+    them running at the same time.  Programs are started with
+    :meth:`submit` and :meth:`join` waits for all of them.  Callbacks are
+    always invoked from the thread that submits or joins, so they are
+    free to touch the build state.
+
+    Programs can be started for artifacts, which are then not committed
+    before the program finished and fail if its callback fails.  See
+    :meth:`lektor.builder.Artifact.begin_job`.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._running = []
+        self._failures = []
+
+    def submit(self, cmdline, callback=None, artifacts=()):
+        """Starts a program.  If given, the callback is invoked with the
+        return code once the program finished.
+        """
+        while len(self._running) >= self.size:
+            self._reap(block=True)
+        proc = portable_popen(cmdline)
+        for artifact in artifacts:
+            artifact.begin_job()
+        self._running.append((proc, callback, artifacts))
+
+    def _finish(self, proc, callback, artifacts):
+        exc_info = None
+        if callback is not None:
+            try:
+                callback(proc.returncode)
+            except Exception:  # pylint: disable=broad-except
+                exc_info = sys.exc_info()
+        if exc_info is not None:
+            self._failures.extend((x, exc_info) for x in artifacts or (None,))
+        for artifact in artifacts:
+            artifact.finish_job(exc_info)
+
+    def _reap(self, block=False):
+        still_running = []
+        finished = []
+        for item in self._running:
+            if item[0].poll() is None:
+                still_running.append(item)
+            else:
+                finished.append(item)
+        if block and not finished:
+            finished.append(still_running.pop(0))
+            finished[0][0].wait()
+        self._running = still_running
+        for item in finished:
+            self._finish(*item)
+
+    def poll(self):
+        """Finishes the programs that exited without waiting for others."""
+        self._reap()
+
+    def join(self):
+        """Waits for all programs and returns ``(artifact, exc_info)``
+        tuples for all callbacks that failed since the last join.  The
+        artifact is `None` for programs that were not started for one.
+        """
+        while self._running:
+            self._reap(block=True)
+        rv = self._failures
+        self._failures = []
+        return rv
+
+
+def _link_or_copy(src, dst):
+    """Places a file at `dst` with the contents of `src`.  This is a hard
+    link if possible and a copy otherwise.  The destination is replaced
+    atomically, so files linked this way must never be written in place.
+    """
+    folder = os.path.dirname(dst)
+    try:
+        os.makedirs(folder)
+    except OSError:
+        pass
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=folder, prefix='.__trans', suffix=os.path.splitext(dst)[1])
+    os.close(fd)
+    try:
+        try:
+            os.remove(tmp_filename)
+            os.link(src, tmp_filename)
+        except (OSError, AttributeError):
+            shutil.copyfile(src, tmp_filename)
+        replace_file(tmp_filename, dst)
+    except Exception:
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+        raise
+
+
+class ThumbnailCache(object):
+    """A store of generated thumbnails outside of the build folder.
+    Thumbnails are addressed by a key that is computed from the contents
+    of the source and the thumbnail parameters, so they survive cleaning
+    the build and are shared between output paths.  See
+    :func:`lektor.imagetools.get_thumbnail_cache_key` for how the keys are
+    computed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_filename(self, key, ext):
+        """Returns the filename of the thumbnail with a key."""
+        return os.path.join(self.path, key[:2], key[2:] + ext)
+
+    def lookup(self, key, dst_filename):
+        """Places the cached thumbnail for a key at the destination.
+        Returns `False` if there is none.
+        """
+        filename = self.get_filename(key, os.path.splitext(dst_filename)[1])
+        if not os.path.isfile(filename):
+            return False
+        _link_or_copy(filename, dst_filename)
+        return True
+
+    def store(self, key, filename):
+        """Remembers a thumbnail for a key."""
+        _link_or_copy(filename, self.get_filename(
+            key, os.path.splitext(filename)[1]))
+
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+
+def _scan_dir(path):
+    """Lists a directory and stats its entries.  Yields tuples in the form
+    ``(name, stat_result)`` where the stat result is `None` if the entry
+    cannot be stated, as well as whether the entry is a symlink.
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                st = entry.stat()
+            except OSError:
+                st = None
+            yield entry.name, st, entry.is_symlink()
+        return
+    for name in os.listdir(path):
+        full_path = os.path.join(path, name)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            st = None
+        yield name, st, os.path.islink(full_path)
+
+
+class FileSystemSnapshot(object):
+    """Stats the source folders of a project once and remembers the
+    results.  File infos and directory listings for paths below these
+    folders can then be answered without further IO.  Like the path
+    cache, a snapshot must not be used after files were changed.
+    """
+
+    #: The folders of the project and of themes that are recorded.
+    folders = ('content', 'templates', 'models', 'flowblocks', 'assets')
+
+    def __init__(self):
+        self.stats = {}
+        self.listings = {}
+        self.entries = set()
+
+    @classmethod
+    def take(cls, env):
+        """Takes a snapshot of the project and theme folders of `env`."""
+        rv = cls()
+        for path in [env.root_path] + env.theme_paths:
+            rv.add_tree(os.path.abspath(path), only=cls.folders)
+        return rv
+
+    def add_tree(self, path, only=None):
+        """Records a directory and everything below it.  If `only` is
+        given, only those names are recursed into at the topmost level.
+        """
+        try:
+            root_mtime = int(os.stat(path).st_mtime)
+        except OSError:
+            return
+        dir_mtimes = {path: root_mtime}
+        stack = [(path, only)]
+        while stack:
+            dir_path, only = stack.pop()
+            try:
+                scanned = list(_scan_dir(dir_path))
+            except OSError:
+                continue
+            self.listings[dir_path] = [x[0] for x in scanned]
+            for name, st, is_link in scanned:
+                if st is None:
+                    continue
+                full_path = os.path.join(dir_path, name)
+                self.entries.add(full_path)
+                if not stat.S_ISDIR(st.st_mode):
+                    self.stats[full_path] = (int(st.st_mtime),
+                                             int(st.st_size), False)
+                # Directories are only recorded once their listing is
+                # known as that is what their size is.  Symlinked ones
+                # are left alone so that we cannot get stuck in loops.
+                elif not is_link and (only is None or name in only):
+                    dir_mtimes[full_path] = int(st.st_mtime)
+                    stack.append((full_path, None))
+
+        for dir_path, mtime in iteritems(dir_mtimes):
+            listing = self.listings.get(dir_path)
+            if listing is not None:
+                self.stats[dir_path] = (mtime, len(listing), True)
+
+    def stat(self, path):
+        """Returns ``(mtime, size, is_dir)`` for a path like
+        :class:`FileInfo` does or `None` if the path was not recorded.
+        """
+        path = os.path.normpath(path)
+        rv = self.stats.get(path)
+        if rv is None and path not in self.entries and \
+           os.path.dirname(path) in self.listings:
+            rv = 0, -1, False
+        return rv
+
+    def isfile(self, path):
+        """Like :func:`os.path.isfile` but returns `None` if the path was
+        not recorded.
+        """
+        rv = self.stat(path)
+        if rv is not None:
+            return rv[1] >= 0 and not rv[2]
+        return None
+
+    def listdir(self, path):
+        """Like :func:`os.listdir` but returns `None` if the directory was
+        not recorded.
+        """
+        return self.listings.get(os.path.normpath(path))
@@ -2,25 +2,35 @@ import locale
 import os
 import sys
 import stat
+import time
 import shutil
 import sqlite3
-import hashlib
 import tempfile
+import threading
+import multiprocessing
 
 from contextlib import contextmanager
 from itertools import chain
 from collections import deque, namedtuple
 
 import click
-from werkzeug.posixemulation import rename
 
-from lektor._compat import PY2, iteritems, text_type
-from lektor.context import Context
+from lektor._compat import PY2, iteritems, range_type, text_type
+from lektor.context import Context, push_active_builder, \
+     pop_active_builder
 from lektor.build_programs import builtin_build_programs
+from lektor.db import Database
+from lektor.databags import Databags
+from lektor.assets import Asset
+from lektor.sourceobj import VirtualSourceObject
 from lektor.reporter import reporter
 from lektor.sourcesearch import find_files
-from lektor.utils import prune_file_and_folder, fs_enc
+from lektor.utils import prune_file_and_folder, fs_enc, bool_from_string, \
+     replace_file
 from lektor.environment import PRIMARY_ALT
+from lektor.buildcaches import ArtifactIndex, ChecksumCache, \
+     FileSystemSnapshot, ImageInfoCache, MarkdownCache, PooledConnection, \
+     ProcessPool, RecordIndex, ThumbnailCache, compute_checksum
 from lektor.buildfailures import FailureController
 
 
@@ -62,6 +72,49 @@ def create_tables(con):
                 primary key (source)
             ) %s;
         ''' % without_rowid)
+        con.execute('''
+            create table if not exists checksums (
+                path text,
+                algorithm text,
+                inode integer,
+                size integer,
+                mtime_ns integer,
+                checksum text,
+                primary key (path)
+            ) %s;
+        ''' % without_rowid)
+        con.execute('''
+            create table if not exists markdown_cache (
+                key text,
+                html text,
+                dependencies text,
+                last_used integer,
+                primary key (key)
+            ) %s;
+        ''' % without_rowid)
+        con.execute('''
+            create table if not exists raw_records (
+                path text,
+                inode integer,
+                size integer,
+                mtime_ns integer,
+                data text,
+                primary key (path)
+            ) %s;
+        ''' % without_rowid)
+        con.execute('''
+            create table if not exists image_info (
+                path text,
+                inode integer,
+                size integer,
+                mtime_ns integer,
+                format text,
+                width integer,
+                height integer,
+                exif text,
+                primary key (path)
+            ) %s;
+        ''' % without_rowid)
         con.execute('''
             create table if not exists source_info (
                 path text,
@@ -155,9 +208,11 @@ class BuildState(object):
         checksum = virtual_source.get_checksum(self.path_cache)
         return VirtualSourceInfo(virtual_source_path, mtime, checksum)
 
-    def connect_to_database(self):
-        """Returns a database connection for the build state db."""
-        return self.builder.connect_to_database()
+    def connect_to_database(self, artifact_name=None):
+        """Returns a database connection for the build state db.  See
+        :meth:`Builder.connect_to_database`.
+        """
+        return self.builder.connect_to_database(artifact_name)
 
     def get_destination_filename(self, artifact_name):
         """Returns the destination filename for an artifact name."""
@@ -199,13 +254,17 @@ class BuildState(object):
 
     def _iter_artifact_dependency_infos(self, cur, artifact_name, sources):
         """This iterates over all dependencies as file info objects."""
-        cur.execute('''
-            select source, source_mtime, source_size,
-                   source_checksum, is_dir
-            from artifacts
-            where artifact = ?
-        ''', [artifact_name])
-        rv = cur.fetchall()
+        index = self.builder.artifact_index
+        if index is not None and index.knows(artifact_name):
+            rv = index.dependencies.get(artifact_name, ())
+        else:
+            cur.execute('''
+                select source, source_mtime, source_size,
+                       source_checksum, is_dir
+                from artifacts
+                where artifact = ?
+            ''', [artifact_name])
+            rv = cur.fetchall()
 
         found = set()
         for path, mtime, size, checksum, is_dir in rv:
@@ -277,7 +336,10 @@ class BuildState(object):
 
     def remove_artifact(self, artifact_name):
         """Removes an artifact from the build state."""
-        con = self.connect_to_database()
+        index = self.builder.artifact_index
+        if index is not None:
+            index.invalidate(artifact_name)
+        con = self.connect_to_database(artifact_name)
         try:
             cur = con.cursor()
             cur.execute('''
@@ -295,6 +357,10 @@ class BuildState(object):
         if not sources:
             return False
 
+        index = self.builder.artifact_index
+        if index is not None:
+            return not index.dirty_sources.isdisjoint(sources)
+
         cur.execute('''
             select source from dirty_sources where source in (%s) limit 1
         ''' % ', '.join(['?'] * len(sources)), sources)
@@ -302,6 +368,10 @@ class BuildState(object):
 
     def _get_artifact_config_hash(self, cur, artifact_name):
         """Returns the artifact's config hash."""
+        index = self.builder.artifact_index
+        if index is not None and index.knows(artifact_name):
+            return index.config_hashes.get(artifact_name)
+
         cur.execute('''
             select config_hash from artifact_config_hashes
              where artifact = ?
@@ -400,6 +470,29 @@ class BuildState(object):
         finally:
             con.close()
 
+    def iter_dependent_artifacts(self, sources):
+        """Yields the names of all artifacts that depend on at least one of
+        the given source filenames.
+        """
+        sources = list(sources)
+        con = self.connect_to_database()
+        try:
+            cur = con.cursor()
+            seen = set()
+            # Stay below the default limit of host parameters of sqlite.
+            for offset in range_type(0, len(sources), 900):
+                chunk = sources[offset:offset + 900]
+                cur.execute('''
+                    select distinct artifact from artifacts
+                     where source in (%s)
+                ''' % ', '.join(['?'] * len(chunk)), chunk)
+                for artifact_name, in cur.fetchall():
+                    if artifact_name not in seen:
+                        seen.add(artifact_name)
+                        yield artifact_name
+        finally:
+            con.close()
+
     def vacuum(self):
         """Vacuums the build db."""
         con = self.connect_to_database()
@@ -409,29 +502,13 @@ class BuildState(object):
             con.close()
 
 
-def _describe_fs_path_for_checksum(path):
-    """Given a file system path this returns a basic description of what
-    this is.  This is used for checksum hashing on directories.
-    """
-    # This is not entirely correct as it does not detect changes for
-    # contents from alternatives.  However for the moment it's good
-    # enough.
-    if os.path.isfile(path):
-        return b'\x01'
-    if os.path.isfile(os.path.join(path, 'contents.lr')):
-        return b'\x02'
-    if os.path.isdir(path):
-        return b'\x03'
-    return b'\x00'
-
-
 class FileInfo(object):
     """A file info object holds metainformation of a file so that changes
     can be detected easily.
     """
 
     def __init__(self, env, filename, mtime=None, size=None,
-                 checksum=None, is_dir=None):
+                 checksum=None, is_dir=None, checksum_cache=None):
         self.env = env
         self.filename = filename
         if mtime is not None and size is not None and is_dir is not None:
@@ -439,6 +516,7 @@ class FileInfo(object):
         else:
             self._stat = None
         self._checksum = checksum
+        self._checksum_cache = checksum_cache
 
     def _get_stat(self):
         rv = self._stat
@@ -488,29 +566,11 @@ class FileInfo(object):
         if rv is not None:
             return rv
 
-        try:
-            h = hashlib.sha1()
-            if os.path.isdir(self.filename):
-                h.update(b'DIR\x00')
-                for filename in sorted(os.listdir(self.filename)):
-                    if self.env.is_uninteresting_source_name(filename):
-                        continue
-                    if isinstance(filename, text_type):
-                        filename = filename.encode('utf-8')
-                    h.update(filename)
-                    h.update(_describe_fs_path_for_checksum(
-                        os.path.join(self.filename, filename.decode('utf-8'))))
-                    h.update(b'\x00')
-            else:
-                with open(self.filename, 'rb') as f:
-                    while 1:
-                        chunk = f.read(16 * 1024)
-                        if not chunk:
-                            break
-                        h.update(chunk)
-            checksum = h.hexdigest()
-        except (OSError, IOError):
-            checksum = '0' * 40
+        if self._checksum_cache is not None:
+            checksum = self._checksum_cache.get_checksum(self.env,
+                                                         self.filename)
+        else:
+            checksum = compute_checksum(self.env, self.filename)
         self._checksum = checksum
         return checksum
 
@@ -583,6 +643,9 @@ class Artifact(object):
 
         self._new_artifact_file = None
         self._pending_update_ops = []
+        self._running_jobs = 0
+        self._job_exc_info = None
+        self._waiting_ctx = None
 
     def __repr__(self):
         return '<%s %r>' % (
@@ -646,6 +709,25 @@ class Artifact(object):
         else:
             self._new_artifact_file = filename
 
+    def get_new_filename(self):
+        """Returns the name of the file that replaces the artifact when it
+        is committed.  Unlike :meth:`open` this keeps the extension of the
+        artifact, which helps programs that write the file themselves.
+        """
+        if self._new_artifact_file is None:
+            self.ensure_dir()
+            fd, self._new_artifact_file = tempfile.mkstemp(
+                dir=os.path.dirname(self.dst_filename), prefix='.__trans',
+                suffix=os.path.splitext(self.dst_filename)[1])
+            os.close(fd)
+            os.chmod(self._new_artifact_file, 0o644)
+        return self._new_artifact_file
+
+    def discard(self):
+        """Removes the new file of an artifact that will not be built."""
+        if not self.in_update_block:
+            self._rollback()
+
     def render_template_into(self, template_name, this, **extra):
         """Renders a template into the artifact.  The default behavior is to
         catch the error and render it into the template with a failure marker.
@@ -663,7 +745,7 @@ class Artifact(object):
         stores the config hash.
 
         This normally defers the operation until commit but the `for_failure`
-        more will immediately commit into a new connection.
+        mode will immediately commit it.
         """
         def operation(con):
             primary_sources = set(self.build_state.to_source_filename(x)
@@ -701,6 +783,10 @@ class Artifact(object):
 
             reporter.report_dependencies(rows)
 
+            index = self.build_state.builder.artifact_index
+            if index is not None:
+                index.invalidate(self.artifact_name)
+
             cur = con.cursor()
             if not for_failure:
                 cur.execute('delete from artifacts where artifact = ?',
@@ -727,7 +813,8 @@ class Artifact(object):
             cur.close()
 
         if for_failure:
-            con = self.build_state.connect_to_database()
+            con = self.build_state.connect_to_database(
+                self.artifact_name)
             try:
                 operation(con)
             except:
@@ -745,6 +832,9 @@ class Artifact(object):
         def operation(con):
             sources = [self.build_state.to_source_filename(x)
                        for x in self.sources]
+            index = self.build_state.builder.artifact_index
+            if index is not None:
+                index.dirty_sources.difference_update(sources)
             cur = con.cursor()
             cur.execute('''
                 delete from dirty_sources where source in (%s)
@@ -765,6 +855,9 @@ class Artifact(object):
             if not sources:
                 return
 
+            index = self.build_state.builder.artifact_index
+            if index is not None:
+                index.dirty_sources.update(sources)
             cur = con.cursor()
             cur.executemany('''
                 insert or replace into dirty_sources (source) values (?)
@@ -780,13 +873,15 @@ class Artifact(object):
         if self.in_update_block:
             self._pending_update_ops.append(f)
             return
-        con = self.build_state.connect_to_database()
+        con = self.build_state.connect_to_database(self.artifact_name)
         try:
             f(con)
         except:
             con.rollback()
+            con.close()
             raise
         con.commit()
+        con.close()
 
     @contextmanager
     def update(self):
@@ -820,11 +915,12 @@ class Artifact(object):
         try:
             for op in self._pending_update_ops:
                 if con is None:
-                    con = self.build_state.connect_to_database()
+                    con = self.build_state.connect_to_database(
+                        self.artifact_name)
                 op(con)
 
             if self._new_artifact_file is not None:
-                rename(self._new_artifact_file, self.dst_filename)
+                replace_file(self._new_artifact_file, self.dst_filename)
                 self._new_artifact_file = None
 
             if con is not None:
@@ -857,39 +953,79 @@ class Artifact(object):
         self.in_update_block = False
         self.updated = True
 
-        # If there was no error, we memoize the dependencies like normal
-        # and then commit our transaction.
+        # Programs that write the artifact in the background have to
+        # finish before it can be committed.
         if exc_info is None:
+            if self._running_jobs:
+                self._waiting_ctx = ctx
+                return
+            exc_info = self._job_exc_info
+        self._job_exc_info = None
+        self._finish_update(ctx, exc_info)
+
+    def _finish_update(self, ctx, exc_info):
+        succeeded = False
+        try:
+            # If there was no error, we memoize the dependencies like
+            # normal and then commit our transaction.
+            if exc_info is None:
+                self._memorize_dependencies(
+                    ctx.referenced_dependencies,
+                    ctx.referenced_virtual_dependencies.values())
+                self._commit()
+                succeeded = True
+                return
+
+            # If an error happened we roll back all changes and record the
+            # stacktrace in two locations: we record it on the context so
+            # that a called can respond to our failure, and we also persist
+            # it so that the dev server can render it out later.
+            self._rollback()
+
+            # This is a special form of dependency memorization where we do
+            # not prune old dependencies and we just append new ones and we
+            # use a new database connection that immediately commits.
             self._memorize_dependencies(
                 ctx.referenced_dependencies,
-                ctx.referenced_virtual_dependencies.values())
-            self._commit()
-            return
+                ctx.referenced_virtual_dependencies.values(),
+                for_failure=True)
 
-        # If an error happened we roll back all changes and record the
-        # stacktrace in two locations: we record it on the context so
-        # that a called can respond to our failure, and we also persist
-        # it so that the dev server can render it out later.
-        self._rollback()
+            ctx.exc_info = exc_info
+            self.build_state.notify_failure(self, exc_info)
+        finally:
+            self.build_state.builder.finish_claim(self.artifact_name,
+                                                  succeeded)
 
-        # This is a special form of dependency memorization where we do
-        # not prune old dependencies and we just append new ones and we
-        # use a new database connection that immediately commits.
-        self._memorize_dependencies(
-            ctx.referenced_dependencies,
-            ctx.referenced_virtual_dependencies.values(),
-            for_failure=True)
+    def begin_job(self):
+        """Notes that a program writing the artifact was started in the
+        background, see :class:`lektor.buildcaches.ProcessPool`.  The
+        artifact is not committed before :meth:`finish_job` was called.
+        """
+        self._running_jobs += 1
 
-        ctx.exc_info = exc_info
-        self.build_state.notify_failure(self, exc_info)
+    def finish_job(self, exc_info=None):
+        """Notes that a program started for the artifact finished.  If the
+        update block already ended, the artifact is committed once all of
+        them finished or rolled back and reported if one of them failed.
+        """
+        self._running_jobs -= 1
+        if exc_info is not None and self._job_exc_info is None:
+            self._job_exc_info = exc_info
+        if not self._running_jobs and self._waiting_ctx is not None:
+            ctx = self._waiting_ctx
+            exc_info = self._job_exc_info
+            self._waiting_ctx = self._job_exc_info = None
+            self._finish_update(ctx, exc_info)
 
 
 class PathCache(object):
 
-    def __init__(self, env):
+    def __init__(self, env, snapshot=None, checksum_cache=None):
         self.file_info_cache = {}
         self.source_filename_cache = {}
         self.env = env
+        self.snapshot = snapshot
+        self.checksum_cache = checksum_cache
 
     def to_source_filename(self, filename):
         """Given a path somewhere below the environment this will return the
@@ -932,7 +1068,17 @@ class PathCache(object):
         fn = os.path.join(self.env.root_path, filename)
         rv = self.file_info_cache.get(fn)
         if rv is None:
-            self.file_info_cache[fn] = rv = FileInfo(self.env, fn)
+            st = None
+            if self.snapshot is not None:
+                st = self.snapshot.stat(fn)
+            if st is not None:
+                mtime, size, is_dir = st
+                rv = FileInfo(self.env, fn, mtime, size, is_dir=is_dir,
+                              checksum_cache=self.checksum_cache)
+            else:
+                rv = FileInfo(self.env, fn,
+                              checksum_cache=self.checksum_cache)
+            self.file_info_cache[fn] = rv
         return rv
 
 
@@ -951,10 +1097,31 @@ def process_extra_flags(flags):
 
 class Builder(object):
 
+    #: Whether :meth:`build` emits the ``before-build`` and ``after-build``
+    #: plugin events.  The workers of a parallel build leave this to the
+    #: parent process.
+    emit_build_events = True
+
+    #: The number of commits after which a pooled connection actually
+    #: commits.  Pending changes are also committed at the end of every
+    #: build program.
+    commit_interval = 100
+
     def __init__(self, pad, destination_path, buildstate_path=None,
-                 extra_flags=None):
+                 extra_flags=None, jobs=1, fs_snapshot=False):
         self.extra_flags = process_extra_flags(extra_flags)
         self.pad = pad
+        self.jobs = max(1, jobs or 1)
+        self.fs_snapshot = fs_snapshot
+        self._pooled_con = None
+
+        #: The artifacts claimed by the processes of a parallel build.  See
+        #: :meth:`claim_artifact`.
+        self.artifact_claims = None
+
+        #: The :class:`ArtifactIndex` of the build state while building
+        #: everything.
+        self.artifact_index = None
         self.destination_path = os.path.abspath(os.path.join(
             pad.db.env.root_path, destination_path))
         if buildstate_path:
@@ -983,6 +1150,32 @@ class Builder(object):
         finally:
             con.close()
 
+        self.checksum_cache = ChecksumCache(
+            self, pad.db.config['CHECKSUM_ALGORITHM'])
+
+        self.markdown_cache = None
+        markdown_cache_size = int(pad.db.config['MARKDOWN_CACHE_SIZE'] or 0)
+        if markdown_cache_size > 0:
+            self.markdown_cache = MarkdownCache(self, markdown_cache_size)
+
+        self.record_index = None
+        if bool_from_string(pad.db.config['RECORD_INDEX'], False):
+            self.record_index = RecordIndex(self)
+
+        self.image_info_cache = ImageInfoCache(self)
+
+        #: Runs thumbnail programs concurrently if more than one job is
+        #: configured for them.  See :func:`lektor.imagetools.process_image`.
+        self.thumbnail_pool = None
+        thumbnail_jobs = int(pad.db.config['THUMBNAIL_JOBS'] or self.jobs)
+        if thumbnail_jobs > 1:
+            self.thumbnail_pool = ProcessPool(thumbnail_jobs)
+
+        self.thumbnail_cache = None
+        if bool_from_string(pad.db.config['THUMBNAIL_CACHE'], False):
+            self.thumbnail_cache = ThumbnailCache(
+                self.env.project.get_thumbnail_cache_path())
+
     @property
     def env(self):
         """The environment backing this generator."""
@@ -993,9 +1186,9 @@ class Builder(object):
         """The filename for the build state database."""
         return os.path.join(self.meta_path, 'buildstate')
 
-    def connect_to_database(self):
+    def _connect_to_database(self, isolation_level=None):
         con = sqlite3.connect(self.buildstate_database_filename,
-                              isolation_level=None,
+                              isolation_level=isolation_level,
                               timeout=10, check_same_thread=False)
         if PY2:
             # This code block solve lektor/lektor#243 issue
@@ -1018,6 +1211,60 @@ class Builder(object):
         cur.close()
         return con
 
+    def connect_to_database(self, artifact_name=None):
+        """Returns a database connection for the build state db.  While a
+        pooled connection is active (see :meth:`pooled_connection`) that
+        connection is returned instead of a new one.  If the writes through
+        the connection belong to an artifact, `artifact_name` names it so
+        that parallel builds can apply them per artifact.
+        """
+        if self._pooled_con is not None:
+            return self._pooled_con.begin()
+        return self._connect_to_database()
+
+    def begin_pooled_connection(self):
+        """Opens the connection that is shared by everything accessing the
+        build state until :meth:`finish_pooled_connection` is called.  Until
+        then the database of the pad uses the build state caches of this
+        builder in the current thread.
+        """
+        if self._pooled_con is not None:
+            raise RuntimeError('A pooled connection is already active.')
+        # Unlike the regular connections this one does not auto commit.
+        # The pooled connection opens the transaction itself and decides
+        # when to commit it.
+        self._pooled_con = PooledConnection(
+            self._connect_to_database(isolation_level=''),
+            self.commit_interval)
+        push_active_builder(self)
+        return self._pooled_con
+
+    def finish_pooled_connection(self):
+        """Commits outstanding changes and closes the pooled connection."""
+        con = self._pooled_con
+        if con is None:
+            raise RuntimeError('No pooled connection is active.')
+        self._pooled_con = None
+        pop_active_builder()
+        try:
+            con.flush()
+        finally:
+            con.con.close()
+
+    @contextmanager
+    def pooled_connection(self):
+        """Shares one build state connection for the duration of the block.
+        If a pooled connection is already active it is reused.
+        """
+        if self._pooled_con is not None:
+            yield self._pooled_con
+            return
+        con = self.begin_pooled_connection()
+        try:
+            yield con
+        finally:
+            self.finish_pooled_connection()
+
     def touch_site_config(self):
         """Touches the site config which typically will trigger a rebuild."""
         try:
@@ -1036,7 +1283,8 @@ class Builder(object):
     def new_build_state(self, path_cache=None):
         """Creates a new build state."""
         if path_cache is None:
-            path_cache = PathCache(self.env)
+            path_cache = PathCache(self.env,
+                                   checksum_cache=self.checksum_cache)
         return BuildState(self, path_cache)
 
     def get_build_program(self, source, build_state):
@@ -1057,6 +1305,8 @@ class Builder(object):
         if it was built, or `None` otherwise.
         """
         is_current = artifact.is_current
+        if not is_current and self.artifact_claims is not None:
+            is_current = not self.claim_artifact(artifact.artifact_name)
         with reporter.build_artifact(artifact, build_func, is_current):
             if not is_current:
                 with artifact.update() as ctx:
@@ -1071,6 +1321,38 @@ class Builder(object):
                 return ctx
         return None
 
+    def claim_artifact(self, artifact_name):
+        """In a parallel build an artifact is only built by the process
+        that claims it first.  The others wait for it and then treat the
+        artifact as current, unless building it failed.  Then they try
+        again like a serial build would.  Returns `True` if this process
+        has to build the artifact.
+        """
+        pid = os.getpid()
+        while 1:
+            state, owner = self.artifact_claims.setdefault(
+                artifact_name, ('building', pid))
+            if owner == pid and state == 'building':
+                return True
+            if state == 'built':
+                return False
+            # The artifacts of this process might wait for its thumbnail
+            # programs which have to make progress meanwhile.
+            if self.thumbnail_pool is not None:
+                self.thumbnail_pool.poll()
+            time.sleep(0.01)
+
+    def finish_claim(self, artifact_name, succeeded):
+        """Marks a claimed artifact as built or releases the claim if
+        building it failed.
+        """
+        if self.artifact_claims is None:
+            return
+        if succeeded:
+            self.artifact_claims[artifact_name] = ('built', os.getpid())
+        else:
+            self.artifact_claims.pop(artifact_name, None)
+
     def update_source_info(self, prog, build_state):
         """Updates a single source info based on a program.  This is done
         automatically as part of a build.
@@ -1094,6 +1376,12 @@ class Builder(object):
                     prune_file_and_folder(filename, self.destination_path)
                     build_state.remove_artifact(aft)
                 build_state.prune_source_infos()
+                self.checksum_cache.prune()
+                if self.record_index is not None:
+                    self.record_index.prune()
+                self.image_info_cache.prune()
+                if self.markdown_cache is not None:
+                    self.markdown_cache.prune()
 
             if all:
                 build_state.vacuum()
@@ -1102,19 +1390,23 @@ class Builder(object):
 
     def build(self, source, path_cache=None):
         """Given a source object, builds it."""
-        with self.new_build_state(path_cache=path_cache) as build_state:
-            with reporter.process_source(source):
-                prog = self.get_build_program(source, build_state)
-                self.env.plugin_controller.emit(
-                    'before-build', builder=self, build_state=build_state,
-                    source=source, prog=prog)
-                prog.build()
-                if build_state.updated_artifacts:
-                    self.update_source_info(prog, build_state)
-                self.env.plugin_controller.emit(
-                    'after-build', builder=self, build_state=build_state,
-                    source=source, prog=prog)
-                return prog, build_state
+        with self.pooled_connection() as con:
+            with self.new_build_state(path_cache=path_cache) as build_state:
+                with reporter.process_source(source):
+                    prog = self.get_build_program(source, build_state)
+                    if self.emit_build_events:
+                        self.env.plugin_controller.emit(
+                            'before-build', builder=self,
+                            build_state=build_state, source=source, prog=prog)
+                    prog.build()
+                    if build_state.updated_artifacts:
+                        self.update_source_info(prog, build_state)
+                    if self.emit_build_events:
+                        self.env.plugin_controller.emit(
+                            'after-build', builder=self,
+                            build_state=build_state, source=source, prog=prog)
+            con.flush()
+        return prog, build_state
 
     def get_initial_build_queue(self):
         """Returns the initial build queue as deque."""
@@ -1125,27 +1417,256 @@ class Builder(object):
         for func in self.env.custom_generators:
             queue.extend(func(prog.source) or ())
 
+    @contextmanager
+    def _snapshot_sources(self):
+        """Takes a :class:`FileSystemSnapshot` for the duration of the block
+        if snapshots are enabled and makes the database use it.  Yields the
+        snapshot or `None`.
+        """
+        if not self.fs_snapshot:
+            yield None
+            return
+        db = self.pad.db
+        db.fs_snapshot = snapshot = FileSystemSnapshot.take(self.env)
+        try:
+            yield snapshot
+        finally:
+            db.fs_snapshot = None
+
     def build_all(self):
         """Builds the entire tree.  Returns the number of failures."""
         failures = 0
-        path_cache = PathCache(self.env)
-        # We keep a dummy connection here that does not do anything which
+        # All of the build shares one connection.  Keeping it open also
         # helps us with the WAL handling.  See #144
-        con = self.connect_to_database()
-        try:
+        with self.pooled_connection() as con, \
+                self._snapshot_sources() as snapshot:
+            path_cache = PathCache(self.env, snapshot=snapshot,
+                                   checksum_cache=self.checksum_cache)
             with reporter.build('build', self):
                 self.env.plugin_controller.emit('before-build-all', builder=self)
                 to_build = self.get_initial_build_queue()
-                while to_build:
-                    source = to_build.popleft()
-                    prog, build_state = self.build(source, path_cache=path_cache)
-                    self.extend_build_queue(to_build, prog)
-                    failures += len(build_state.failed_artifacts)
+                if self.jobs > 1 and _fork_context is not None:
+                    failures = self._build_queue_parallel(to_build, path_cache)
+                else:
+                    self.artifact_index = ArtifactIndex.load(con)
+                    try:
+                        while to_build:
+                            source = to_build.popleft()
+                            prog, build_state = self.build(
+                                source, path_cache=path_cache)
+                            self.extend_build_queue(to_build, prog)
+                            failures += len(build_state.failed_artifacts)
+                    finally:
+                        self.artifact_index = None
                 self.env.plugin_controller.emit('after-build-all', builder=self)
                 if failures:
                     reporter.report_build_all_failure(failures)
             return failures
+
+    def _iter_sources_for_filename(self, source_filename):
+        """Yields the sources that are directly backed by a source file.
+        This is how sources are found that no artifact depends on yet.
+        """
+        pieces = source_filename.split('/')
+        if pieces[0] == 'content':
+            pieces = pieces[1:]
+            alts = self.pad.db.config.list_alternatives() or [PRIMARY_ALT]
+            if pieces and pieces[-1].endswith('.lr'):
+                basename = pieces.pop()
+                if basename.startswith('contents+'):
+                    alts = [basename[9:-3]]
+                elif basename != 'contents.lr':
+                    # Metadata of an attachment.
+                    pieces.append(basename[:-3])
+            for alt in alts:
+                source = self.pad.get('/'.join(pieces), alt=alt)
+                if source is not None:
+                    yield source
+        elif pieces[0] == 'assets' or \
+                (pieces[0] == 'themes' and pieces[2:3] == ['assets']):
+            pieces = pieces[pieces.index('assets') + 1:]
+            if pieces:
+                source = self.pad.get_asset('/'.join(pieces))
+                if source is not None:
+                    yield source
+
+    def _iter_sources_for_artifact(self, artifact_name):
+        """Yields the source that produces an artifact if it can be found
+        by its URL.  Sub artifacts such as thumbnails are not found this way
+        but get rebuilt by their parent sources.
+        """
+        url_path = '/' + artifact_name
+        if url_path.endswith('/index.html'):
+            url_path = url_path[:-10]
+        source = self.pad.resolve_url_path(url_path, include_invisible=True)
+        if source is not None:
+            yield source
+
+    def build_changed(self, filenames):
+        """Incrementally builds everything affected by changes to the given
+        files.  The filenames can be absolute or relative to the project
+        folder, files outside of the project are ignored.  This rebuilds the
+        sources backed by the files themselves, the sources of all artifacts
+        that depend on the files or their folders, and all child sources
+        that these builds discover.  Returns the number of failures.
+        """
+        failures = 0
+        path_cache = PathCache(self.env, checksum_cache=self.checksum_cache)
+
+        changed = set()
+        for filename in filenames:
+            try:
+                source_filename = path_cache.to_source_filename(filename)
+            except ValueError:
+                continue
+            # Adding or removing files changes the folders that contain
+            # them, which is what queries over the children depend on.
+            while source_filename and source_filename not in changed:
+                changed.add(source_filename)
+                source_filename = source_filename.rpartition('/')[0]
+
+        with self.pooled_connection() as con:
+            self.artifact_index = ArtifactIndex.load(con)
+            try:
+                with reporter.build('build', self):
+                    to_build = deque()
+                    for source_filename in sorted(changed):
+                        to_build.extend(
+                            self._iter_sources_for_filename(source_filename))
+                    build_state = self.new_build_state(path_cache=path_cache)
+                    for artifact_name in \
+                            build_state.iter_dependent_artifacts(changed):
+                        to_build.extend(
+                            self._iter_sources_for_artifact(artifact_name))
+
+                    seen = set()
+                    while to_build:
+                        source = to_build.popleft()
+                        key = _get_source_ident(source) or source
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        prog, build_state = self.build(
+                            source, path_cache=path_cache)
+                        failures += len(build_state.failed_artifacts)
+                        # Only look for new children below sources that
+                        # changed or that do not produce anything themselves.
+                        if not prog.artifacts or \
+                                build_state.updated_artifacts:
+                            self.extend_build_queue(to_build, prog)
+                    if failures:
+                        reporter.report_build_all_failure(failures)
+            finally:
+                self.artifact_index = None
+        return failures
+
+    def _build_queue_parallel(self, to_build, path_cache):
+        """Builds everything in the queue with a pool of worker processes.
+        The workers run the build programs with their own pad and record
+        their build state writes and reporter output.  This process applies
+        those writes, replays the output and expands the queue in the same
+        order as a serial build would.
+
+        Artifacts that are shared between sources are only built by the
+        process that claims them first, see :meth:`claim_artifact`.  The
+        ``before-build`` plugin event is emitted when a source is handed to
+        a worker and ``after-build`` once its results were applied, so
+        plugins see both in the same order as in a serial build.
+        """
+        failures = 0
+        pending = deque()
+        manager = _fork_context.Manager()
+        self.artifact_claims = claims = manager.dict()
+        pool = _fork_context.Pool(self.jobs, initializer=_init_build_worker,
+                                  initargs=(self, claims))
+        try:
+            while to_build or pending:
+                while to_build and len(pending) < self.jobs * 2:
+                    source = to_build.popleft()
+                    build_state = self.new_build_state(path_cache=path_cache)
+                    prog = self.get_build_program(source, build_state)
+                    ident = _get_source_ident(source)
+                    result = None
+                    # Sources the workers cannot locate by themselves are
+                    # built right here.
+                    if ident is not None and \
+                            _source_from_ident(self.pad, ident) is not None:
+                        self.env.plugin_controller.emit(
+                            'before-build', builder=self,
+                            build_state=build_state, source=source, prog=prog)
+                        result = pool.apply_async(_build_in_worker, (ident,))
+                    pending.append((source, build_state, prog, result))
+
+                source, build_state, prog, result = pending.popleft()
+                if result is None:
+                    prog, build_state = self.build(source,
+                                                   path_cache=path_cache)
+                    failures += len(build_state.failed_artifacts)
+                else:
+                    worker, num_failures, writes, output = result.get()
+                    self._replay_worker_output(output, source, build_state,
+                                               prog)
+                    self._apply_worker_writes(writes, worker)
+                    failures += num_failures
+                    self.env.plugin_controller.emit(
+                        'after-build', builder=self, build_state=build_state,
+                        source=source, prog=prog)
+                self.extend_build_queue(to_build, prog)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
         finally:
+            pool.join()
+            self.artifact_claims = None
+            manager.shutdown()
+        return failures
+
+    def _replay_worker_output(self, output, source, build_state, prog):
+        """Reports what a build worker recorded while building a source."""
+        prog.produce_artifacts()
+        artifacts = dict((x.artifact_name, x) for x in prog.artifacts)
+
+        def get_artifact(artifact_name):
+            rv = artifacts.get(artifact_name)
+            if rv is None:
+                rv = artifacts[artifact_name] = \
+                    build_state.new_artifact(artifact_name)
+            return rv
+
+        def get_source(ident):
+            if ident == _get_source_ident(source):
+                return source
+            return _source_from_ident(self.pad, ident)
+
+        reporter.replay_output(output, get_artifact, get_source)
+
+    def _apply_worker_writes(self, writes, worker):
+        """Applies the build state writes recorded by a build worker.  The
+        writes that belong to an artifact are applied in one transaction,
+        unless another process built the artifact in the meantime.
+        """
+        for artifact_name, statements in writes:
+            if artifact_name is not None:
+                state, owner = self.artifact_claims.get(
+                    artifact_name, (None, None))
+                if state == 'built' and owner != worker:
+                    continue
+            con = self.connect_to_database(artifact_name)
+            try:
+                cur = con.cursor()
+                for sql, args, many in statements:
+                    if many:
+                        cur.executemany(sql, args)
+                    else:
+                        cur.execute(sql, args)
+                cur.close()
+            except:
+                con.rollback()
+                con.close()
+                raise
+            con.commit()
             con.close()
 
     def update_all_source_infos(self):
@@ -1153,12 +1674,282 @@ class Builder(object):
         everything.
         """
         with reporter.build('source info update', self):
-            with self.new_build_state() as build_state:
-                to_build = self.get_initial_build_queue()
-                while to_build:
-                    source = to_build.popleft()
-                    with reporter.process_source(source):
-                        prog = self.get_build_program(source, build_state)
-                        self.update_source_info(prog, build_state)
-                    self.extend_build_queue(to_build, prog)
-            build_state.prune_source_infos()
+            with self.pooled_connection():
+                with self.new_build_state() as build_state:
+                    to_build = self.get_initial_build_queue()
+                    while to_build:
+                        source = to_build.popleft()
+                        with reporter.process_source(source):
+                            prog = self.get_build_program(source, build_state)
+                            self.update_source_info(prog, build_state)
+                        self.extend_build_queue(to_build, prog)
+                build_state.prune_source_infos()
+
+
+class WatchBuilder(object):
+    """Builds a project over and over from a watch loop.  The database and
+    pad are kept warm between builds and only what depends on the reported
+    changes gets rebuilt.
+
+    Neither the pad nor its record cache are thread safe.  Everything that
+    uses the pad from another thread than the watch loop has to hold
+    :attr:`lock` while doing so.
+    """
+
+    def __init__(self, env, destination_path, prune=True, **options):
+        self.env = env
+        self.destination_path = destination_path
+        self.prune = prune
+        self.options = options
+        self.lock = threading.RLock()
+        self.pad = Database(env).new_pad()
+
+    def new_builder(self):
+        """Creates a builder for the warm pad."""
+        return Builder(self.pad, self.destination_path, **self.options)
+
+    def reset(self):
+        """Starts over with a fresh database and pad."""
+        self.pad = Database(self.env).new_pad()
+
+    def invalidate(self, source_filenames):
+        """Drops what the pad remembers about the given source files."""
+        record_paths = set()
+        for source_filename in source_filenames:
+            pieces = source_filename.split('/')
+            if pieces[0] == 'themes':
+                pieces = pieces[2:] or ['']
+            if pieces[0] == 'content':
+                # Records remember their parent and siblings, so all
+                # records below the parent are forgotten.
+                pieces = pieces[1:-1]
+                if source_filename.endswith('.lr') and \
+                        source_filename.rsplit('/', 1)[-1] \
+                        .startswith('contents'):
+                    pieces = pieces[:-1]
+                record_paths.add('/'.join(pieces))
+            elif pieces[0] == 'databags':
+                self.pad.databags = Databags(self.env)
+            elif pieces[0] in ('models', 'flowblocks') or \
+                    source_filename.endswith('.lektorproject'):
+                self.reset()
+                return
+        self.pad.cache.forget(record_paths)
+
+    def build_all(self, update_source_info_first=False):
+        """Builds everything.  Returns the number of failures."""
+        with self.lock:
+            builder = self.new_builder()
+            if update_source_info_first:
+                builder.update_all_source_infos()
+            failures = builder.build_all()
+            if self.prune:
+                builder.prune()
+        return failures
+
+    def build_changed(self, filenames):
+        """Rebuilds what depends on the given changed files.  Returns the
+        number of failures.
+        """
+        path_cache = PathCache(self.env)
+        source_filenames = set()
+        for filename in filenames:
+            try:
+                source_filenames.add(path_cache.to_source_filename(filename))
+            except ValueError:
+                pass
+
+        with self.lock:
+            try:
+                self.invalidate(source_filenames)
+                builder = self.new_builder()
+                failures = builder.build_changed(source_filenames)
+                # Only removed files leave artifacts behind that need
+                # pruning.
+                if self.prune and not all(
+                        os.path.exists(os.path.join(self.env.root_path, x))
+                        for x in source_filenames):
+                    builder.prune()
+            except:
+                self.reset()
+                raise
+        return failures
+
+
+# Parallel builds fork the worker processes so that they inherit the fully
+# set up environment including all plugins.  Where this is not available
+# we fall back to building serially.
+try:
+    _fork_context = multiprocessing.get_context('fork')
+except (AttributeError, ValueError):
+    _fork_context = None
+
+# The builder of the current build worker process.
+_worker_builder = None
+_worker_path_cache = None
+
+
+def _get_source_ident(source):
+    """Returns a picklable description of a source that a build worker can
+    use to locate the source in its own pad, or `None` if there is no
+    such description.
+    """
+    if isinstance(source, VirtualSourceObject):
+        return ('virtual', source.path, source.alt)
+    if source.source_classification == 'record':
+        return ('record', source['_path'], source.alt,
+                getattr(source, 'page_num', None))
+    if isinstance(source, Asset):
+        return ('asset', source.source_filename)
+    return None
+
+
+def _source_from_ident(pad, ident):
+    """Locates a source from a description made by `_get_source_ident`."""
+    kind = ident[0]
+    if kind == 'virtual':
+        return pad.get(ident[1], alt=ident[2])
+    if kind == 'record':
+        return pad.get(ident[1], alt=ident[2], page_num=ident[3])
+    filename = ident[1]
+    for node in [pad.asset_root] + pad.theme_asset_roots:
+        root = node.source_filename
+        if filename == root:
+            return node
+        if not filename.startswith(root + os.path.sep):
+            continue
+        for piece in filename[len(root) + 1:].split(os.path.sep):
+            node = node.get_child(piece)
+            if node is None:
+                break
+        if node is not None:
+            return node
+    return None
+
+
+def _init_build_worker(builder, claims):
+    global _worker_builder, _worker_path_cache  # pylint: disable=global-statement
+    # The snapshot of the parent was taken before forking and is still
+    # valid here.
+    snapshot = builder.pad.db.fs_snapshot
+    db = Database(builder.env)
+    db.fs_snapshot = snapshot
+    _worker_builder = WorkerBuilder(
+        db.new_pad(), builder.destination_path,
+        buildstate_path=builder.meta_path, extra_flags=builder.extra_flags,
+        jobs=builder.jobs)
+    _worker_builder.artifact_claims = claims
+    # The worker reads through the same connection until it exits.  Like
+    # the connection, the artifact index does not see the writes of other
+    # workers, which is why artifacts are claimed before building them.
+    con = _worker_builder.begin_pooled_connection()
+    _worker_builder.artifact_index = ArtifactIndex.load(con)
+    _worker_path_cache = PathCache(
+        builder.env, snapshot=snapshot,
+        checksum_cache=_worker_builder.checksum_cache)
+
+
+def _build_in_worker(ident):
+    """Builds a single source in a build worker.  Returns the process id
+    and number of failures together with the recorded build state writes
+    and reporter output.
+    """
+    builder = _worker_builder
+    source = _source_from_ident(builder.pad, ident)
+    if source is None:
+        raise RuntimeError('Could not locate source %r' % (ident,))
+    del builder.recorded_writes[:]
+    with reporter.capture_output(_get_source_ident) as output:
+        _, build_state = builder.build(source, path_cache=_worker_path_cache)
+    return (os.getpid(), len(build_state.failed_artifacts),
+            list(builder.recorded_writes), output)
+
+
+def _is_write_statement(sql):
+    return sql.lstrip().split(None, 1)[0].lower() in (
+        'insert', 'update', 'delete', 'replace')
+
+
+class _RecordingCursor(object):
+
+    def __init__(self, con):
+        self._con = con
+        self._cur = con.real_con.cursor()
+
+    def execute(self, sql, args=()):
+        if _is_write_statement(sql):
+            self._con.pending_writes.append((sql, list(args), False))
+        else:
+            self._cur.execute(sql, args)
+        return self
+
+    def executemany(self, sql, seq_of_args):
+        self._con.pending_writes.append(
+            (sql, [tuple(x) for x in seq_of_args], True))
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def close(self):
+        self._cur.close()
+
+
+class _RecordingConnection(object):
+    """Build state connection of a build worker.  Reads are answered by
+    the build state database but committed writes are only recorded so
+    that the builder in the parent process can apply them.  They are
+    recorded together with the artifact they belong to.
+    """
+
+    def __init__(self, real_con, recorded_writes, artifact_name):
+        self.real_con = real_con
+        self.recorded_writes = recorded_writes
+        self.artifact_name = artifact_name
+        self.pending_writes = []
+
+    def cursor(self):
+        return _RecordingCursor(self)
+
+    def execute(self, sql, args=()):
+        return self.cursor().execute(sql, args)
+
+    def commit(self):
+        if self.pending_writes:
+            self.recorded_writes.append((self.artifact_name,
+                                         self.pending_writes))
+            self.pending_writes = []
+
+    def rollback(self):
+        del self.pending_writes[:]
+
+    def close(self):
+        self.real_con.close()
+
+
+class WorkerBuilder(Builder):
+    """The builder used by the worker processes of a parallel build.  It
+    never writes to the build state itself but records the writes in
+    :attr:`recorded_writes` instead, as ``(artifact_name, writes)`` tuples
+    for every commit.
+    """
+
+    emit_build_events = False
+
+    def __init__(self, *args, **kwargs):
+        self.recorded_writes = []
+        Builder.__init__(self, *args, **kwargs)
+        # The workers share the thumbnail jobs, so that there are never
+        # more thumbnail programs running than in a serial build.
+        thumbnail_jobs = int(self.pad.db.config['THUMBNAIL_JOBS'] or
+                             self.jobs) // self.jobs
+        self.thumbnail_pool = None
+        if thumbnail_jobs > 1:
+            self.thumbnail_pool = ProcessPool(thumbnail_jobs)
+
+    def connect_to_database(self, artifact_name=None):
+        return _RecordingConnection(Builder.connect_to_database(self),
+                                    self.recorded_writes, artifact_name)
@@ -1,9 +1,9 @@
 import os
 import sys
 import json
-import time
 import itertools
 import warnings
+from functools import partial
 import click
 import pkg_resources
 
@@ -182,10 +182,25 @@ def cli(ctx, project=None, language=None):
 @buildflag
 @click.option('--profile', is_flag=True,
               help='Enable build profiler.')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help='The number of processes that build in parallel.  The '
+              'default is to build in a single process.  Parallel builds '
+              'are not available on platforms that cannot fork processes.')
+@click.option('--fs-snapshot', is_flag=True,
+              help='Stat all source files once at the start of the build '
+              'instead of whenever they are needed.  This saves a lot of '
+              'IO on slow file systems but changes to the sources made '
+              'during the build will not be picked up.')
+@click.option('--changed-files', type=click.File('r'), default=None,
+              help='Only rebuild what depends on the source files listed in '
+              'the given file, one per line and relative to the current '
+              'folder.  Pass `-` to read the list from stdin, for instance '
+              'from `git diff --name-only --relative`.  This requires a '
+              'previous build into the same output path.')
 @pass_context
 def build_cmd(ctx, output_path, watch, prune, verbosity,
               source_info_only, buildstate_path, profile,
-              extra_flags, build_flags):
+              extra_flags, build_flags, jobs, fs_snapshot, changed_files):
     """Builds the entire project into the final artifacts.
 
     The default behavior is to build the project into the default build
@@ -215,19 +230,27 @@ def build_cmd(ctx, output_path, watch, prune, verbosity,
 
     env = ctx.get_env()
 
+    if changed_files is not None:
+        changed_files = [os.path.abspath(line.strip())
+                         for line in changed_files if line.strip()]
+
     def _build():
         builder = Builder(env.new_pad(), output_path,
                           buildstate_path=buildstate_path,
-                          extra_flags=extra_flags)
+                          extra_flags=extra_flags, jobs=jobs,
+                          fs_snapshot=fs_snapshot)
         if source_info_only:
             builder.update_all_source_infos()
             return True
 
+        build_func = builder.build_all
+        if changed_files is not None:
+            build_func = partial(builder.build_changed, changed_files)
         if profile:
             from .utils import profile_func
-            failures = profile_func(builder.build_all)
+            failures = profile_func(build_func)
         else:
-            failures = builder.build_all()
+            failures = build_func()
         if prune:
             builder.prune()
         return failures == 0
@@ -238,13 +261,19 @@ def build_cmd(ctx, output_path, watch, prune, verbosity,
         if not watch:
             return sys.exit(0 if success else 1)
 
-        from lektor.watcher import watch
+        from lektor.builder import WatchBuilder
+        from lektor.watcher import Watcher
         click.secho('Watching for file system changes', fg='cyan')
-        last_build = time.time()
-        for ts, _, _ in watch(env):
-            if ts > last_build:
-                _build()
-                last_build = time.time()
+        watch_builder = WatchBuilder(env, output_path, prune=prune,
+                                     buildstate_path=buildstate_path,
+                                     extra_flags=extra_flags)
+        watcher = Watcher(env, output_path)
+        watcher.observer.start()
+        try:
+            for changes in watcher.iter_changes():
+                watch_builder.build_changed(changes)
+        except KeyboardInterrupt:
+            watcher.observer.stop()
 
 
 @cli.command('clean')
@@ -6,6 +6,7 @@ from lektor.reporter import reporter
 
 
 _ctx_stack = LocalStack()
+_builder_stack = LocalStack()
 
 
 def url_to(*args, **kwargs):
@@ -51,6 +52,21 @@ def get_ctx():
     return _ctx_stack.top
 
 
+def get_active_builder():
+    """Returns the builder that is currently building in this thread."""
+    return _builder_stack.top
+
+
+def push_active_builder(builder):
+    """Makes a builder the active builder of this thread."""
+    _builder_stack.push(builder)
+
+
+def pop_active_builder():
+    """Restores the previously active builder of this thread."""
+    _builder_stack.pop()
+
+
 def get_locale(default='en_US'):
     """Returns the current locale."""
     ctx = get_ctx()
@@ -173,7 +189,7 @@ class Context(object):
                          sources=None, source_obj=None, config_hash=None):
         """Sometimes it can happen that while building an artifact another
         artifact needs building.  This function is generally used to record
-        this request.
+        this request.  The new artifact is returned.
         """
         if self.build_state is None:
             raise TypeError('The context does not have a build state which '
@@ -186,6 +202,7 @@ class Context(object):
         )
         self.sub_artifacts.append((aft, build_func))
         reporter.report_sub_artifact(aft)
+        return aft
 
     def record_dependency(self, filename):
         """Records a dependency from processing."""
@@ -5,7 +5,7 @@ import os
 from inifile import IniFile
 
 from lektor import types
-from lektor._compat import iteritems, itervalues
+from lektor._compat import MutableMapping, iteritems, itervalues
 from lektor.environment import Expression, FormatExpression, PRIMARY_ALT
 from lektor.i18n import get_i18n_block, generate_i18n_kvs
 from lektor.pagination import Pagination
@@ -55,7 +55,7 @@ class PaginationConfig(object):
 
     def count_total_items(self, record):
         """Counts the number of items over all pages."""
-        return self.get_pagination_query(record).count()
+        return self.get_pagination_items(record).count()
 
     def count_pages(self, record):
         """Returns the total number of pages for the children of a record."""
@@ -64,7 +64,7 @@ class PaginationConfig(object):
 
     def slice_query_for_page(self, record, page):
         """Slices the query so it returns the children for a given page."""
-        query = self.get_pagination_query(record)
+        query = self.get_pagination_items(record)
         if not self.enabled or page is None:
             return query
         return query.limit(self.per_page).offset((page - 1) * self.per_page)
@@ -132,6 +132,22 @@ class PaginationConfig(object):
         return self._items_tmpl[1].evaluate(
             record.pad, this=record)
 
+    def get_pagination_items(self, record):
+        """Returns the pagination query of a record as materialized query.
+        It's kept in the record cache so that all pages of the record share
+        the sorted items instead of running the query over and over.
+        """
+        cache = record.pad.cache
+        rv = cache.get_index('pagination', record['_path'], record.alt)
+        if rv is None:
+            query = self.get_pagination_query(record)
+            rv = query.materialize()
+            # Queries over other records would not invalidate the cache.
+            if query.path == record['_path']:
+                cache.remember_index('pagination', record['_path'],
+                                     record.alt, rv)
+        return rv
+
     def to_json(self):
         return {
             'enabled': self.enabled,
@@ -213,6 +229,67 @@ class Field(object):
         )
 
 
+class _LazyFieldData(MutableMapping):
+    """The data of a record.  Values of fields that were added with
+    :meth:`add_raw` are only deserialized when they are first looked up.
+    Everything that looks at all values deserializes all of them.
+
+    This is not a dict subclass on purpose: copying a dict subclass with
+    ``dict(data)`` or ``**data`` can bypass the lookup and would drop the
+    values that were not deserialized yet.
+    """
+
+    def __init__(self, pad=None):
+        self._pad = pad
+        self._values = {}
+        self._pending = {}
+
+    def add_raw(self, field, value):
+        self._pending[field.name] = (field, value)
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        try:
+            field, value = self._pending[key]
+        except KeyError:
+            raise KeyError(key)
+        rv = self._values.setdefault(
+            key, field.deserialize_value(value, pad=self._pad))
+        self._pending.pop(key, None)
+        return rv
+
+    def __contains__(self, key):
+        return key in self._values or key in self._pending
+
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if self._pending.pop(key, None) is not None and \
+           key not in self._values:
+            return
+        del self._values[key]
+
+    def __iter__(self):
+        keys = list(self._values)
+        keys.extend(x for x in list(self._pending) if x not in self._values)
+        return iter(keys)
+
+    def __len__(self):
+        return len(self._values) + \
+            sum(1 for x in list(self._pending) if x not in self._values)
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
 def _iter_all_fields(obj):
     for name in sorted(x for x in obj.field_map if x[:1] == '_'):
         yield obj.field_map[name]
@@ -364,11 +441,19 @@ class DataModel(object):
 
         return self._child_replacements[1].evaluate(record.pad, this=record)
 
-    def process_raw_data(self, raw_data, pad=None):
-        rv = {}
+    def process_raw_data(self, raw_data, pad=None, fields=None):
+        """Deserializes the raw data of a record.  System fields are
+        deserialized right away, all other fields when they are first
+        looked up.  If `fields` is given, only those fields and the system
+        fields are included.
+        """
+        rv = _LazyFieldData(pad)
         for field in itervalues(self.field_map):
             value = raw_data.get(field.name)
-            rv[field.name] = field.deserialize_value(value, pad=pad)
+            if field.name[:1] == '_':
+                rv[field.name] = field.deserialize_value(value, pad=pad)
+            elif fields is None or field.name in fields:
+                rv.add_raw(field, value)
         rv['_model'] = self.id
         return rv
 
@@ -3,6 +3,7 @@ import os
 import errno
 import functools
 import hashlib
+import heapq
 import operator
 import posixpath
 import warnings
@@ -23,7 +24,7 @@ from lektor import metaformat
 from lektor.utils import sort_normalize_string, cleanup_path, \
      untrusted_to_os_path, fs_enc, locate_executable
 from lektor.sourceobj import SourceObject, VirtualSourceObject
-from lektor.context import get_ctx, Context
+from lektor.context import get_ctx, get_active_builder, Context
 from lektor.datamodel import load_datamodels, load_flowblocks
 from lektor.imagetools import (
     ThumbnailMode, make_image_thumbnail,
@@ -105,6 +106,11 @@ class _CmpHelper(object):
     def __init__(self, value, reverse):
         self.value = value
         self.reverse = reverse
+        # Strings are normalized once here instead of on every comparison.
+        if isinstance(value, string_types):
+            self._normalized = sort_normalize_string(value)
+        else:
+            self._normalized = None
 
     @staticmethod
     def coerce(a, b):
@@ -130,15 +136,24 @@ class _CmpHelper(object):
                 pass
         return a, b
 
+    def _coerce_with(self, other):
+        if self._normalized is not None and other._normalized is not None:
+            return self._normalized, other._normalized
+        a = self.value
+        b = other.value
+        if type(a) is type(b):
+            return a, b
+        return self.coerce(a, b)
+
     def __eq__(self, other):
-        a, b = self.coerce(self.value, other.value)
+        a, b = self._coerce_with(other)
         return a == b
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __lt__(self, other):
-        a, b = self.coerce(self.value, other.value)
+        a, b = self._coerce_with(other)
         try:
             if self.reverse:
                 return b < a
@@ -172,11 +187,27 @@ def save_eval(filter, record):
         return Undefined(e.message)
 
 
+def _union_fields(*exprs):
+    rv = set()
+    for expr in exprs:
+        fields = expr.__fields__()
+        if fields is None:
+            return None
+        rv.update(fields)
+    return rv
+
+
 class Expression(object):
 
     def __eval__(self, record):
         return record
 
+    def __fields__(self):
+        """Returns the set of record fields the expression looks at or
+        `None` if that cannot be known.
+        """
+        return None
+
     def __eq__(self, other):
         return _BinExpr(self, _auto_wrap_expr(other), operator.eq)
 
@@ -252,6 +283,9 @@ class _IsBoolExpr(Expression):
         return (not is_undefined(val) and
                 val not in (None, 0, False, '')) == self.__true
 
+    def __fields__(self):
+        return self.__expr.__fields__()
+
 
 class _Literal(Expression):
 
@@ -261,6 +295,9 @@ class _Literal(Expression):
     def __eval__(self, record):
         return self.__value
 
+    def __fields__(self):
+        return set()
+
 
 class _BinExpr(Expression):
 
@@ -275,6 +312,9 @@ class _BinExpr(Expression):
             self.__right.__eval__(record)
         )
 
+    def __fields__(self):
+        return _union_fields(self.__left, self.__right)
+
 
 class _ContainmentExpr(Expression):
 
@@ -289,6 +329,9 @@ class _ContainmentExpr(Expression):
             item = item['_id']
         return item in seq
 
+    def __fields__(self):
+        return _union_fields(self.__seq, self.__item)
+
 
 class _RecordQueryField(Expression):
 
@@ -301,6 +344,9 @@ class _RecordQueryField(Expression):
         except KeyError:
             return Undefined(obj=record, name=self.__field)
 
+    def __fields__(self):
+        return set([self.__field])
+
 
 class _RecordQueryProxy(object):
 
@@ -597,16 +643,18 @@ class Page(Record):
             if rv is not None:
                 return rv
 
-        # When we resolve URLs we also want to be able to explicitly
-        # target undiscoverable pages.  Those who know the URL are
-        # rewarded.
-        q = self.children.include_undiscoverable(True)
+        children, attachments = self._get_slug_index()
 
         for idx in range_type(len(url_path)):
             piece = '/'.join(url_path[:idx + 1])
-            child = q.filter(F._slug == piece).first()
+            child = children.get(piece)
+            if child is not None:
+                child = self.pad.get(child[0], alt=child[1], persist=False)
             if child is None:
-                attachment = self.attachments.filter(F._slug == piece).first()
+                attachment = attachments.get(piece)
+                if attachment is not None:
+                    attachment = self.pad.get(attachment[0], alt=attachment[1],
+                                              persist=False)
                 if attachment is None:
                     obj = self.pad.db.env.resolve_custom_url_path(
                         self, url_path)
@@ -623,6 +671,35 @@ class Page(Record):
                 return rv
         return None
 
+    def _get_slug_index(self):
+        """Returns two dictionaries that map the slugs of the children and
+        the attachments of this page to their paths and alts.  The index is
+        kept in the record cache which drops it together with the records
+        below this page.
+        """
+        rv = self.pad.cache.get_index('slugs', self['_path'], self.alt)
+        if rv is not None:
+            return rv
+
+        # When we resolve URLs we also want to be able to explicitly
+        # target undiscoverable pages.  Those who know the URL are
+        # rewarded.
+        children = {}
+        for child in self.children.include_undiscoverable(True):
+            children.setdefault(child['_slug'], (child['_path'], child.alt))
+        attachments = {}
+        for attachment in self.attachments:
+            attachments.setdefault(attachment['_slug'],
+                                   (attachment['_path'], attachment.alt))
+        rv = children, attachments
+
+        # Replaced children live somewhere else and would not invalidate
+        # the index, so it's only kept for regular children.
+        if self.datamodel.get_child_replacements(self) is None:
+            self.pad.cache.remember_index('slugs', self['_path'], self.alt,
+                                          rv)
+        return rv
+
     @cached_property
     def parent(self):
         """The parent of the record."""
@@ -667,31 +744,57 @@ class Page(Record):
             ctx.pad.db.track_record_dependency(siblings)
         return siblings
 
-    @cached_property
-    def _siblings(self):
+    def _get_sibling_index(self):
+        """Returns the ordered paths and alts of this page and its siblings
+        together with a dictionary that maps paths to their positions.  The
+        index is computed once per parent and kept in the record cache.
+        """
         parent = self.parent
+        rv = self.pad.cache.get_index('siblings', parent['_path'], self.alt)
+        if rv is not None:
+            return rv
+
         pagination_enabled = parent.datamodel.pagination_config.enabled
 
         # Don't track dependencies for this part.
         with Context(pad=self.pad):
             if pagination_enabled:
                 pagination = parent.pagination
-                siblings = list(pagination.config.get_pagination_query(parent))
+                query = pagination.config.get_pagination_items(parent)
             else:
-                siblings = list(parent.children)
+                query = parent.children
+
+            siblings = []
+            positions = {}
+            for sibling in query:
+                positions.setdefault(sibling['_path'], len(siblings))
+                siblings.append((sibling['_path'], sibling.alt))
+        rv = siblings, positions
+
+        # Queries over other records would not invalidate the index, so
+        # it's only kept if it covers the children of the parent.
+        if getattr(query, 'path', None) == parent['_path']:
+            self.pad.cache.remember_index('siblings', parent['_path'],
+                                          self.alt, rv)
+        return rv
 
-            prev_item, next_item = None, None
-            try:
-                me = siblings.index(self)
-            except ValueError:
-                # Self not in parents.children or not in parents.pagination.
-                pass
-            else:
+    @cached_property
+    def _siblings(self):
+        siblings, positions = self._get_sibling_index()
+
+        prev_item, next_item = None, None
+        # Self not in parents.children or not in parents.pagination.
+        me = positions.get(self['_path'])
+        if me is not None:
+            # Don't track dependencies for this part.
+            with Context(pad=self.pad):
                 if me > 0:
-                    prev_item = siblings[me - 1]
+                    path, alt = siblings[me - 1]
+                    prev_item = self.pad.get(path, alt=alt, persist=False)
 
                 if me + 1 < len(siblings):
-                    next_item = siblings[me + 1]
+                    path, alt = siblings[me + 1]
+                    next_item = self.pad.get(path, alt=alt, persist=False)
 
         return prev_item, next_item
 
@@ -752,16 +855,15 @@ class Image(Attachment):
 
     def _get_image_info(self):
         if self._image_info is None:
-            with open(self.attachment_filename, 'rb') as f:
-                self._image_info = get_image_info(f)
+            self._image_info = self.pad.db.get_image_info(
+                self.attachment_filename)
         return self._image_info
 
     @property
     def exif(self):
         """Provides access to the exif data."""
         if self._exif_cache is None:
-            with open(self.attachment_filename, 'rb') as f:
-                self._exif_cache = read_exif(f)
+            self._exif_cache = self.pad.db.read_exif(self.attachment_filename)
         return self._exif_cache
 
     @property
@@ -941,6 +1043,10 @@ class Query(object):
     only finds pages.
     """
 
+    #: Indicates that the query can match records by looking at only the
+    #: fields its filters and ordering refer to.
+    supports_partial_records = True
+
     def __init__(self, path, pad, alt=PRIMARY_ALT):
         self.path = path
         self.pad = pad
@@ -1000,8 +1106,7 @@ class Query(object):
                 return False
         return True
 
-    def _iterate(self):
-        """Low level record iteration."""
+    def _track_self_dependency(self):
         # If we iterate over children we also need to track those
         # dependencies.  There are two ways in which we track them.  The
         # first is through the start record of the query.  If that does
@@ -1016,16 +1121,100 @@ class Query(object):
         if ctx is not None:
             ctx.record_dependency(self.pad.db.to_fs_path(self.path))
 
+        return self_record
+
+    def _iter_item_names(self):
         for name, _, is_attachment in self.pad.db.iter_items(
                 self.path, alt=self.alt):
             if not ((is_attachment == self._include_attachments) or
                     (not is_attachment == self._include_pages)):
                 continue
+            yield name
 
+    def _iterate(self):
+        """Low level record iteration."""
+        self._track_self_dependency()
+        for name in self._iter_item_names():
             record = self._get(name, persist=False)
             if self._matches(record):
                 yield record
 
+    def _iterate_partial(self, fields):
+        """Like :meth:`_iterate` but yields ``(record, raw_data)`` tuples
+        where the record only has the given fields and the system fields
+        loaded.  `raw_data` is `None` if the record is already complete.
+        """
+        self_record = self._track_self_dependency()
+
+        # The default slug can refer to any field of the child, so in that
+        # case partial records would get the wrong slug.
+        if self_record is not None and \
+           self_record.datamodel.child_config.slug_format is not None:
+            for record in self._iterate():
+                yield record, None
+            return
+
+        for name in self._iter_item_names():
+            record, raw_data = self.pad._get_partial(
+                '%s/%s' % (self.path, name), fields, alt=self.alt,
+                page_num=self._page_num)
+            if record is not None and self._matches(record):
+                yield record, raw_data
+
+    def _get_referenced_fields(self):
+        """Returns the set of fields that the filters and the ordering of
+        this query refer to or `None` if that is not known.
+        """
+        rv = set()
+        for filter in self._filters or ():
+            fields = filter.__fields__()
+            if fields is None:
+                return None
+            rv.update(fields)
+        for field in self.get_order_by() or ():
+            rv.add(field.lstrip('-+'))
+        return rv
+
+    def _iter_matches(self, partial=False):
+        """Yields ``(record, raw_data)`` tuples for the matched records in
+        order with offset and limit applied.  Partial records are used if
+        `partial` is set or if they let the query skip loading the full
+        records that are filtered out.
+        """
+        fields = None
+        if self.supports_partial_records and (
+                partial or self._filters or self._offset or
+                self._limit is not None):
+            fields = self._get_referenced_fields()
+        if fields is None:
+            iterable = ((record, None) for record in self._iterate())
+        else:
+            iterable = self._iterate_partial(fields)
+
+        stop = None
+        if self._limit is not None:
+            stop = (self._offset or 0) + self._limit
+
+        order_by = self.get_order_by()
+        if order_by:
+            key = lambda x: x[0].get_sort_key(order_by)
+            # With a limit only the first records in order are needed,
+            # which a heap finds without sorting all of them.
+            if stop is not None:
+                iterable = heapq.nsmallest(stop, iterable, key=key)
+            else:
+                iterable = sorted(iterable, key=key)
+
+        if self._offset is not None or self._limit is not None:
+            iterable = islice(iterable, self._offset or 0, stop)
+
+        return iterable
+
+    def _complete(self, record, raw_data):
+        if raw_data is None:
+            return record
+        return self.pad._complete_partial(record, raw_data)
+
     def filter(self, expr):
         """Filters records by an expression."""
         rv = self._clone(mark_dirty=True)
@@ -1081,7 +1270,20 @@ class Query(object):
 
     def first(self):
         """Loads all matching records as list."""
-        return next(iter(self), None)
+        for record, raw_data in self._iter_matches(partial=True):
+            return self._complete(record, raw_data)
+        return None
+
+    def materialize(self):
+        """Runs the query once and returns a query over the matched records
+        that is cheap to iterate over again.  Iterating over it records the
+        same dependencies as iterating over this query.
+        """
+        dependencies = []
+        with Context(pad=self.pad) as ctx:
+            with ctx.gather_dependencies(dependencies.append):
+                records = list(self)
+        return MaterializedQuery(self, records, dependencies)
 
     def all(self):
         """Loads all matching records as list."""
@@ -1108,7 +1310,7 @@ class Query(object):
     def count(self):
         """Counts all matched objects."""
         rv = 0
-        for item in self:
+        for item in self._iter_matches(partial=True):
             rv += 1
         return rv
 
@@ -1143,19 +1345,8 @@ class Query(object):
 
     def __iter__(self):
         """Iterates over all records matched."""
-        iterable = self._iterate()
-
-        order_by = self.get_order_by()
-        if order_by:
-            iterable = sorted(
-                iterable, key=lambda x: x.get_sort_key(order_by))
-
-        if self._offset is not None or self._limit is not None:
-            iterable = islice(iterable, self._offset or 0,
-                              (self._offset or 0) + self._limit)
-
-        for item in iterable:
-            yield item
+        for record, raw_data in self._iter_matches():
+            yield self._complete(record, raw_data)
 
     def __repr__(self):
         return '<%s %r%s>' % (
@@ -1166,6 +1357,7 @@ class Query(object):
 
 
 class EmptyQuery(Query):
+    supports_partial_records = False
 
     def _get(self, id, persist=True, page_num=Ellipsis):
         pass
@@ -1175,6 +1367,36 @@ class EmptyQuery(Query):
         return iter(())
 
 
+class MaterializedQuery(Query):
+    """A query over the records that another query already matched and
+    sorted.  Further filters and orderings still apply.
+    """
+    supports_partial_records = False
+
+    def __init__(self, query, records, dependencies):
+        Query.__init__(self, query.path, query.pad, alt=query.alt)
+        self._records = records
+        self._dependencies = dependencies
+        # The records already passed the checks of the original query.
+        self._include_undiscoverable = True
+
+    def get_order_by(self):
+        return self._order_by
+
+    def _iterate(self):
+        ctx = get_ctx()
+        if ctx is not None:
+            for dependency in self._dependencies:
+                if isinstance(dependency, string_types):
+                    ctx.record_dependency(dependency)
+                else:
+                    ctx.record_virtual_dependency(dependency)
+
+        for record in self._records:
+            if self._matches(record):
+                yield record
+
+
 class AttachmentsQuery(Query):
     """Specialized query class that only finds attachments."""
 
@@ -1231,7 +1453,7 @@ def _iter_filename_choices(fn_base, alts, config, fallback=True):
         yield fn_base + '.lr', PRIMARY_ALT, True
 
 
-def _iter_content_files(dir_path, alts):
+def _iter_content_files(dir_path, alts, isfile=os.path.isfile):
     """Returns an iterator over all existing content files below the given
     directory.  This yields specific files for alts before it falls back
     to the primary alt.
@@ -1239,9 +1461,9 @@ def _iter_content_files(dir_path, alts):
     for alt in alts:
         if alt == PRIMARY_ALT:
             continue
-        if os.path.isfile(os.path.join(dir_path, 'contents+%s.lr' % alt)):
+        if isfile(os.path.join(dir_path, 'contents+%s.lr' % alt)):
             yield alt
-    if os.path.isfile(os.path.join(dir_path, 'contents.lr')):
+    if isfile(os.path.join(dir_path, 'contents.lr')):
         yield PRIMARY_ALT
 
 
@@ -1262,6 +1484,80 @@ class Database(object):
         self.config = config
         self.datamodels = load_datamodels(env)
         self.flowblocks = load_flowblocks(env)
+        # A :class:`lektor.buildcaches.FileSystemSnapshot` that is consulted
+        # instead of the file system while a builder provides one.
+        self.fs_snapshot = None
+
+    def get_build_cache(self, name):
+        """Returns the build state cache with the given name (for instance
+        ``'record_index'``) of the builder that is building this database
+        in the current thread, or `None`.
+        """
+        builder = get_active_builder()
+        if builder is None or builder.pad.db is not self:
+            return None
+        return getattr(builder, name, None)
+
+    def isfile(self, path):
+        """Like :func:`os.path.isfile` but answered from the file system
+        snapshot if there is one.
+        """
+        if self.fs_snapshot is not None:
+            rv = self.fs_snapshot.isfile(path)
+            if rv is not None:
+                return rv
+        return os.path.isfile(path)
+
+    def listdir(self, path):
+        """Like :func:`os.listdir` but answered from the file system
+        snapshot if there is one.
+        """
+        if self.fs_snapshot is not None:
+            rv = self.fs_snapshot.listdir(path)
+            if rv is not None:
+                return rv
+        return os.listdir(path)
+
+    def load_tokens(self, fs_path):
+        """Returns the ``(key, value)`` pairs of a record file.  They come
+        from the record index if the file did not change since it was last
+        parsed.  Raises :exc:`IOError` if the file does not exist.
+        """
+        if self.fs_snapshot is not None and \
+           self.fs_snapshot.isfile(fs_path) is False:
+            raise IOError(errno.ENOENT, 'No such file', fs_path)
+        index = self.get_build_cache('record_index')
+        if index is not None:
+            rv = index.get_tokens(fs_path)
+            if rv is not None:
+                return rv
+        with open(fs_path, 'rb') as f:
+            rv = [(key, u''.join(lines)) for key, lines
+                  in metaformat.tokenize(f, encoding='utf-8')]
+        if index is not None:
+            index.remember(fs_path, rv)
+        return rv
+
+    def get_image_info(self, filename):
+        """Returns the format, width and height of an image.  They come from
+        the image info cache if the file did not change since it was last
+        read.
+        """
+        cache = self.get_build_cache('image_info_cache')
+        if cache is not None:
+            return cache.get_image_info(filename)
+        with open(filename, 'rb') as f:
+            return get_image_info(f)
+
+    def read_exif(self, filename):
+        """Returns the EXIF data of an image.  Like :meth:`get_image_info`
+        this uses the image info cache if there is one.
+        """
+        cache = self.get_build_cache('image_info_cache')
+        if cache is not None:
+            return cache.read_exif(filename)
+        with open(filename, 'rb') as f:
+            return read_exif(f)
 
     def to_fs_path(self, path):
         """Convenience function to convert a path into an file system path."""
@@ -1292,16 +1588,16 @@ class Database(object):
                 break
 
             try:
-                with open(fs_path, 'rb') as f:
-                    if rv_type is None:
-                        rv_type = is_attachment
-                    for key, lines in metaformat.tokenize(f, encoding='utf-8'):
-                        if key not in rv:
-                            rv[key] = u''.join(lines)
+                tokens = self.load_tokens(fs_path)
+                if rv_type is None:
+                    rv_type = is_attachment
+                for key, value in tokens:
+                    if key not in rv:
+                        rv[key] = value
             except IOError as e:
                 if e.errno not in (errno.ENOTDIR, errno.ENOENT):
                     raise
-                if not is_attachment or not os.path.isfile(fs_path[:-3]):
+                if not is_attachment or not self.isfile(fs_path[:-3]):
                     continue
                 # Special case: we are loading an attachment but the meta
                 # data file does not exist.  In that case we still want to
@@ -1340,7 +1636,7 @@ class Database(object):
         choiceiter = _iter_filename_choices(fn_base, alts, self.config)
 
         for fs_path, actual_alt, is_attachment in choiceiter:
-            if not os.path.isfile(fs_path):
+            if not self.isfile(fs_path):
                 continue
 
             # This path is actually for an attachment, which means that we
@@ -1351,7 +1647,7 @@ class Database(object):
 
             try:
                 dir_path = os.path.dirname(fs_path)
-                for filename in os.listdir(dir_path):
+                for filename in self.listdir(dir_path):
                     if not isinstance(filename, text_type):
                         try:
                             filename = filename.decode(fs_enc)
@@ -1364,14 +1660,15 @@ class Database(object):
 
                     # We found an attachment.  Attachments always live
                     # below the primary alt, so we report it as such.
-                    if os.path.isfile(os.path.join(dir_path, filename)):
+                    if self.isfile(os.path.join(dir_path, filename)):
                         yield filename, PRIMARY_ALT, True
 
                     # We found a directory, let's make sure it contains a
                     # contents.lr file (or a contents+alt.lr file).
                     else:
                         for content_alt in _iter_content_files(
-                                os.path.join(dir_path, filename), alts):
+                                os.path.join(dir_path, filename), alts,
+                                isfile=self.isfile):
                             yield filename, content_alt, False
                             # If we want a single alt, we break here so
                             # that we only produce a single result.
@@ -1761,11 +2058,46 @@ class Pad(object):
                 return node
         return None
 
-    def instance_from_data(self, raw_data, datamodel=None, page_num=None):
+    def _get_partial(self, path, fields, alt=PRIMARY_ALT, page_num=None):
+        """Loads a record with only the given fields and the system fields
+        deserialized.  Returns ``(record, raw_data)``.  If the full record
+        is already cached it is returned instead and `raw_data` is `None`.
+        Partial records are never cached.
+        """
+        path = cleanup_path(path)
+        virtual_path = None
+        if page_num is not None:
+            virtual_path = str(page_num)
+
+        rv = self.cache.get(path, alt, virtual_path)
+        if rv is not Ellipsis:
+            if rv is not None:
+                self.db.track_record_dependency(rv)
+            return rv, None
+
+        raw_data = self.db.load_raw_data(path, alt=alt)
+        if raw_data is None:
+            self.cache.remember_as_missing(path, alt, virtual_path)
+            return None, None
+
+        rv = self.instance_from_data(raw_data, page_num=page_num,
+                                     fields=fields)
+        return self.db.track_record_dependency(rv), raw_data
+
+    def _complete_partial(self, record, raw_data):
+        """Returns the full record for a record from :meth:`_get_partial`."""
+        rv = self.cache.get(record)
+        if rv is Ellipsis:
+            rv = self.instance_from_data(raw_data, page_num=record.page_num)
+            self.cache.remember(rv)
+        return rv
+
+    def instance_from_data(self, raw_data, datamodel=None, page_num=None,
+                           fields=None):
         """This creates an instance from the given raw data."""
         if datamodel is None:
             datamodel = self.db.get_datamodel_for_raw_data(raw_data, self)
-        data = datamodel.process_raw_data(raw_data, self)
+        data = datamodel.process_raw_data(raw_data, self, fields=fields)
         self.db.process_data(data, datamodel, self)
         cls = self.db.get_record_class(datamodel, data)
         return cls(self, data, page_num=page_num)
@@ -1971,6 +2303,7 @@ class RecordCache(object):
     def __init__(self, ephemeral_cache_size=1000):
         self.persistent = {}
         self.ephemeral = LRUCache(ephemeral_cache_size)
+        self.indexes = {}
 
     def _get_cache_key(self, record_or_path, alt=PRIMARY_ALT,
                        virtual_path=None):
@@ -1987,6 +2320,31 @@ class RecordCache(object):
         """Flushes the cache"""
         self.persistent.clear()
         self.ephemeral.clear()
+        self.indexes.clear()
+
+    def forget(self, paths):
+        """Forgets the cached records at the given paths and everything
+        below them in all alternatives.
+        """
+        paths = set(path.strip('/') for path in paths)
+        if '' in paths:
+            return self.flush()
+
+        def _is_affected(cache_key):
+            path = cache_key[0]
+            while path:
+                if path in paths:
+                    return True
+                path = path.rpartition('/')[0]
+            return False
+
+        for cache in self.persistent, self.ephemeral, self.indexes:
+            for cache_key in [x for x in cache.keys() if _is_affected(x)]:
+                # Another thread sharing the pad might have been faster.
+                try:
+                    del cache[cache_key]
+                except KeyError:
+                    pass
 
     def is_persistent(self, record):
         """Indicates if a record is in the persistent record cache."""
@@ -2027,6 +2385,16 @@ class RecordCache(object):
             return rv
         return Ellipsis
 
+    def get_index(self, name, path, alt=PRIMARY_ALT):
+        """Looks up an index over the children of a record.  Indexes are
+        forgotten together with the records below that record.
+        """
+        return self.indexes.get((path.strip('/'), alt, name))
+
+    def remember_index(self, name, path, alt, index):
+        """Remembers an index over the children of a record."""
+        self.indexes[(path.strip('/'), alt, name)] = index
+
     def remember_as_missing(self, path, alt=PRIMARY_ALT, virtual_path=None):
         cache_key = self._get_cache_key(path, alt, virtual_path)
         self.persistent.pop(cache_key, None)
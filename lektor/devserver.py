@@ -5,8 +5,7 @@ import threading
 
 from werkzeug.serving import run_simple, WSGIRequestHandler
 
-from lektor.db import Database
-from lektor.builder import Builder, process_extra_flags
+from lektor.builder import WatchBuilder, process_extra_flags
 from lektor.watcher import Watcher
 from lektor.reporter import CliReporter
 from lektor.admin import WebAdmin
@@ -25,7 +24,7 @@ class SilentWSGIRequestHandler(WSGIRequestHandler):
 class BackgroundBuilder(threading.Thread):
 
     def __init__(self, env, output_path, prune=True, verbosity=0,
-                 extra_flags=None):
+                 extra_flags=None, watch_builder=None):
         threading.Thread.__init__(self)
         watcher = Watcher(env, output_path)
         watcher.observer.start()
@@ -36,17 +35,23 @@ class BackgroundBuilder(threading.Thread):
         self.verbosity = verbosity
         self.last_build = time.time()
         self.extra_flags = extra_flags
+        if watch_builder is None:
+            watch_builder = WatchBuilder(env, output_path, prune=prune,
+                                         extra_flags=extra_flags)
+        self.watch_builder = watch_builder
 
     def build(self, update_source_info_first=False):
         try:
-            db = Database(self.env)
-            builder = Builder(db.new_pad(), self.output_path,
-                              extra_flags=self.extra_flags)
-            if update_source_info_first:
-                builder.update_all_source_infos()
-            builder.build_all()
-            if self.prune:
-                builder.prune()
+            self.watch_builder.build_all(
+                update_source_info_first=update_source_info_first)
+        except Exception:
+            traceback.print_exc()
+        else:
+            self.last_build = time.time()
+
+    def build_changed(self, filenames):
+        try:
+            self.watch_builder.build_changed(filenames)
         except Exception:
             traceback.print_exc()
         else:
@@ -55,9 +60,8 @@ class BackgroundBuilder(threading.Thread):
     def run(self):
         with CliReporter(self.env, verbosity=self.verbosity):
             self.build(update_source_info_first=True)
-            for ts, _, _ in self.watcher:
-                if self.last_build is None or ts > self.last_build:
-                    self.build()
+            for changes in self.watcher.iter_changes():
+                self.build_changed(changes)
 
 
 class DevTools(object):
@@ -105,10 +109,15 @@ def run_server(bindaddr, env, output_path, prune=True, verbosity=0,
     in_main_process = not lektor_dev or wz_as_main
     extra_flags = process_extra_flags(extra_flags)
 
+    # The background builder and the admin share one warm pad.
+    watch_builder = WatchBuilder(env, output_path, prune=prune,
+                                 extra_flags=extra_flags)
+
     if in_main_process:
         background_builder = BackgroundBuilder(env, output_path=output_path,
                                                prune=prune, verbosity=verbosity,
-                                               extra_flags=extra_flags)
+                                               extra_flags=extra_flags,
+                                               watch_builder=watch_builder)
         background_builder.setDaemon(True)
         background_builder.start()
         env.plugin_controller.emit('server-spawn', bindaddr=bindaddr,
@@ -116,7 +125,7 @@ def run_server(bindaddr, env, output_path, prune=True, verbosity=0,
 
     app = WebAdmin(env, output_path=output_path, verbosity=verbosity,
                    debug=lektor_dev, ui_lang=ui_lang,
-                   extra_flags=extra_flags)
+                   extra_flags=extra_flags, watch_builder=watch_builder)
 
     dt = None
     if lektor_dev and not wz_as_main:
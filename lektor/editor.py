@@ -298,6 +298,9 @@ class EditorSession(object):
                 self._delete_impl()
             else:
                 self._save_impl()
+            # Records remember their parent and siblings, so the pad
+            # forgets everything below the parent.
+            self.pad.cache.forget([posixpath.dirname(self.path)])
         self.closed = True
 
     def delete(self, recursive=None, delete_master=False):
@@ -341,6 +344,7 @@ class EditorSession(object):
 
         with atomic_open(fn, 'wb') as f:
             shutil.copyfileobj(fp, f)
+        self.pad.cache.forget([self.path])
         return safe_filename
 
     def _attachment_delete_impl(self):
@@ -1,5 +1,6 @@
 import copy
 import fnmatch
+import hashlib
 import os
 import re
 import uuid
@@ -8,6 +9,7 @@ from collections import OrderedDict
 
 import jinja2
 from jinja2.loaders import split_template_path
+from jinja2.utils import LRUCache
 from babel import dates
 from inifile import IniFile
 from werkzeug.urls import url_parse
@@ -27,6 +29,20 @@ from lektor.utils import (bool_from_string, format_lat_long, secure_url,
 PRIMARY_ALT = '_primary'
 DEFAULT_CONFIG = {
     'IMAGEMAGICK_EXECUTABLE': None,
+    'CHECKSUM_ALGORITHM': 'sha1',
+    # The build caches below are configured in the ``[env]`` section of
+    # the project file and are all off by default:
+    #
+    # ``record_index``: remember parsed content files in the build state.
+    # ``markdown_cache_size``: number of rendered markdown fields that are
+    #   kept in the build state.
+    # ``thumbnail_cache``: keep generated thumbnails in the project's
+    #   cache folder so that they survive a clean of the build folder.
+    'RECORD_INDEX': False,
+    'MARKDOWN_CACHE_SIZE': 0,
+    'THUMBNAIL_JOBS': None,
+    'THUMBNAIL_CACHE': False,
+    'THUMBNAIL_BACKEND': 'imagemagick',
     'EPHEMERAL_RECORD_CACHE_SIZE': 500,
     'ATTACHMENT_TYPES': {
         # Only enable image formats here that we can handle in imagetools.
@@ -86,7 +102,7 @@ def _pass_locale(func):
 
 def update_config_from_ini(config, inifile):
     def set_simple(target, source_path):
-        rv = config.get(source_path)
+        rv = inifile.get(source_path)
         if rv is not None:
             config[target] = rv
 
@@ -94,6 +110,18 @@ def update_config_from_ini(config, inifile):
                source_path='env.imagemagick_executable')
     set_simple(target='LESSC_EXECUTABLE',
                source_path='env.lessc_executable')
+    set_simple(target='CHECKSUM_ALGORITHM',
+               source_path='env.checksum_algorithm')
+    set_simple(target='RECORD_INDEX',
+               source_path='env.record_index')
+    set_simple(target='MARKDOWN_CACHE_SIZE',
+               source_path='env.markdown_cache_size')
+    set_simple(target='THUMBNAIL_JOBS',
+               source_path='env.thumbnail_jobs')
+    set_simple(target='THUMBNAIL_CACHE',
+               source_path='env.thumbnail_cache')
+    set_simple(target='THUMBNAIL_BACKEND',
+               source_path='env.thumbnail_backend')
 
     for section_name in ('ATTACHMENT_TYPES', 'PROJECT', 'PACKAGES', 'THEME_SETTINGS'):
         section_config = inifile.section_as_dict(section_name.lower())
@@ -144,6 +172,18 @@ def any_fnmatch(filename, patterns):
     return False
 
 
+def compile_fnmatch(patterns):
+    """Compiles glob patterns into a single regular expression and returns
+    its match method.  Matching against it is equivalent to calling
+    :func:`any_fnmatch` but a lot faster when done over and over.
+    """
+    flags = 0
+    if os.path.normcase('A') == 'a':
+        flags = re.IGNORECASE
+    rv = '|'.join('(?:%s)' % fnmatch.translate(pat) for pat in patterns)
+    return re.compile(rv or '(?!)', flags).match
+
+
 class ServerInfo(object):
 
     def __init__(self, id, name_i18n, target, enabled=True, default=False,
@@ -208,8 +248,60 @@ class FormatExpression(object):
         return self.tmpl.render(values)
 
 
+class BytecodeCache(jinja2.FileSystemBytecodeCache):
+    """A bytecode cache that creates its folder once the first template
+    is stored.  If the folder cannot be created, nothing is stored.
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                return
+        jinja2.FileSystemBytecodeCache.dump_bytecode(self, bucket)
+
+
 class CustomJinjaEnvironment(jinja2.Environment):
 
+    def __init__(self, *args, **kwargs):
+        jinja2.Environment.__init__(self, *args, **kwargs)
+        self._string_templates = LRUCache(1000)
+
+    def from_string(self, source, globals=None, template_class=None):
+        """Like the regular method but templates compiled from the same
+        source are shared.  If there is a bytecode cache, their bytecode is
+        kept there so that other processes do not need to compile them.
+        """
+        if globals is not None or template_class is not None:
+            return jinja2.Environment.from_string(
+                self, source, globals, template_class)
+        rv = self._string_templates.get(source)
+        if rv is None:
+            rv = self._compile_string(source)
+            self._string_templates[source] = rv
+        return rv
+
+    def _compile_string(self, source):
+        bcc = self.bytecode_cache
+        if bcc is None:
+            return jinja2.Environment.from_string(self, source)
+        # The name is part of the cache key, so it has to be unique to the
+        # source as there is no file backing it.
+        name = '<string:%s>' % hashlib.sha1(
+            source.encode('utf-8')).hexdigest()
+        bucket = bcc.get_bucket(self, name, None, source)
+        code = bucket.code
+        if code is None:
+            code = self.compile(source)
+            bucket.code = code
+            try:
+                bcc.set_bucket(bucket)
+            except (IOError, OSError):
+                pass
+        return self.template_class.from_code(
+            self, code, self.make_globals(None), None)
+
     def _load_template(self, name, globals):
         ctx = get_ctx()
 
@@ -426,13 +518,18 @@ class Environment(object):
         template_paths = [os.path.join(path, 'templates')
                           for path in [self.root_path] + self.theme_paths]
 
+        # Compiled templates are kept across processes in the cache folder
+        # of the project.
+        bytecode_cache = BytecodeCache(project.get_template_cache_path())
+
         self.jinja_env = CustomJinjaEnvironment(
             autoescape=self.select_jinja_autoescape,
             extensions=['jinja2.ext.autoescape',
                         'jinja2.ext.with_',
                         'jinja2.ext.do'],
             loader=jinja2.FileSystemLoader(
-                template_paths)
+                template_paths),
+            bytecode_cache=bytecode_cache,
         )
 
         from lektor.db import F, get_alts
@@ -1,19 +1,24 @@
 # -*- coding: utf-8 -*-
 import decimal
+import hashlib
 import os
 import imghdr
 import re
 import struct
 import posixpath
+import tempfile
 import warnings
+from collections import namedtuple
 from datetime import datetime
 from enum import IntEnum
 from xml.etree import ElementTree as etree
 import exifread
+from werkzeug.posixemulation import rename
 
 from lektor.utils import get_dependent_url, portable_popen, locate_executable
 from lektor.reporter import reporter
-from lektor._compat import iteritems, text_type, PY2
+from lektor._compat import iteritems, itervalues, range_type, text_type, \
+     PY2
 
 
 # yay shitty library
@@ -78,15 +83,102 @@ def _parse_svg_units_px(length):
         return None
 
 
+#: The number of the Orientation tag in the first IFD of EXIF data.
+_EXIF_ORIENTATION_TAG = 0x0112
+
+#: The values of the Orientation tag that rotate the image by 90 degrees.
+_ROTATED_ORIENTATIONS = frozenset([5, 6, 7, 8])
+
+
+#: The EXIF tags that :class:`EXIFInfo` reads.  Only these are kept when
+#: EXIF data is cached.
+_EXIF_TAGS = (
+    'Image Artist', 'Image Copyright', 'Image Make', 'Image Model',
+    'Image DocumentName', 'Image ImageDescription', 'Image Orientation',
+    'Image DateTime', 'Image DateTimeOriginal',
+    'EXIF LensMake', 'EXIF LensModel', 'EXIF ApertureValue', 'EXIF FNumber',
+    'EXIF ExposureTime', 'EXIF ShutterSpeedValue', 'EXIF FocalLength',
+    'EXIF FocalLengthIn35mmFilm', 'EXIF Flash', 'EXIF ISOSpeedRatings',
+    'EXIF DateTimeOriginal', 'EXIF DateTimeDigitized',
+    'GPS GPSDate', 'GPS GPSLongitude', 'GPS GPSLongitudeRef',
+    'GPS GPSLatitude', 'GPS GPSLatitudeRef', 'GPS GPSAltitude',
+    'GPS GPSAltitudeRef',
+)
+
+
+class _CachedRatio(object):
+    """Stands in for the ratios of exifread in cached EXIF data."""
+
+    def __init__(self, num, den):
+        self.num = num
+        self.den = den
+
+
+class _CachedTag(object):
+    """Stands in for the tags of exifread in cached EXIF data."""
+
+    def __init__(self, printable, values):
+        self.printable = printable
+        self.values = values
+
+
+def _dump_exif_value(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if hasattr(value, 'num') and hasattr(value, 'den'):
+        return {'num': value.num, 'den': value.den}
+    return value
+
+
+def _load_exif_value(value):
+    if isinstance(value, dict):
+        return _CachedRatio(value['num'], value['den'])
+    return value
+
+
 class EXIFInfo(object):
 
-    def __init__(self, d):
+    def __init__(self, d, present=None):
         self._mapping = d
+        # Cached EXIF data might lack all tags that are read here even
+        # though the image has EXIF data.
+        if present is None:
+            present = bool(d)
+        self._present = present
 
     def __bool__(self):
-        return bool(self._mapping)
+        return self._present
     __nonzero__ = __bool__
 
+    def to_json(self):
+        """Returns the tags this class reads in a form that can be
+        serialized to JSON.  :meth:`from_json` restores them.
+        """
+        tags = {}
+        for key in _EXIF_TAGS:
+            tag = self._mapping.get(key)
+            if tag is None:
+                continue
+            values = tag.values
+            if isinstance(values, (list, tuple)):
+                values = [_dump_exif_value(x) for x in values]
+            else:
+                values = _dump_exif_value(values)
+            tags[key] = [_dump_exif_value(tag.printable), values]
+        return {'present': bool(self), 'tags': tags}
+
+    @classmethod
+    def from_json(cls, data):
+        """Creates EXIF info from the return value of :meth:`to_json`."""
+        mapping = {}
+        for key, (printable, values) in iteritems(data['tags']):
+            if isinstance(values, list):
+                values = [_load_exif_value(x) for x in values]
+            else:
+                values = _load_exif_value(values)
+            mapping[key] = _CachedTag(printable, values)
+        return cls(mapping, present=data['present'])
+
     def to_dict(self):
         rv = {}
         for key, value in iteritems(self.__class__.__dict__):
@@ -282,7 +374,7 @@ class EXIFInfo(object):
         (rotated 90deg left, right, and mirrored versions of those), i.e.,
         the image is rotated.
         """
-        return self._get_int('Image Orientation') in {5, 6, 7, 8}
+        return self._get_int('Image Orientation') in _ROTATED_ORIENTATIONS
 
 
 def get_suffix(width, height, mode, quality=None):
@@ -349,6 +441,7 @@ def get_image_info(fp):
         # we are looking for a SOF marker ("start of frame").
         # skip over the "start of image" marker (imghdr took care of that).
         fp.seek(2)
+        orientation = None
 
         while True:
             byte = fp.read(1)
@@ -366,7 +459,12 @@ def get_image_info(fp):
             if ord(byte) not in _JPEG_SOF_MARKERS:
                 # header length parameter takes 2 bytes for all markers
                 length = struct.unpack('>H', fp.read(2))[0]
-                fp.seek(length - 2, 1)
+                if ord(byte) == 0xe1 and orientation is None:
+                    # APP1, which holds the EXIF data.
+                    orientation = _parse_exif_orientation(
+                        fp.read(length - 2))
+                else:
+                    fp.seek(length - 2, 1)
                 continue
 
             # else...
@@ -391,9 +489,7 @@ def get_image_info(fp):
         # the image rotated, and any template computations are likely to want
         # to make decisions based on the "visual", not the "real" dimensions.
         # thumbnail code also depends on this behaviour.)
-        fp.seek(0)
-        exif = read_exif(fp)
-        if exif.is_rotated:
+        if orientation in _ROTATED_ORIENTATIONS:
             width, height = height, width
     else:
         fmt = None
@@ -401,9 +497,48 @@ def get_image_info(fp):
     return fmt, width, height
 
 
+def _parse_exif_orientation(data):
+    """Returns the value of the Orientation tag from the contents of an
+    APP1 segment of a JPEG or `None`.  Only the header of the TIFF
+    structure and the first IFD are looked at, which is where the tag is.
+    """
+    if data[:6] != b'Exif\x00\x00':
+        return None
+    tiff = data[6:]
+    if tiff[:4] == b'II*\x00':
+        endian = '<'
+    elif tiff[:4] == b'MM\x00*':
+        endian = '>'
+    else:
+        return None
+
+    try:
+        offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+        count = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+        for idx in range_type(count):
+            entry = offset + 2 + idx * 12
+            tag, value_type = struct.unpack(endian + 'HH',
+                                            tiff[entry:entry + 4])
+            if tag != _EXIF_ORIENTATION_TAG:
+                continue
+            # The value is a short, some writers use a long.
+            if value_type == 3:
+                return struct.unpack(endian + 'H',
+                                     tiff[entry + 8:entry + 10])[0]
+            if value_type == 4:
+                return struct.unpack(endian + 'I',
+                                     tiff[entry + 8:entry + 12])[0]
+            return None
+    except struct.error:
+        pass
+    return None
+
+
 def read_exif(fp):
     """Reads exif data from a file pointer of an image and returns it."""
-    exif = exifread.process_file(fp)
+    # MakerNotes are not needed for anything in EXIFInfo and are by far
+    # the most expensive part to parse.
+    exif = exifread.process_file(fp, details=False)
     return EXIFInfo(exif)
 
 
@@ -467,6 +602,154 @@ def compute_dimensions(width, height, source_width, source_height):
 
     return computed_width, computed_height
 
+#: A thumbnail that a :class:`ThumbnailBackend` is asked to produce.
+ThumbnailJob = namedtuple('ThumbnailJob', ['dst_filename', 'width', 'height',
+                                           'mode', 'quality'])
+
+
+class ThumbnailBackend(object):
+    """The interface of the programs that produce thumbnails.  Backends
+    are registered in :data:`thumbnail_backends` and selected with the
+    ``thumbnail_backend`` setting of the ``[env]`` section.
+    """
+
+    #: The name the backend is registered as.
+    name = None
+
+    def process(self, ctx, source_image, jobs, callback, artifacts=()):
+        """Writes the thumbnails described by a list of
+        :class:`ThumbnailJob` objects for one source image and invokes
+        `callback` without arguments once they exist.  Backends may do the
+        work in the background with the thumbnail pool of the builder, in
+        which case the program is submitted for the given `artifacts`.
+        Failures are signalled by raising an exception, either from this
+        method or from the callback of the pool, and must not leave any of
+        the files behind.
+        """
+        raise NotImplementedError()
+
+
+class ImageMagickBackend(ThumbnailBackend):
+    """Runs the ``convert`` program of imagemagick once per source image.
+    Multiple thumbnails are written from clones of the decoded source.
+    """
+
+    name = 'imagemagick'
+
+    def get_job_args(self, job):
+        """Returns the arguments that turn the source into a thumbnail."""
+        resize_key = ''
+        if job.width is not None:
+            resize_key += str(job.width)
+        if job.height is not None:
+            resize_key += 'x' + str(job.height)
+
+        if job.mode == ThumbnailMode.STRETCH:
+            resize_key += '!'
+
+        if job.mode == ThumbnailMode.CROP:
+            rv = ['-resize', resize_key + '^',
+                  '-gravity', 'Center',
+                  '-extent', resize_key]
+        else:
+            rv = ['-resize', resize_key]
+
+        return rv + ['-quality', str(job.quality)]
+
+    def process(self, ctx, source_image, jobs, callback, artifacts=()):
+        im = find_imagemagick(
+            ctx.build_state.config['IMAGEMAGICK_EXECUTABLE'])
+
+        cmdline = [im, source_image, '-auto-orient']
+        if len(jobs) == 1:
+            cmdline += self.get_job_args(jobs[0]) + [jobs[0].dst_filename]
+        else:
+            for job in jobs:
+                cmdline += ['(', '+clone'] + self.get_job_args(job) + \
+                    ['-write', job.dst_filename, '+delete', ')']
+            cmdline.append('null:')
+
+        def _finish(returncode):
+            if returncode != 0:
+                for job in jobs:
+                    if os.path.isfile(job.dst_filename):
+                        os.remove(job.dst_filename)
+                raise RuntimeError('imagemagick failed to produce thumbnails '
+                                   'of "%s" (exit code %d)' % (source_image,
+                                                               returncode))
+            callback()
+
+        reporter.report_debug_info('imagemagick cmd line', cmdline)
+        # With a pool the program keeps running after the update block of
+        # the artifacts ended.  They are committed once it finished.
+        pool = ctx.build_state.builder.thumbnail_pool
+        if pool is None:
+            _finish(portable_popen(cmdline).wait())
+        else:
+            pool.submit(cmdline, _finish, artifacts)
+
+
+class PillowBackend(ThumbnailBackend):
+    """Resizes images in process with Pillow, which avoids starting a
+    program for every thumbnail.  This requires the `Pillow` package.
+    """
+
+    name = 'pillow'
+
+    def resize(self, img, job):
+        """Returns the resized image for a job."""
+        from PIL import Image as PILImage, ImageOps
+        width, height = job.width, job.height
+        if job.mode == ThumbnailMode.CROP:
+            return ImageOps.fit(img, (width, height), PILImage.LANCZOS)
+        if job.mode != ThumbnailMode.STRETCH:
+            width, height = compute_dimensions(
+                width, height, img.size[0], img.size[1])
+        return img.resize((width, height), PILImage.LANCZOS)
+
+    def process(self, ctx, source_image, jobs, callback, artifacts=()):
+        try:
+            from PIL import Image as PILImage, ImageOps
+        except ImportError:
+            raise RuntimeError('The pillow thumbnail backend requires the '
+                               'Pillow package.')
+
+        img = PILImage.open(source_image)
+        try:
+            img = ImageOps.exif_transpose(img)
+            for job in jobs:
+                thumbnail = self.resize(img, job)
+                options = {}
+                ext = os.path.splitext(job.dst_filename)[1].lower()
+                if ext in ('.jpg', '.jpeg'):
+                    if thumbnail.mode not in ('RGB', 'L', 'CMYK'):
+                        thumbnail = thumbnail.convert('RGB')
+                    options['quality'] = job.quality
+                thumbnail.save(job.dst_filename, **options)
+        finally:
+            img.close()
+        callback()
+
+
+#: The available thumbnail backends by name.  Plugins can register
+#: additional subclasses of :class:`ThumbnailBackend` here.
+thumbnail_backends = {
+    'imagemagick': ImageMagickBackend,
+    'pillow': PillowBackend,
+}
+
+
+def get_thumbnail_backend(name=None):
+    """Returns an instance of the thumbnail backend with the given name.
+    By default this is imagemagick.
+    """
+    rv = thumbnail_backends.get(name or 'imagemagick')
+    if rv is None:
+        raise RuntimeError('Unknown thumbnail backend %r.  Supported are: '
+                           '%s' % (name, ', '.join(sorted(thumbnail_backends))))
+    return rv()
+
+
 def process_image(ctx, source_image, dst_filename,
                   width=None, height=None, mode=ThumbnailMode.DEFAULT,
                   quality=None):
@@ -477,34 +760,120 @@ def process_image(ctx, source_image, dst_filename,
     """
     if width is None and height is None:
         raise ValueError("Must specify at least one of width or height.")
+    process_images(ctx, source_image,
+                   [ThumbnailJob(dst_filename, width, height, mode, quality)])
 
-    im = find_imagemagick(
-        ctx.build_state.config['IMAGEMAGICK_EXECUTABLE'])
-
-    if quality is None:
-        quality = get_quality(source_image)
-
-    resize_key = ''
-    if width is not None:
-        resize_key += str(width)
-    if height is not None:
-        resize_key += 'x' + str(height)
 
-    if mode == ThumbnailMode.STRETCH:
-        resize_key += '!'
+def process_images(ctx, source_image, jobs, artifacts=()):
+    """Like :func:`process_image` but produces all thumbnails in a list of
+    :class:`ThumbnailJob` objects from a single pass over the source.  If
+    the thumbnails are produced in the background, the given artifacts are
+    only committed once they are done.
+    """
+    backend = get_thumbnail_backend(
+        ctx.build_state.config['THUMBNAIL_BACKEND'])
+    cache = ctx.build_state.builder.thumbnail_cache
+
+    # The backend writes into temporary files that only replace the
+    # destinations once it succeeded.  This way a destination that is
+    # linked to the thumbnail cache is never written to.  The extension is
+    # kept as the backends pick the output format based on it.
+    tmp_jobs = []
+    finished = []
+    for job in jobs:
+        if job.quality is None:
+            job = job._replace(quality=get_quality(source_image))
+
+        key = None
+        if cache is not None:
+            key = get_thumbnail_cache_key(ctx, backend, source_image, job)
+            if cache.lookup(key, job.dst_filename):
+                reporter.report_debug_info('cached thumbnail', key)
+                continue
 
-    cmdline = [im, source_image, '-auto-orient']
-    if mode == ThumbnailMode.CROP:
-        cmdline += ['-resize', resize_key + '^',
-                    '-gravity', 'Center',
-                    '-extent', resize_key]
-    else:
-        cmdline += ['-resize', resize_key]
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(job.dst_filename), prefix='.__trans',
+            suffix=os.path.splitext(job.dst_filename)[1])
+        os.close(fd)
+        tmp_jobs.append(job._replace(dst_filename=tmp_filename))
+        finished.append((tmp_filename, job.dst_filename, key))
+
+    if not tmp_jobs:
+        return
+
+    def _finish():
+        for tmp_filename, dst_filename, key in finished:
+            os.chmod(tmp_filename, 0o644)
+            rename(tmp_filename, dst_filename)
+            if key is not None:
+                cache.store(key, dst_filename)
+
+    def _cleanup():
+        for tmp_filename, _dst_filename, _key in finished:
+            if os.path.isfile(tmp_filename):
+                os.remove(tmp_filename)
+
+    def _finish_or_cleanup():
+        try:
+            _finish()
+        except Exception:
+            _cleanup()
+            raise
 
-    cmdline += ['-quality', str(quality), dst_filename]
+    try:
+        backend.process(ctx, source_image, tmp_jobs, _finish_or_cleanup,
+                        artifacts)
+    except Exception:
+        _cleanup()
+        raise
+
+
+def get_thumbnail_cache_key(ctx, backend, source_image, job):
+    """Computes the key of a thumbnail in the thumbnail cache."""
+    checksum = ctx.build_state.get_file_info(source_image).checksum
+    h = hashlib.sha1()
+    h.update(('%s|%s|%s|%s|%s|%s|%s' % (
+        backend.name, checksum, job.width, job.height, job.mode.label,
+        job.quality,
+        os.path.splitext(job.dst_filename)[1].lower())).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ThumbnailBatch(object):
+    """Collects the thumbnails of a source image that are requested while
+    building an artifact.  When the first of them is built, all others
+    that are out of date are produced along with it.
+    """
 
-    reporter.report_debug_info('imagemagick cmd line', cmdline)
-    portable_popen(cmdline).wait()
+    def __init__(self, source_image):
+        self.source_image = source_image
+        self.pending = []
+        self.done = set()
+
+    def add(self, artifact, job):
+        """Adds the thumbnail of a sub artifact to the batch."""
+        self.pending.append((artifact, job))
+
+    def build(self, ctx, artifact, job):
+        """Builds the thumbnail of an artifact and all pending ones."""
+        if artifact.artifact_name in self.done:
+            return
+        todo = {artifact.artifact_name: (artifact, job)}
+        for other, other_job in self.pending:
+            name = other.artifact_name
+            if name not in todo and name not in self.done and \
+               not other.is_current:
+                todo[name] = (other, other_job)
+        self.pending = []
+
+        # Every thumbnail goes into the new file of its own artifact so
+        # that it only shows up once that artifact is committed.
+        jobs = []
+        for aft, aft_job in itervalues(todo):
+            jobs.append(aft_job._replace(dst_filename=aft.get_new_filename()))
+        process_images(ctx, self.source_image, jobs,
+                       [aft for aft, _ in itervalues(todo)])
+        self.done.update(todo)
 
 
 def make_image_thumbnail(ctx, source_image, source_url_path,
@@ -542,8 +911,8 @@ def make_image_thumbnail(ctx, source_image, source_url_path,
         )
         mode = ThumbnailMode.FIT
 
-    with open(source_image, 'rb') as f:
-        format, source_width, source_height = get_image_info(f)
+    format, source_width, source_height = ctx.pad.db.get_image_info(
+        source_image)
 
     if format is None:
         raise RuntimeError('Cannot process unknown images')
@@ -578,11 +947,19 @@ def make_image_thumbnail(ctx, source_image, source_url_path,
     else:
         computed_width, computed_height = width, height
 
-    @ctx.sub_artifact(artifact_name=dst_url_path, sources=[source_image])
+    # All thumbnails of the same source are produced together.
+    batches = ctx.cache.setdefault(__name__ + ':thumbnail_batches', {})
+    batch = batches.get(source_image)
+    if batch is None:
+        batch = batches[source_image] = ThumbnailBatch(source_image)
+    job = ThumbnailJob(None, width, height, mode, quality)
+
     def build_thumbnail_artifact(artifact):
-        artifact.ensure_dir()
-        process_image(ctx, source_image, artifact.dst_filename,
-                      width, height, mode, quality=quality)
+        batch.build(ctx, artifact, job)
+
+    batch.add(ctx.add_sub_artifact(artifact_name=dst_url_path,
+                                   build_func=build_thumbnail_artifact,
+                                   sources=[source_image]), job)
 
     return Thumbnail(dst_url_path, computed_width, computed_height)
 
@@ -1,3 +1,4 @@
+import hashlib
 import threading
 from weakref import ref as weakref
 
@@ -5,7 +6,7 @@ import mistune
 from markupsafe import Markup, escape
 from werkzeug.urls import url_parse
 
-from lektor._compat import PY2
+from lektor._compat import PY2, string_types
 from lektor.context import get_ctx
 
 
@@ -63,6 +64,57 @@ def make_markdown(env):
     return mistune.Markdown(renderer, **cfg.options)
 
 
+def _hash_file(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        return ''
+
+
+def _get_config_hash(env, md):
+    """Hashes everything about the markdown setup that affects the HTML.
+    Returns `None` if the rendered HTML cannot be reused because plugins
+    fill in the meta data for each record.
+    """
+    plugins = []
+    for plugin in env.plugin_controller.iter_plugins():
+        if getattr(plugin, 'on_markdown_meta_init', None) is not None or \
+           getattr(plugin, 'on_markdown_meta_postprocess', None) is not None:
+            return None
+        if getattr(plugin, 'on_markdown_config', None) is not None or \
+           getattr(plugin, 'on_markdown_lexer_config', None) is not None:
+            # Plugins usually configure markdown from their config file.
+            plugins.append('%s=%s:%s' % (plugin.id, plugin.version,
+                                         _hash_file(plugin.config_filename)))
+
+    values = [mistune.__version__, repr(sorted(md.renderer.options.items()))]
+    values.extend('%s.%s' % (cls.__module__, cls.__name__)
+                  for cls in type(md.renderer).__mro__)
+    values.extend(sorted(plugins))
+
+    h = hashlib.sha1()
+    for value in values:
+        h.update(value.encode('utf-8') + b'\x00')
+    return h.hexdigest()
+
+
+def _get_render_cache_key(ctx, config_hash, text, record):
+    config = ctx.pad.db.config
+    h = hashlib.sha1(config_hash.encode('ascii'))
+    for value in (config.url_style, config.base_url, config.base_path,
+                  record is not None and record.url_path or '',
+                  ctx.base_url, text):
+        h.update((u'%s\x00' % (value,)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _get_render_cache(ctx):
+    if ctx.build_state is None:
+        return None
+    return getattr(ctx.build_state.builder, 'markdown_cache', None)
+
+
 def markdown_to_html(text, record=None):
     ctx = get_ctx()
     if ctx is None:
@@ -75,15 +127,36 @@ def markdown_to_html(text, record=None):
     if md is None:
         md = make_markdown(ctx.env)
         _markdown_cache.md = md
+        _markdown_cache.config_hash = _get_config_hash(ctx.env, md)
+
+    # The HTML only depends on the source, the URL of the record and the
+    # URL it is rendered for, so it can be reused across pages and builds.
+    cache = _get_render_cache(ctx)
+    key = None
+    if cache is not None and _markdown_cache.config_hash is not None:
+        key = _get_render_cache_key(ctx, _markdown_cache.config_hash,
+                                    text, record)
+        cached = cache.get(key)
+        if cached is not None:
+            rv, dependencies = cached
+            for filename in dependencies:
+                ctx.record_dependency(filename)
+            return rv, {}
 
     meta = {}
     ctx.env.plugin_controller.emit('markdown-meta-init', meta=meta,
                                    record=record)
     md.renderer.meta = meta
     md.renderer.record = record
-    rv = md(text)
+    dependencies = []
+    with ctx.gather_dependencies(dependencies.append):
+        rv = md(text)
     ctx.env.plugin_controller.emit('markdown-meta-postprocess', meta=meta,
                                    record=record)
+
+    if key is not None and \
+       all(isinstance(x, string_types) for x in dependencies):
+        cache.put(key, rv, sorted(set(dependencies)))
     return rv, meta
 
 
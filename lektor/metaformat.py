@@ -1,3 +1,8 @@
+import re
+
+from lektor._compat import text_type
+
+
 def _line_is_dashes(line):
     line = line.strip()
     return line == u'-' * len(line) and len(line) >= 3
@@ -5,9 +10,8 @@ def _line_is_dashes(line):
 
 def _process_buf(buf):
     for idx, line in enumerate(buf):
-        if _line_is_dashes(line):
-            line = line[1:]
-        buf[idx] = line
+        if u'---' in line and _line_is_dashes(line):
+            buf[idx] = line[1:]
 
     if buf and buf[-1][-1:] == '\n':
         buf[-1] = buf[-1][:-1]
@@ -15,6 +19,52 @@ def _process_buf(buf):
     return buf[:]
 
 
+_line_end_re = re.compile(r'\r*\n|\r+\Z')
+# Matches a separator line together with the newline before it, which
+# is faster to find than a separator at the start of a line.
+_separator_re = re.compile(r'\n---[^\S\n]*(?=\n|\Z)', re.UNICODE)
+_line_re = re.compile(r'[^\n]*\n')
+# Line breaks other than newlines which str.splitlines also splits on.
+_other_line_breaks_re = re.compile(u'[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+def _split_lines(text):
+    if _other_line_breaks_re.search(text) is None:
+        return text.splitlines(True)
+    return _line_re.findall(text)
+
+
+def _tokenize_block(block, interesting_keys):
+    # Lines before the first one with a colon are ignored and that line
+    # holds the key.
+    colon = block.find(u':')
+    if colon < 0:
+        return None
+    key = block[block.rfind(u'\n', 0, colon) + 1:colon].strip()
+    if interesting_keys is not None and key not in interesting_keys:
+        return key, None
+
+    line_end = block.index(u'\n', colon) + 1
+    first_bit = block[colon + 1:line_end].strip(u'\t ')
+    rest = block[line_end:]
+    if first_bit.strip():
+        buf = [first_bit]
+    else:
+        buf = []
+        # A value that starts on the line after the key may be separated
+        # from it by one blank line.
+        first_line_end = rest.find(u'\n') + 1
+        if first_line_end and not rest[:first_line_end].strip():
+            rest = rest[first_line_end:]
+    buf.extend(_split_lines(rest))
+
+    if u'---' in block:
+        return key, _process_buf(buf)
+    if buf:
+        buf[-1] = buf[-1][:-1]
+    return key, buf
+
+
 def tokenize(iterable, interesting_keys=None, encoding=None):
     """This tokenizes an iterable of newlines as bytes into key value
     pairs out of the lektor bulk format.  By default it will process all
@@ -22,58 +72,35 @@ def tokenize(iterable, interesting_keys=None, encoding=None):
     will instead yield `None`.  The values are left as list of decoded
     lines with their endings preserved.
 
+    Instead of an iterable a file object or the whole contents as string
+    can be passed.  They are read and split up at once which is faster.
+
     This will not perform any other processing on the data other than
     decoding and basic tokenizing.
     """
-    key = []
-    buf = []
-    want_newline = False
-    is_interesting = True
-
-    def _flush_item():
-        the_key = key[0]
-        if not is_interesting:
-            value = None
-        else:
-            value = _process_buf(buf)
-        del key[:], buf[:]
-        return the_key, value
+    if hasattr(iterable, 'read'):
+        data = iterable.read()
+    elif isinstance(iterable, (bytes, text_type)):
+        data = iterable
+    else:
+        if encoding is not None:
+            iterable = [x.decode(encoding, 'replace') for x in iterable]
+            encoding = None
+        data = u''.join(x.rstrip(u'\r\n') + u'\n' for x in iterable)
 
     if encoding is not None:
-        iterable = (x.decode(encoding, 'replace') for x in iterable)
-
-    for line in iterable:
-        line = line.rstrip(u'\r\n') + u'\n'
-
-        if line.rstrip() == u'---':
-            want_newline = False
-            if key:
-                yield _flush_item()
-        elif key:
-            if want_newline:
-                want_newline = False
-                if not line.strip():
-                    continue
-            if is_interesting:
-                buf.append(line)
-        else:
-            bits = line.split(u':', 1)
-            if len(bits) == 2:
-                key = [bits[0].strip()]
-                if interesting_keys is None:
-                    is_interesting = True
-                else:
-                    is_interesting = key[0] in interesting_keys
-                if is_interesting:
-                    first_bit = bits[1].strip(u'\t ')
-                    if first_bit.strip():
-                        buf = [first_bit]
-                    else:
-                        buf = []
-                        want_newline = True
-
-    if key:
-        yield _flush_item()
+        data = data.decode(encoding, 'replace')
+    if u'\r' in data:
+        data = _line_end_re.sub(u'\n', data)
+    if data[-1:] == u'\n':
+        data = data[:-1]
+
+    # Every chunk is a newline followed by the lines of a block without
+    # the newline at the end.
+    for chunk in _separator_re.split(u'\n' + data):
+        item = _tokenize_block(chunk[1:] + u'\n', interesting_keys)
+        if item is not None:
+            yield item
 
 
 def serialize(iterable, encoding=None):
@@ -97,6 +97,14 @@ class Project(object):
         """The path where output files are stored."""
         return os.path.join(get_cache_dir(), 'builds', self.id)
 
+    def get_template_cache_path(self):
+        """The path where compiled templates are stored."""
+        return os.path.join(get_cache_dir(), 'templates', self.id)
+
+    def get_thumbnail_cache_path(self):
+        """The path where generated thumbnails are cached."""
+        return os.path.join(get_cache_dir(), 'thumbnails', self.id)
+
     def get_package_cache_path(self):
         """The path where plugin packages are stored."""
         h = hashlib.md5()
@@ -1,4 +1,5 @@
 import time
+import pickle
 import traceback
 from contextlib import contextmanager
 
@@ -155,6 +156,44 @@ class Reporter(object):
     def report_pruned_artifact(self, artifact_name):
         pass
 
+    @contextmanager
+    def capture_output(self, source_key=repr):
+        """Records what is reported for the duration of the block instead
+        of reporting it.  Yields the list of recorded events which
+        :meth:`replay_output` reports later, possibly in another process.
+        To keep the events picklable, artifacts are recorded by their name
+        and sources by what `source_key` returns for them.
+        """
+        rv = []
+        with RecordingReporter(self.env, rv, source_key, self.verbosity):
+            yield rv
+
+    def replay_output(self, output, get_artifact, get_source):
+        """Reports the events recorded by :meth:`capture_output`.  The
+        artifacts and sources are looked up again with `get_artifact` and
+        `get_source` which are invoked with the recorded names and keys.
+        """
+        stack = []
+        for event in output:
+            kind, args = event[0], event[1:]
+            if kind == 'pop':
+                stack.pop().__exit__(None, None, None)
+                continue
+            if kind == 'push-artifact':
+                name, build_func, is_current = args
+                block = self.build_artifact(get_artifact(name),
+                                            _ReplayedBuildFunc(build_func),
+                                            is_current)
+            elif kind == 'push-source':
+                block = self.process_source(get_source(args[0]))
+            else:
+                if kind in ('report_failure', 'report_sub_artifact'):
+                    args = (get_artifact(args[0]),) + args[1:]
+                getattr(self, kind)(*args)
+                continue
+            block.__enter__()
+            stack.append(block)
+
     @contextmanager
     def process_source(self, source):
         now = time.time()
@@ -177,6 +216,88 @@ class NullReporter(Reporter):
     pass
 
 
+class _ReplayedBuildFunc(object):
+    """Stands in for a build function that was described by
+    :func:`describe_build_func` in another process.
+    """
+
+    def __init__(self, description):
+        self.__module__, _, self.__name__ = description.rpartition('.')
+
+
+def _picklable(value):
+    try:
+        pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except Exception:  # pylint: disable=broad-except
+        return False
+    return True
+
+
+class RecordingReporter(Reporter):
+    """Records the events for :meth:`Reporter.capture_output`."""
+
+    def __init__(self, env, events, source_key, verbosity=0):
+        Reporter.__init__(self, env, verbosity)
+        self.events = events
+        self.source_key = source_key
+
+    @contextmanager
+    def build_artifact(self, artifact, build_func, is_current):
+        self.events.append(('push-artifact', artifact.artifact_name,
+                            describe_build_func(build_func), is_current))
+        try:
+            with Reporter.build_artifact(self, artifact, build_func,
+                                         is_current):
+                yield
+        finally:
+            self.events.append(('pop',))
+
+    @contextmanager
+    def process_source(self, source):
+        self.events.append(('push-source', self.source_key(source)))
+        try:
+            with Reporter.process_source(self, source):
+                yield
+        finally:
+            self.events.append(('pop',))
+
+    def report_failure(self, artifact, exc_info):
+        # Tracebacks cannot be pickled, only the exception is kept.
+        exc_type, exc_value = exc_info[:2]
+        if not _picklable(exc_value):
+            exc_type = RuntimeError
+            exc_value = RuntimeError(''.join(
+                traceback.format_exception_only(*exc_info[:2])).strip())
+        self.events.append(('report_failure', artifact.artifact_name,
+                            (exc_type, exc_value, None)))
+
+    def report_build_all_failure(self, failures):
+        self.events.append(('report_build_all_failure', failures))
+
+    def report_dirty_flag(self, value):
+        self.events.append(('report_dirty_flag', value))
+
+    def report_write_source_info(self, info):
+        self.events.append(('report_write_source_info', info))
+
+    def report_prune_source_info(self, source):
+        self.events.append(('report_prune_source_info', source))
+
+    def report_sub_artifact(self, artifact):
+        self.events.append(('report_sub_artifact', artifact.artifact_name))
+
+    def report_debug_info(self, key, value):
+        if not _picklable(value):
+            value = repr(value)
+        self.events.append(('report_debug_info', key, value))
+
+    def report_generic(self, message):
+        self.events.append(('report_generic', text_type(message)))
+
+    def report_pruned_artifact(self, artifact_name):
+        self.events.append(('report_pruned_artifact', artifact_name))
+
+
 class BufferReporter(Reporter):
 
     def __init__(self, env, verbosity=0):
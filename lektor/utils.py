@@ -452,6 +452,20 @@ def get_dependent_url(url_path, suffix, ext=None):
     return posixpath.join(url_directory, url_base + u'@' + suffix + ext)
 
 
+def replace_file(src, dst):
+    """Moves `src` over `dst`.  If both are hard links to the same file,
+    renaming does nothing, so `src` is removed instead.
+    """
+    try:
+        same_file = os.path.samefile(src, dst)
+    except (OSError, AttributeError):
+        same_file = False
+    if same_file:
+        os.remove(src)
+    else:
+        rename(src, dst)
+
+
 @contextmanager
 def atomic_open(filename, mode='r'):
     if 'r' not in mode:
@@ -2,9 +2,12 @@ import os
 import time
 
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, DirModifiedEvent, FileMovedEvent
+from watchdog.events import FileSystemEventHandler, DirModifiedEvent, \
+     FileSystemMovedEvent
 
 from lektor._compat import queue
+from lektor.environment import compile_fnmatch, EXCLUDED_ASSETS, \
+     INCLUDED_ASSETS, SPECIAL_ARTIFACTS
 from lektor.utils import get_cache_dir
 
 # Alias this as this can be called during interpreter shutdown
@@ -23,12 +26,16 @@ class EventHandler(FileSystemEventHandler):
 
     def on_any_event(self, event):
         if not isinstance(event, DirModifiedEvent):
-            path = event.dest_path if isinstance(event, FileMovedEvent) else event.src_path
-            item = (time.time(), event.event_type, path)
-            if self.queue is not None:
-                self.queue.put(item)
-            else:
-                self.callback(*item)
+            # Moves change both the old and the new location.
+            paths = [event.src_path]
+            if isinstance(event, FileSystemMovedEvent):
+                paths.append(event.dest_path)
+            for path in paths:
+                item = (time.time(), event.event_type, path)
+                if self.queue is not None:
+                    self.queue.put(item)
+                else:
+                    self.callback(*item)
 
 
 class BasicWatcher(object):
@@ -54,6 +61,32 @@ class BasicWatcher(object):
             except _Empty:
                 pass
 
+    def iter_changes(self, window=0.5, max_latency=5.0):
+        """Yields de-duplicated sets of changed paths.  A set is yielded
+        once no interesting event came in for `window` seconds, or at the
+        latest `max_latency` seconds after its first event so that a
+        steady stream of events does not hold back builds forever.
+        """
+        if self.event_handler.queue is None:
+            raise RuntimeError('watcher used with callback')
+        changes = set()
+        deadline = None
+        while 1:
+            timeout = 1
+            if changes:
+                timeout = max(0, min(window, deadline - time.time()))
+            try:
+                item = self.event_handler.queue.get(timeout=timeout)
+            except _Empty:
+                item = None
+            if item is not None and self.is_interesting(*item):
+                if not changes:
+                    deadline = time.time() + max_latency
+                changes.add(item[2])
+            if changes and (item is None or time.time() >= deadline):
+                yield changes
+                changes = set()
+
 
 class Watcher(BasicWatcher):
 
@@ -62,11 +95,25 @@ class Watcher(BasicWatcher):
         self.env = env
         self.output_path = output_path
         self.cache_dir = os.path.abspath(get_cache_dir())
+        # The same rules as `Environment.is_uninteresting_source_name`
+        # but compiled once as they are checked for every single event.
+        proj = env.project
+        self._is_included = compile_fnmatch(INCLUDED_ASSETS +
+                                            proj.included_assets)
+        self._is_excluded = compile_fnmatch(EXCLUDED_ASSETS +
+                                            proj.excluded_assets)
+
+    def is_uninteresting_source_name(self, filename):
+        if filename.lower() in SPECIAL_ARTIFACTS:
+            return False
+        if self._is_included(filename):
+            return False
+        return self._is_excluded(filename) is not None
 
     def is_interesting(self, time, event_type, path):
         path = os.path.abspath(path)
 
-        if self.env.is_uninteresting_source_name(os.path.basename(path)):
+        if self.is_uninteresting_source_name(os.path.basename(path)):
             return False
         if path.startswith(self.cache_dir):
             return False
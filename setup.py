@@ -46,6 +46,7 @@ setup(
     extras_require={
         'test': tests_require,
         'ipython': ['ipython'],
+        'pillow': ['Pillow'],
     },
     classifiers=[
         'Framework :: Lektor',
@@ -1,6 +1,7 @@
 import os
 import shutil
 import subprocess
+import sys
 import textwrap
 import pytest
 
@@ -114,6 +115,24 @@ def child_sources_test_project_builder(tmpdir):
     return Builder(pad, str(tmpdir.mkdir("output")))
 
 
+@pytest.fixture(scope='function')
+def fake_convert(tmpdir, mocker):
+    # Stands in for imagemagick by copying the source to the destinations.
+    # Every run is logged to convert.log next to it.
+    rv = tmpdir.join('convert')
+    rv.write('#!%s\nimport shutil, sys\n'
+             'with open(%r, "a") as f:\n'
+             '    f.write(sys.argv[1] + "\\n")\n'
+             'args = sys.argv[2:]\n'
+             'dsts = [y for x, y in zip(args, args[1:]) if x == "-write"]\n'
+             'for dst in dsts or args[-1:]:\n'
+             '    shutil.copy(sys.argv[1], dst)\n'
+             % (sys.executable, str(tmpdir.join('convert.log'))))
+    rv.chmod(0o755)
+    mocker.patch('lektor.imagetools.find_imagemagick', return_value=str(rv))
+    return rv
+
+
 @pytest.fixture(scope='function')
 def F():
     from lektor.db import F
@@ -75,3 +75,20 @@ def test_eventstream_yield_bytes():
         count += 1
         assert isinstance(data, bytes)
     assert count >= 2
+
+
+def test_warm_pad_follows_edits(scratch_project, scratch_env):
+    webadmin = WebAdmin(scratch_env, output_path=scratch_project.tree)
+    client = webadmin.test_client()
+    pad = webadmin.lektor_info.get_pad()
+    assert pad.root['title'] == 'Index'
+
+    client.put('/admin/api/rawrecord', data=json.dumps({
+        'path': '/', 'data': {'title': 'Changed'},
+    }), content_type='application/json')
+
+    # The pad is shared between requests and forgot the edited record.
+    assert webadmin.lektor_info.get_pad() is pad
+    assert pad.root['title'] == 'Changed'
+    data = json.loads(client.get('/admin/api/recordinfo?path=/').data)
+    assert data['label_i18n']['en'] == 'Changed'
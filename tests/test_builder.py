@@ -1,3 +1,20 @@
+import os
+import shutil
+import hashlib
+
+import pytest
+
+import lektor.buildcaches
+import lektor.db
+from lektor.buildcaches import ArtifactIndex, ChecksumCache, \
+     FileSystemSnapshot
+from lektor.builder import Builder, FileInfo, PathCache, WatchBuilder, \
+     _fork_context
+from lektor.db import Database
+from lektor.environment import Environment
+from lektor.pluginsystem import PluginController
+from lektor.reporter import BufferReporter, CliReporter
+
 from markers import imagemagick
 
 
@@ -220,3 +237,406 @@ def test_iter_child_attachments(child_sources_test_project_builder):
     pad = builder.pad
     prog, _ = builder.build(pad.root)
     assert builder.pad.get('attachment.txt') in prog.iter_child_sources()
+
+
+def _read_output_tree(path):
+    rv = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [x for x in dirnames if x != '.lektor']
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            with open(full_path, 'rb') as f:
+                rv[os.path.relpath(full_path, path)] = f.read()
+    return rv
+
+
+def _built_artifacts(reporter):
+    rv = sorted(data['artifact'].artifact_name
+                for event, data in reporter.get_major_events()
+                if event == 'start-artifact-build'
+                and not data['is_current'])
+    reporter.clear()
+    return rv
+
+
+def _rebuilt_artifacts(env, builder, reporter):
+    reporter.clear()
+    Builder(Database(env).new_pad(), builder.destination_path).build_all()
+    return _built_artifacts(reporter)
+
+
+@pytest.mark.skipif(_fork_context is None,
+                    reason='parallel builds require fork')
+def test_parallel_build_matches_serial_build(env, builder, tmpdir, reporter):
+    parallel = Builder(Database(env).new_pad(), str(tmpdir.mkdir('parallel')),
+                       jobs=3)
+
+    serial_failures = builder.build_all()
+    serial_built = _built_artifacts(reporter)
+    parallel_failures = parallel.build_all()
+
+    assert parallel_failures == serial_failures
+    # The output of the workers is reported like the one of a serial build.
+    assert serial_built
+    assert _built_artifacts(reporter) == serial_built
+    assert _read_output_tree(parallel.destination_path) == \
+        _read_output_tree(builder.destination_path)
+
+    # The build state written on behalf of the workers is as good as the
+    # one of the serial build.
+    assert _rebuilt_artifacts(env, parallel, reporter) == \
+        _rebuilt_artifacts(env, builder, reporter)
+
+
+@pytest.mark.skipif(_fork_context is None,
+                    reason='parallel builds require fork')
+def test_parallel_build_events_and_output(env, tmpdir, mocker, capsys):
+    emit = mocker.spy(PluginController, 'emit')
+
+    def _build(jobs):
+        emit.reset_mock()
+        builder = Builder(Database(env).new_pad(),
+                          str(tmpdir.mkdir('output-%d' % jobs)), jobs=jobs)
+        with CliReporter(env):
+            builder.build_all()
+        events = [(c[0][1], c[1]['source'].path)
+                  for c in emit.call_args_list
+                  if c[0][1] in ('before-build', 'after-build')]
+        output = [x for x in capsys.readouterr().out.splitlines()
+                  if not x.startswith(('Started', 'Finished'))]
+        return events, output
+
+    serial_events, serial_output = _build(1)
+    parallel_events, parallel_output = _build(3)
+    assert serial_events
+    # Sources are handed to the workers before their results are in, but
+    # each kind of event comes in the order of a serial build.
+    for event in 'before-build', 'after-build':
+        assert [x for x in parallel_events if x[0] == event] == \
+            [x for x in serial_events if x[0] == event]
+    for event, path in parallel_events:
+        if event == 'after-build':
+            assert parallel_events.index(('before-build', path)) < \
+                parallel_events.index((event, path))
+    assert parallel_output == serial_output
+
+
+@pytest.mark.skipif(_fork_context is None,
+                    reason='parallel builds require fork')
+def test_parallel_build_shares_sub_artifacts(scratch_project, scratch_env,
+                                             fake_convert, tmpdir, reporter):
+    # All pages show the same thumbnail, which is a sub artifact of each.
+    base = tmpdir.join('scratch-proj')
+    shutil.copy(os.path.join(os.path.dirname(__file__), 'demo-project',
+                             'content', 'test.jpg'),
+                str(base.join('content', 'image.jpg')))
+    base.join('templates', 'page.html').write_text(
+        u'{{ site.get("/").attachments.get("image.jpg").thumbnail(20) }}',
+        'utf8')
+    for name in 'a', 'b', 'c':
+        base.join('content', name, 'contents.lr').write_text(
+            u'_model: page\n---\ntitle: %s\n' % name, 'utf8', ensure=True)
+
+    builder = Builder(Database(scratch_env).new_pad(),
+                      str(tmpdir.mkdir('output')), jobs=2)
+    assert builder.build_all() == 0
+    assert _built_artifacts(reporter).count('image@20.jpg') == 1
+    assert len(tmpdir.join('convert.log').readlines()) == 1
+    assert tmpdir.join('output', 'image@20.jpg').check()
+
+    # Only the writes of the worker that built it made it into the build
+    # state, so it is current.
+    con = builder.connect_to_database()
+    try:
+        rows = con.execute('''
+            select source from artifacts where artifact = 'image@20.jpg'
+        ''').fetchall()
+    finally:
+        con.close()
+    assert sorted(rows) == [('Scratch.lektorproject',), ('content/image.jpg',)]
+    assert _rebuilt_artifacts(scratch_env, builder, reporter) == []
+
+
+def test_build_all_shares_one_connection(pad, builder, mocker):
+    connect = mocker.spy(builder, '_connect_to_database')
+    builder.build_all()
+    assert connect.call_count == 1
+
+    # Everything got committed by the end of the build.
+    con = builder.connect_to_database()
+    try:
+        artifacts = con.execute('''
+            select distinct artifact from artifacts
+             where artifact = 'static/demo.css'
+        ''').fetchall()
+    finally:
+        con.close()
+    assert artifacts == [('static/demo.css',)]
+
+
+def test_pooled_connection_groups_commits(builder):
+    with builder.pooled_connection() as con:
+        unit = builder.connect_to_database()
+        assert unit.pool is con
+        unit.commit()
+        assert con.pending_commits == 1
+        for _ in range(builder.commit_interval - 1):
+            builder.connect_to_database().commit()
+        assert con.pending_commits == 0
+    assert builder.connect_to_database() is not con
+
+
+def test_pooled_connection_rolls_back_only_the_failed_unit(builder):
+    def dirty_sources():
+        con = builder.connect_to_database()
+        try:
+            return set(x[0] for x in con.execute(
+                'select source from dirty_sources'))
+        finally:
+            con.close()
+
+    with builder.pooled_connection() as con:
+        for source in 'a', 'b':
+            unit = builder.connect_to_database()
+            unit.execute('insert into dirty_sources (source) values (?)',
+                         [source])
+            if source == 'a':
+                unit.commit()
+            else:
+                unit.rollback()
+        assert con.pending_commits == 1
+    assert dirty_sources() == set(['a'])
+
+    # A transaction is not kept open longer than `max_age`.
+    with builder.pooled_connection() as con:
+        con.max_age = 0
+        builder.connect_to_database().commit()
+        assert con.transaction_started is None
+
+
+def test_artifact_index_answers_is_current(pad, builder):
+    post1 = pad.get('blog/post1')
+    prog, _ = builder.build(post1)
+    artifact = prog.artifacts[0]
+
+    con = builder.connect_to_database()
+    try:
+        builder.artifact_index = ArtifactIndex.load(con)
+    finally:
+        con.close()
+    assert artifact.artifact_name in builder.artifact_index.dependencies
+
+    with builder.pooled_connection():
+        assert artifact.is_current
+
+        # Writes are reflected without reloading the index.
+        artifact.set_dirty_flag()
+        assert not artifact.is_current
+        artifact.clear_dirty_flag()
+        assert artifact.is_current
+
+        # The dependencies come from the index, not the database.
+        builder.artifact_index.dependencies[artifact.artifact_name] = []
+        assert not artifact.is_current
+        builder.artifact_index.invalidate(artifact.artifact_name)
+        assert artifact.is_current
+
+
+def test_fs_snapshot(env):
+    snapshot = FileSystemSnapshot.take(env)
+    content = os.path.join(env.root_path, 'content')
+
+    assert sorted(snapshot.listdir(content)) == sorted(os.listdir(content))
+    assert snapshot.isfile(os.path.join(content, 'contents.lr'))
+    assert snapshot.isfile(os.path.join(content, 'missing.lr')) is False
+    assert not snapshot.isfile(os.path.join(content, 'blog'))
+    # Folders that are not part of the snapshot are unknown.
+    assert snapshot.listdir(os.path.join(env.root_path, 'packages')) is None
+    assert snapshot.isfile(os.path.join(env.root_path, 'nope', 'x')) is None
+
+    path_cache = PathCache(env, snapshot=snapshot)
+    for filename in ('content/contents.lr', 'content/blog', 'content/missing'):
+        info = path_cache.get_file_info(filename)
+        uncached = FileInfo(env, info.filename)
+        assert (info.mtime, info.size, info.is_dir, info.exists) == \
+            (uncached.mtime, uncached.size, uncached.is_dir, uncached.exists)
+
+
+def test_build_with_fs_snapshot_matches_regular_build(env, builder, tmpdir):
+    snapshot = Builder(Database(env).new_pad(), str(tmpdir.mkdir('snapshot')),
+                       fs_snapshot=True)
+
+    assert snapshot.build_all() == builder.build_all()
+    assert snapshot.pad.db.fs_snapshot is None
+    assert _read_output_tree(snapshot.destination_path) == \
+        _read_output_tree(builder.destination_path)
+
+
+def test_checksum_cache(env, builder, tmpdir, mocker):
+    filename = str(tmpdir.join('file.txt'))
+    with open(filename, 'wb') as f:
+        f.write(b'hello')
+    # Files modified just now are not remembered.
+    os.utime(filename, (1000000000, 1000000000))
+
+    compute = mocker.spy(lektor.buildcaches, 'compute_checksum')
+    checksum = builder.checksum_cache.get_checksum(env, filename)
+    assert checksum == hashlib.sha1(b'hello').hexdigest()
+    assert compute.call_count == 1
+
+    # The checksum is persisted in the build state.
+    cache = ChecksumCache(builder)
+    assert cache.get_checksum(env, filename) == checksum
+    assert compute.call_count == 1
+
+    with open(filename, 'wb') as f:
+        f.write(b'world')
+    os.utime(filename, (1000000001, 1000000001))
+    assert cache.get_checksum(env, filename) == \
+        hashlib.sha1(b'world').hexdigest()
+    assert compute.call_count == 2
+
+    os.remove(filename)
+    cache.prune()
+    assert cache._load_entries() == {}
+
+
+@pytest.mark.skipif(not hasattr(hashlib, 'blake2b'),
+                    reason='blake2b not available')
+def test_checksum_algorithm(env, tmpdir):
+    filename = str(tmpdir.join('file.txt'))
+    with open(filename, 'wb') as f:
+        f.write(b'hello')
+    builder = Builder(Database(env).new_pad(), str(tmpdir.mkdir('output')))
+    cache = ChecksumCache(builder, 'blake2b')
+    assert cache.get_checksum(env, filename) == \
+        hashlib.blake2b(b'hello', digest_size=20).hexdigest()
+
+    with pytest.raises(RuntimeError):
+        ChecksumCache(builder, 'md4')
+
+
+def test_checksum_algorithm_setting(scratch_project, tmpdir):
+    with open(scratch_project.project_file, 'a') as f:
+        f.write('\n[env]\nchecksum_algorithm = xxhash\n')
+    env = Environment(scratch_project)
+    assert env.load_config()['CHECKSUM_ALGORITHM'] == 'xxhash'
+
+
+def test_record_index(scratch_project, tmpdir, mocker):
+    output = str(tmpdir.mkdir('output'))
+    # The index is off by default.
+    pad = Database(Environment(scratch_project)).new_pad()
+    assert Builder(pad, output).record_index is None
+
+    with open(scratch_project.project_file, 'a') as f:
+        f.write('\n[env]\nrecord_index = yes\n')
+    env = Environment(scratch_project)
+    filename = os.path.join(scratch_project.tree, 'content', 'contents.lr')
+    os.utime(filename, (1000000000, 1000000000))
+
+    def get_root():
+        builder = Builder(Database(env).new_pad(), output)
+        with builder.pooled_connection():
+            return builder.pad.get('/')
+
+    tokenize = mocker.spy(lektor.db.metaformat, 'tokenize')
+    assert get_root()['title'] == 'Index'
+    assert tokenize.call_count == 1
+
+    # A fresh database reads the record from the index.
+    root = get_root()
+    assert root['title'] == 'Index'
+    assert root['body'].source.strip() == 'Hello World!'
+    assert tokenize.call_count == 1
+
+    # Outside of builds the index is not used.
+    assert Builder(Database(env).new_pad(), output).pad.get('/')
+    assert tokenize.call_count == 2
+
+    with open(filename, 'w') as f:
+        f.write('_model: page\n---\ntitle: Changed\n')
+    os.utime(filename, (1000000001, 1000000001))
+    assert get_root()['title'] == 'Changed'
+    assert tokenize.call_count == 3
+
+
+def test_build_changed(scratch_project, scratch_env, tmpdir):
+    base = tmpdir.join('scratch-proj')
+    base.join('templates', 'page.html').write_text(
+        u'<h1>{{ this.title }}</h1>\n'
+        u'{% for child in this.children %}{{ child.title }}\n{% endfor %}',
+        'utf8')
+    output_path = str(tmpdir.mkdir('output'))
+    Builder(Database(scratch_env).new_pad(), output_path).build_all()
+
+    def build_changed(*filenames):
+        builder = Builder(Database(scratch_env).new_pad(), output_path)
+        with BufferReporter(scratch_env) as reporter:
+            assert builder.build_changed(filenames) == 0
+        return sorted(data['artifact'].artifact_name
+                      for event, data in reporter.get_major_events()
+                      if event == 'start-artifact-build'
+                      and not data['is_current'])
+
+    # New pages are built and so is everything that lists them.
+    base.join('content', 'sub', 'contents.lr').write_text(
+        u'_model: page\n---\ntitle: Sub\n', 'utf8', ensure=True)
+    assert build_changed(str(base.join('content', 'sub', 'contents.lr'))) \
+        == ['de/index.html', 'de/sub/index.html', 'index.html',
+            'sub/index.html']
+    assert 'Sub' in tmpdir.join('output', 'index.html').read()
+
+    base.join('content', 'sub', 'contents+de.lr').write_text(
+        u'title: Unter\n', 'utf8')
+    # The primary page lists the children of its folder which changed.
+    assert build_changed('content/sub/contents+de.lr') == \
+        ['de/index.html', 'de/sub/index.html', 'sub/index.html']
+    assert 'Unter' in tmpdir.join('output', 'de', 'index.html').read()
+
+    # Nothing depends on files outside of the project.
+    assert build_changed(str(tmpdir.join('elsewhere.txt'))) == []
+
+
+def test_watch_builder(scratch_project, scratch_env, tmpdir):
+    base = tmpdir.join('scratch-proj')
+    output = tmpdir.join('output')
+    watch_builder = WatchBuilder(scratch_env, str(output))
+    assert watch_builder.build_all() == 0
+    pad = watch_builder.pad
+    assert pad.root['title'] == 'Index'
+
+    base.join('content', 'sub', 'contents.lr').write_text(
+        u'_model: page\n---\ntitle: Sub\n', 'utf8', ensure=True)
+    assert watch_builder.build_changed(
+        [str(base.join('content', 'sub', 'contents.lr'))]) == 0
+    # The pad stays warm and picks up the new record.
+    assert watch_builder.pad is pad
+    assert pad.get('/sub')['title'] == 'Sub'
+    assert 'Sub' in output.join('sub', 'index.html').read()
+
+    base.join('content', 'sub', 'contents.lr').write_text(
+        u'_model: page\n---\ntitle: Changed\n', 'utf8')
+    watch_builder.build_changed(
+        [str(base.join('content', 'sub', 'contents.lr'))])
+    assert pad.get('/sub')['title'] == 'Changed'
+    assert 'Changed' in output.join('sub', 'index.html').read()
+
+    # Removed pages get pruned.
+    base.join('content', 'sub').remove()
+    watch_builder.build_changed([str(base.join('content', 'sub'))])
+    assert not output.join('sub', 'index.html').check()
+
+    # Renamed attachments leave no stale artifact behind.
+    base.join('content', 'a.txt').write('A')
+    watch_builder.build_changed([str(base.join('content', 'a.txt'))])
+    assert output.join('a.txt').check()
+    base.join('content', 'a.txt').rename(base.join('content', 'b.txt'))
+    watch_builder.build_changed([str(base.join('content', 'a.txt')),
+                                 str(base.join('content', 'b.txt'))])
+    assert not output.join('a.txt').check()
+    assert output.join('b.txt').read() == 'A'
+
+    # Model changes start over with a fresh database.
+    watch_builder.build_changed([str(base.join('models', 'page.ini'))])
+    assert watch_builder.pad is not pad
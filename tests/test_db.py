@@ -1,8 +1,9 @@
 import os
+import threading
 from datetime import date
 
 from lektor.context import Context
-from lektor.db import get_alts
+from lektor.db import get_alts, F
 
 
 def test_root(pad):
@@ -304,3 +305,107 @@ def test_default_order_by(scratch_project, scratch_env):
     assert list(children.get_order_by()) == ['title']
     assert list(children.order_by('explicit').get_order_by()) == ['explicit']
     assert list(myobj.attachments.get_order_by()) == ['attachment_filename']
+
+
+def test_resolve_url_path_uses_slug_index(pad):
+    projects = pad.get('/projects')
+    assert pad.resolve_url_path('/projects/slave/')['_id'] == 'slave'
+    children, attachments = pad.cache.get_index('slugs', '/projects', 'en')
+    assert children['slave'] == ('/projects/slave', 'en')
+    assert children['secret'] == ('/projects/secret', 'en')
+    assert attachments['attachment.txt'][0] == '/projects/attachment.txt'
+    assert pad.resolve_url_path('/projects/attachment.txt')['_id'] == \
+        'attachment.txt'
+
+    # The index is dropped together with the records below the page.
+    pad.cache.forget([projects['_path']])
+    assert pad.cache.get_index('slugs', '/projects', 'en') is None
+
+
+def test_query_loads_only_surviving_records(pad):
+    pad.get('/projects')
+    query = pad.query('/projects').filter(F.seq > 5).order_by('seq')
+    assert query._get_referenced_fields() == set(['seq'])
+    assert query.count() == 4
+    assert not [key for key in pad.cache.ephemeral
+                if key[0].startswith('projects/')]
+
+    first = query.limit(1).first()
+    assert first['_id'] == 'master'
+    assert 'description' in first._data
+    assert [key[0] for key in pad.cache.ephemeral
+            if key[0].startswith('projects/')] == ['projects/master']
+    assert first is pad.get('/projects/master')
+
+    assert [x['_id'] for x in query.offset(1)] == \
+        [x['_id'] for x in query.all()[1:]]
+    assert query.filter(lambda x: x['seq'] > 6)._get_referenced_fields() \
+        is None
+
+
+def test_query_limit_keeps_sort_order(pad, mocker):
+    query = pad.query('/projects').order_by('-seq', 'name')
+    everything = [x['_id'] for x in query]
+    for offset in (None, 0, 2, 7):
+        for limit in (0, 1, 3, 20):
+            q = query.offset(offset).limit(limit)
+            start = offset or 0
+            assert [x['_id'] for x in q] == everything[start:start + limit]
+
+    coerce = mocker.patch('lektor.db._CmpHelper.coerce')
+    assert [x['_id'] for x in pad.query('/projects').order_by('name')
+            .limit(2)] == ['bagpipe', 'coffee']
+    assert not coerce.called
+
+
+def test_fields_are_deserialized_on_access(pad):
+    record = pad.get('/projects/bagpipe')
+    assert 'description' in record._data._pending
+    assert 'description' in record
+    assert 'description' not in record._bound_data
+
+    description = record['description']
+    assert 'description' not in record._data._pending
+    assert record._bound_data['description'] is description
+    assert record['description'] is description
+
+    field = record.datamodel.field_map['description']
+    raw = pad.db.load_raw_data('/projects/bagpipe')
+    expected = field.deserialize_value(raw['description'], pad=pad)
+    assert description.source == expected.source
+    assert record['seq'] == 8
+    assert dict(record._data)['name'] == record['name']
+    assert not record._data._pending
+
+
+def test_copies_of_record_data_have_all_fields(pad):
+    record = pad.get('/projects/bagpipe')
+    raw = pad.db.load_raw_data('/projects/bagpipe')
+
+    def new_data():
+        rv = record.datamodel.process_raw_data(raw, pad)
+        assert 'description' in rv._pending
+        return rv
+
+    copy = {}
+    copy.update(new_data())
+    for copy in (dict(new_data()), copy, dict(**new_data()),
+                 new_data().copy()):
+        assert sorted(copy) == sorted(record.datamodel.field_map)
+        assert copy['name'] == record['name']
+        assert copy['description'].source == record['description'].source
+
+
+def test_build_caches_are_per_thread(pad, builder):
+    db = pad.db
+    assert db.get_build_cache('image_info_cache') is None
+    with builder.pooled_connection():
+        assert db.get_build_cache('image_info_cache') is \
+            builder.image_info_cache
+        rv = []
+        thread = threading.Thread(target=lambda: rv.append(
+            db.get_build_cache('image_info_cache')))
+        thread.start()
+        thread.join()
+        assert rv == [None]
+    assert db.get_build_cache('image_info_cache') is None
@@ -1,6 +1,44 @@
+import os
+
+
 def test_jinja2_extensions(env):
     extensions = env.jinja_env.extensions
 
     assert 'jinja2.ext.AutoEscapeExtension' in extensions.keys()
     assert 'jinja2.ext.WithExtension' in extensions.keys()
     assert 'jinja2.ext.ExprStmtExtension' in extensions.keys()
+
+
+def test_string_templates_are_shared(env):
+    from lektor.environment import Expression, FormatExpression
+
+    assert Expression(env, 'this.title').tmpl is \
+        Expression(env, 'this.title').tmpl
+    assert FormatExpression(env, '{{ this._id }}').tmpl is \
+        FormatExpression(env, '{{ this._id }}').tmpl
+    assert Expression(env, '1 + 2').evaluate() == 3
+
+
+def test_template_bytecode_cache(env, tmpdir, mocker):
+    import jinja2
+    from lektor.environment import Environment
+
+    mocker.patch('lektor.project.get_cache_dir',
+                 return_value=str(tmpdir.join('cache')))
+    env = Environment(env.project, load_plugins=False)
+    cache_path = env.project.get_template_cache_path()
+    assert env.jinja_env.bytecode_cache.directory == cache_path
+    # The folder is only created once something is stored.
+    assert not os.path.exists(cache_path)
+
+    env.jinja_env.get_template('page.html')
+    env.jinja_env.from_string('{{ 1 + 2 }}')
+    assert len(tmpdir.join('cache', 'templates', env.project.id)
+               .listdir()) == 2
+
+    # Another environment loads the bytecode instead of compiling.
+    compile = mocker.spy(jinja2.Environment, 'compile')
+    other = Environment(env.project, load_plugins=False)
+    other.jinja_env.get_template('page.html')
+    assert other.jinja_env.from_string('{{ 1 + 2 }}').render() == '3'
+    assert compile.call_count == 0
@@ -1,12 +1,21 @@
 import io
 import os
+import struct
+import sys
 from datetime import datetime
 from hashlib import md5
 
 import pytest
 
+import lektor.buildcaches
+import lektor.imagetools
 from lektor._compat import iteritems
-from lektor.imagetools import get_image_info, compute_dimensions
+from lektor.buildcaches import ImageInfoCache, ProcessPool, ThumbnailCache
+from lektor.builder import Artifact, Builder, WorkerBuilder
+from lektor.db import Database
+from lektor.environment import Environment
+from lektor.imagetools import get_image_info, compute_dimensions, \
+     get_thumbnail_backend, _parse_exif_orientation
 
 
 def almost_equal(a, b, e=0.00001):
@@ -91,6 +100,56 @@ def test_image_attributes(pad):
         assert image.format == 'jpeg'
 
 
+def test_image_info_cache(env, tmpdir, mocker):
+    mocker.patch.object(ImageInfoCache, 'racy_window', -1)
+    output = str(tmpdir.mkdir('output'))
+    expected = Database(env).new_pad().root.attachments.images \
+        .get('test.jpg').exif.to_dict()
+
+    def _check_image():
+        builder = Builder(Database(env).new_pad(), output)
+        with builder.pooled_connection():
+            image = builder.pad.root.attachments.images.get('test.jpg')
+            assert (image.format, image.width, image.height) == \
+                ('jpeg', 384, 512)
+            assert image.exif.to_dict() == expected
+
+    get_image_info = mocker.spy(lektor.buildcaches, 'get_image_info')
+    read_exif = mocker.spy(lektor.buildcaches, 'read_exif')
+    _check_image()
+    assert get_image_info.call_count == 1
+    assert read_exif.call_count == 1
+
+    # Fresh databases take everything from the cache.
+    _check_image()
+    assert get_image_info.call_count == 1
+    assert read_exif.call_count == 1
+
+
+def test_image_info_reads_only_orientation(pad, mocker):
+    process_file = mocker.spy(lektor.imagetools.exifread, 'process_file')
+    for img, rotated in (
+        ('test.jpg', True),
+        ('test-progressive.jpg', False),
+    ):
+        image = pad.root.attachments.images.get(img)
+        with open(image.attachment_filename, 'rb') as f:
+            assert get_image_info(f) == ('jpeg', 384, 512)
+        assert not process_file.called
+        assert image.exif.is_rotated == rotated
+        process_file.reset_mock()
+
+
+def test_exif_orientation_big_endian():
+    ifd = struct.pack('>H', 2) + \
+        struct.pack('>HHIHH', 0x010f, 2, 1, 0, 0) + \
+        struct.pack('>HHIHH', 0x0112, 3, 1, 8, 0)
+    data = b'Exif\x00\x00MM\x00*' + struct.pack('>I', 8) + ifd
+    assert _parse_exif_orientation(data) == 8
+    assert _parse_exif_orientation(data[:20]) is None
+    assert _parse_exif_orientation(b'http://ns.adobe.com/xap/1.0/') is None
+
+
 def test_image_info_svg_declaration(make_svg):
     w, h = 100, 100
     svg_with_xml_decl = make_svg(with_declaration=True, h=h, w=w)
@@ -184,6 +243,189 @@ def test_thumbnail_quality(builder):
     assert image_size < 9200
 
 
+def test_thumbnails_in_pool(builder, fake_convert, mocker):
+    submit = mocker.spy(ProcessPool, 'submit')
+
+    builder.thumbnail_pool = ProcessPool(4)
+    builder.build_all()
+    assert submit.called
+    for t in _THUMBNAILS:
+        assert os.path.isfile(os.path.join(builder.destination_path, t))
+    assert not [x for x in os.listdir(builder.destination_path)
+                if x.startswith('.__trans')]
+
+
+@pytest.mark.parametrize('pool_size', [None, 4])
+def test_failing_thumbnails_are_reported(builder, fake_convert, pool_size):
+    fake_convert.write('#!%s\nimport sys\nsys.exit(1)\n' % sys.executable)
+    if pool_size is not None:
+        builder.thumbnail_pool = ProcessPool(pool_size)
+
+    assert builder.build_all() > 0
+    if pool_size is not None:
+        # All thumbnails were started before the first failure showed.
+        for t in _THUMBNAILS:
+            assert builder.failure_controller.lookup_failure(t) is not None
+    for t in _THUMBNAILS:
+        assert not os.path.isfile(os.path.join(builder.destination_path, t))
+    assert not [x for x in os.listdir(builder.destination_path)
+                if x.startswith('.__trans')]
+
+
+def test_thumbnails_batched(builder, fake_convert, mocker):
+    popen = mocker.spy(lektor.imagetools, 'portable_popen')
+    builder.build_all()
+    sources = [c[0][0][1] for c in popen.call_args_list]
+    assert os.path.join(builder.env.root_path, 'content', 'test.jpg') \
+        in sources
+    # Every source image is decoded once for all its thumbnails.
+    assert len(sources) == len(set(sources))
+    for t in _THUMBNAILS:
+        assert os.path.isfile(os.path.join(builder.destination_path, t))
+
+
+def test_batched_thumbnails_written_by_their_artifacts(builder, fake_convert,
+                                                       mocker):
+    commit = Artifact._commit
+    committed = {}
+
+    def _commit(self):
+        committed[self.artifact_name] = (os.path.isfile(self.dst_filename),
+                                         self._new_artifact_file)
+        commit(self)
+    mocker.patch.object(Artifact, '_commit', _commit)
+
+    builder.build_all()
+    # Sibling thumbnails only show up when their own artifact commits.
+    for t in _THUMBNAILS:
+        existed, new_file = committed[t]
+        assert not existed
+        assert new_file is not None
+        assert os.path.isfile(os.path.join(builder.destination_path, t))
+
+
+def _temp_files(path):
+    return [name for _dirpath, _dirnames, filenames in os.walk(path)
+            for name in filenames if name.startswith('.__trans')]
+
+
+def test_partly_current_batch_leaves_no_temp_files(builder, fake_convert):
+    # Another worker built one of the thumbnails after the batch put it
+    # on its list, so that thumbnail is skipped as current.
+    builder.artifact_claims = {'test@192.jpg': ('built', -1)}
+    builder.build_all()
+    assert not os.path.isfile(
+        os.path.join(builder.destination_path, 'test@192.jpg'))
+    assert os.path.isfile(
+        os.path.join(builder.destination_path, 'test@x256.jpg'))
+    assert _temp_files(builder.destination_path) == []
+
+
+def test_thumbnail_cache(pad, tmpdir, fake_convert, mocker):
+    popen = mocker.spy(lektor.imagetools, 'portable_popen')
+    cache = ThumbnailCache(str(tmpdir.join('thumbnails')))
+
+    builder = Builder(pad, str(tmpdir.join('output')))
+    builder.thumbnail_cache = cache
+    builder.build_all()
+    assert popen.called
+
+    # A build into a fresh folder takes all thumbnails from the cache.
+    popen.reset_mock()
+    builder = Builder(pad, str(tmpdir.join('other-output')))
+    builder.thumbnail_cache = cache
+    builder.build_all()
+    assert popen.call_count == 0
+    for t in _THUMBNAILS:
+        with open(os.path.join(builder.destination_path, t), 'rb') as f:
+            assert f.read().startswith(b'\xff\xd8')
+
+
+def test_thumbnail_cache_rebuild_leaves_no_temp_files(pad, tmpdir,
+                                                      fake_convert):
+    cache = ThumbnailCache(str(tmpdir.join('thumbnails')))
+    output = str(tmpdir.join('output'))
+
+    # The second build state does not know the thumbnails, so they are
+    # taken from the cache on top of the same cached files.
+    for state in ('first', 'second'):
+        builder = Builder(pad, output,
+                          buildstate_path=str(tmpdir.join(state)))
+        builder.thumbnail_cache = cache
+        builder.build_all()
+    for t in _THUMBNAILS:
+        assert os.path.isfile(os.path.join(output, t))
+    assert _temp_files(output) == []
+    assert _temp_files(cache.path) == []
+
+
+def test_thumbnails_with_pillow(pad, tmpdir, mocker):
+    pytest.importorskip('PIL')
+    popen = mocker.spy(lektor.imagetools, 'portable_popen')
+    pad.db.config.values['THUMBNAIL_BACKEND'] = 'pillow'
+    builder = Builder(pad, str(tmpdir.join('output')))
+    builder.build_all()
+    assert popen.call_count == 0
+    for t, dimensions in _THUMBNAILS.items():
+        with open(os.path.join(builder.destination_path, t), 'rb') as f:
+            _format, width, height = get_image_info(f)
+            assert (width, height) == dimensions
+
+
+def test_process_pool(mocker):
+    popen = mocker.spy(lektor.buildcaches, 'portable_popen')
+    pool = ProcessPool(2)
+    finished = []
+    running = []
+
+    def _submit(code):
+        pool.submit([sys.executable, '-c', 'import sys; sys.exit(%d)' % code],
+                    finished.append)
+        running.append(len(pool._running))
+
+    for code in (0, 0, 1, 0):
+        _submit(code)
+    assert max(running) == 2
+    assert pool.join() == []
+    assert sorted(finished) == [0, 0, 0, 1]
+    assert popen.call_count == 4
+
+    def _fail(returncode):
+        raise RuntimeError('failed')
+    pool.submit([sys.executable, '-c', 'pass'], _fail)
+    failures = pool.join()
+    assert len(failures) == 1
+    assert failures[0][0] is None
+    assert failures[0][1][0] is RuntimeError
+    assert pool.join() == []
+
+
+def test_thumbnail_settings(scratch_project, tmpdir):
+    output = str(tmpdir.mkdir('output'))
+    pad = Database(Environment(scratch_project)).new_pad()
+    assert Builder(pad, output).thumbnail_pool is None
+    assert Builder(pad, output).thumbnail_cache is None
+    assert Builder(pad, output, jobs=3).thumbnail_pool.size == 3
+
+    with open(scratch_project.project_file, 'a') as f:
+        f.write('\n[env]\nthumbnail_jobs = 4\nthumbnail_cache = yes\n')
+    pad = Database(Environment(scratch_project)).new_pad()
+    builder = Builder(pad, output)
+    assert builder.thumbnail_pool.size == 4
+    assert builder.thumbnail_cache.path == \
+        scratch_project.get_thumbnail_cache_path()
+
+    # The workers of parallel builds share the thumbnail jobs.
+    assert WorkerBuilder(pad, output, jobs=2).thumbnail_pool.size == 2
+    assert WorkerBuilder(pad, output, jobs=4).thumbnail_pool is None
+
+
+def test_unknown_thumbnail_backend():
+    with pytest.raises(RuntimeError) as exc:
+        get_thumbnail_backend('missing')
+    assert 'imagemagick, pillow' in str(exc.value)
+
+
 # TODO: delete this when the thumbnails backwards-compatibility period ends
 @pytest.mark.skip(reason="future behaviour")
 def test_large_thumbnail_returns_original(builder):
@@ -0,0 +1,56 @@
+import io
+
+from lektor.metaformat import tokenize
+
+
+def _tokenize_lines(text, **kwargs):
+    return list(tokenize(io.BytesIO(text.encode('utf-8')).readlines(),
+                         encoding='utf-8', **kwargs))
+
+
+def test_tokenize_whole_buffer():
+    text = (
+        u'_model: page\r\n'
+        u'---\r\n'
+        u'title:   Hello  \r\n'
+        u'--- \n'
+        u'ignored line\n'
+        u'body:\n'
+        u'\n'
+        u'First line\n'
+        u'----\n'
+        u'with: colon\n'
+        u'\n'
+        u'---\n'
+        u'empty:'
+    )
+    expected = [
+        (u'_model', [u'page']),
+        (u'title', [u'Hello  ']),
+        (u'body', [u'First line\n', u'---\n', u'with: colon\n', u'']),
+        (u'empty', []),
+    ]
+    data = text.encode('utf-8')
+    assert list(tokenize(io.BytesIO(data), encoding='utf-8')) == expected
+    assert list(tokenize(data, encoding='utf-8')) == expected
+    assert list(tokenize(text)) == expected
+    assert _tokenize_lines(text) == expected
+
+
+def test_tokenize_interesting_keys():
+    text = u'a: 1\n---\nb:\n\nfoo\nbar\n---\nc: 3\n'
+    assert list(tokenize(text, interesting_keys=set(['b']))) == [
+        (u'a', None),
+        (u'b', [u'foo\n', u'bar']),
+        (u'c', None),
+    ]
+    assert _tokenize_lines(text, interesting_keys=set(['b'])) == \
+        list(tokenize(text, interesting_keys=set(['b'])))
+
+
+def test_tokenize_only_splits_on_newlines():
+    text = u'a: x y\n---\nb: 1\r2\n'
+    assert list(tokenize(text.encode('utf-8'), encoding='utf-8')) == [
+        (u'a', [u'x y']),
+        (u'b', [u'1\r2']),
+    ]
@@ -1,3 +1,8 @@
+import os
+
+from lektor.context import Context
+
+
 def test_paginated_children(pad):
     page1 = pad.get('/projects', page_num=1)
 
@@ -238,3 +243,46 @@ def test_virtual_path_behavior(pad):
     assert blog_page2.url_to('..', absolute=True) == '/'
     assert blog_page2.url_to('@1', absolute=True) == '/blog/'
     assert blog_page2.url_to('@3', absolute=True) == '/blog/page/3/'
+
+
+def test_prev_next_shares_sibling_index(pad, mocker):
+    bagpipe = pad.get('/projects/bagpipe')
+    assert bagpipe.get_siblings().prev_page['_id'] == 'coffee'
+    siblings, positions = pad.cache.get_index('siblings', '/projects', '_primary')
+    assert siblings[positions['/projects/bagpipe']] == \
+        ('/projects/bagpipe', '_primary')
+
+    # The other children of the parent reuse the index.
+    query = mocker.spy(pad.db.datamodels['projects'].pagination_config,
+                       'get_pagination_query')
+    oven = pad.get('/projects/oven')
+    assert oven.get_siblings().next_page['_id'] == 'postage'
+    assert query.call_count == 0
+
+
+def test_pages_share_materialized_items(pad, mocker):
+    config = pad.db.datamodels['projects'].pagination_config
+    query = mocker.spy(config, 'get_pagination_query')
+    page1 = pad.get('/projects', page_num=1)
+    page2 = pad.get('/projects', page_num=2)
+    assert page1.pagination.total == page2.pagination.total == 7
+    assert [x['_id'] for x in page2.pagination.items] == \
+        ['postage', 'slave', 'wolf']
+    assert query.call_count == 1
+
+    # Every iteration still records the dependencies of the items.
+    with Context(pad=pad) as ctx:
+        page2.pagination.items.all()
+    assert any(x.endswith(os.path.join('wolf', 'contents.lr'))
+               for x in ctx.referenced_dependencies)
+
+
+def test_pagination_build_uses_materialized_items(pad, builder, mocker):
+    config = pad.db.datamodels['projects'].pagination_config
+    query = mocker.spy(config, 'get_pagination_query')
+    prog, _ = builder.build(pad.get('/projects'))
+    children = list(prog.iter_child_sources())
+    assert len([x for x in children if x.page_num is not None]) == 2
+    for page in children[:2]:
+        builder.build(page)
+    assert query.call_count == 1
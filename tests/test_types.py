@@ -1,13 +1,18 @@
 import datetime
 
+import mistune
 from markupsafe import escape, Markup
 from babel.dates import get_timezone
 
 from lektor._compat import itervalues, text_type
+from lektor.builder import Builder
 from lektor.datamodel import Field
 from lektor.types.formats import MarkdownDescriptor
 from lektor.context import Context
 from lektor.types import Undefined, BadValue
+from lektor.markdown import markdown_to_html, make_markdown, \
+    _get_config_hash
+from lektor.pluginsystem import Plugin
 
 
 class DummySource(object):
@@ -357,3 +362,58 @@ def test_datetime_timezone_name(env, pad):
         assert rv.minute == 2
         assert rv.second == 3
         assert rv.tzinfo._offset == datetime.timedelta(0, 9 * 60 * 60)
+
+
+def test_markdown_render_cache(pad, builder, mocker):
+    # The cache is off unless the project configures a size for it.
+    assert builder.markdown_cache is None
+    pad.db.config.values['MARKDOWN_CACHE_SIZE'] = '10000'
+    builder = Builder(pad, builder.destination_path)
+
+    parse = mocker.spy(mistune.Markdown, 'parse')
+    post = pad.get('/blog/post1')
+
+    def render(builder, base_url='/'):
+        with builder.new_build_state() as build_state:
+            ctx = Context(pad=pad)
+            ctx.build_state = build_state
+            with ctx, ctx.changed_base_url(base_url):
+                return markdown_to_html(u'[x](hello.txt)', record=post)
+
+    html, meta = render(builder)
+    assert 'blog/2015/12/post1/hello.txt' in html
+    assert parse.call_count == 1
+
+    # Another builder on the same build state reuses the HTML.
+    other = Builder(pad, builder.destination_path)
+    assert render(other) == (html, {})
+    assert parse.call_count == 1
+
+    # The HTML depends on the URL it is rendered for.
+    assert render(other, '/blog/') != (html, {})
+    assert parse.call_count == 2
+
+    other.markdown_cache.size = 1
+    other.markdown_cache.prune()
+    con = other.connect_to_database()
+    try:
+        assert con.execute('select count(*) from markdown_cache') \
+            .fetchone()[0] == 1
+    finally:
+        con.close()
+
+
+def test_markdown_config_hash_covers_plugin_config(scratch_env, tmpdir):
+    class MarkdownPlugin(Plugin):
+        version = '1.0'
+
+        def on_markdown_config(self, config, **extra):
+            pass
+
+    scratch_env.plugin_controller.instanciate_plugin('md', MarkdownPlugin)
+    md = make_markdown(scratch_env)
+    before = _get_config_hash(scratch_env, md)
+
+    tmpdir.join('scratch-proj', 'configs', 'md.ini').write(
+        'option = yes\n', ensure=True)
+    assert _get_config_hash(scratch_env, md) != before
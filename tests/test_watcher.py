@@ -1,5 +1,6 @@
 import functools
 import py
+from watchdog.events import FileMovedEvent
 
 from lektor import utils
 from lektor import watcher
@@ -22,3 +23,48 @@ def test_is_interesting(env):
 
     w.output_path = None
     assert is_interesting(str(build_dir / "output.file"))
+
+
+def test_moves_report_both_paths(env):
+    w = watcher.Watcher(env)
+    w.event_handler.on_any_event(FileMovedEvent('old.file', 'new.file'))
+    changes = w.iter_changes(window=0.01)
+    assert next(changes) == set(["old.file", "new.file"])
+
+
+def test_iter_changes(env):
+    w = watcher.Watcher(env)
+    queue = w.event_handler.queue
+    queue.put((0, "modified", "a.file"))
+    queue.put((0, "modified", ".file"))
+    queue.put((0, "created", "b.file"))
+    queue.put((0, "modified", "a.file"))
+
+    changes = w.iter_changes(window=0.01)
+    assert next(changes) == set(["a.file", "b.file"])
+
+    queue.put((0, "deleted", "c.file"))
+    assert next(changes) == set(["c.file"])
+
+
+def test_iter_changes_max_latency(env, mocker):
+    w = watcher.Watcher(env)
+    clock = mocker.patch('lektor.watcher.time')
+    clock.time.return_value = 0
+
+    # Events keep coming in, but the batch is due after max_latency.
+    def get(timeout=None):
+        clock.time.return_value += 1
+        return (0, "modified", "%d.file" % clock.time.return_value)
+    mocker.patch.object(w.event_handler.queue, 'get', side_effect=get)
+
+    changes = next(w.iter_changes(window=10, max_latency=3))
+    assert changes == set(["1.file", "2.file", "3.file", "4.file"])
+
+
+def test_is_uninteresting_source_name(env):
+    w = watcher.Watcher(env)
+    for filename in ("a.file", ".file", "_file", ".htaccess",
+                     "_include_me_despite_underscore", "foo-prefix-x"):
+        assert w.is_uninteresting_source_name(filename) == \
+            env.is_uninteresting_source_name(filename)
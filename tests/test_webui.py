@@ -1,4 +1,5 @@
 import os
+import threading
 
 import flask
 import pytest
@@ -55,3 +56,34 @@ def test_index_html(tmpdir, env):
     assert resolve('/empty') == (None, artifact_path)
     artifact_path = os.path.join(info.output_path, 'doesnt_exist')
     assert resolve('/doesnt_exist') == (None, artifact_path)
+
+
+def test_requests_hold_the_pad_lock_while_using_it(tmpdir, env):
+    webadmin = WebAdmin(env, output_path=str(tmpdir.mkdir("webadmin")))
+    lock = webadmin.lektor_info.pad_lock
+
+    def acquired_elsewhere():
+        rv = []
+
+        def acquire():
+            rv.append(lock.acquire(False))
+            if rv[0]:
+                lock.release()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        return rv[0]
+
+    @webadmin.route('/_test_lock')
+    def check_lock():  # pylint: disable=unused-variable
+        before = acquired_elsewhere()
+        assert flask.g.admin_context.pad is webadmin.lektor_info.get_pad()
+        return '%s %s' % (before, acquired_elsewhere())
+
+    client = webadmin.test_client()
+    assert client.get('/_test_lock').data == b'True False'
+    assert acquired_elsewhere()
+
+    # Serving the output builds with the pad but does not keep the lock.
+    assert client.get('/').status_code == 200
+    assert acquired_elsewhere()